@@ -0,0 +1,213 @@
+"""
+Benchmark the opal_release_downloader commands against a local S3 stand-in.
+
+Every command runs in its own process, as a user would run it, and is
+measured for wall time, bytes moved, requests made to the stand-in and peak
+resident memory. Results are printed as a table and can be written as JSON
+for tracking trends between commits:
+
+    python benchmarks/bench.py --json results.json
+
+See benchmarks/README.md for the options.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from opal_release_downloader.fetch import parse_size
+from s3_stand_in import Bucket, StandIn, seed
+
+BUCKET = "opal-bench"
+
+
+def run_command(name, args, *, cwd, env, server, nbytes=0):
+    """
+    Run one command in a child process and return its measurements.
+    """
+    requests_before = server.requests
+    with tempfile.TemporaryFile() as log:
+        start = time.monotonic()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "opal_release_downloader", *args],
+            cwd=cwd,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        # wait4 gives the rusage of this child alone
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.monotonic() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            log.seek(0)
+            output = log.read().decode(errors="replace")
+            raise RuntimeError(f"{name} failed ({proc.returncode}):\n{output[-2000:]}")
+
+    requests = server.requests - requests_before
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "name": name,
+        "args": args,
+        "wall_s": round(wall, 3),
+        "bytes": nbytes,
+        "mb_per_s": round(nbytes / 1e6 / wall, 2) if nbytes else None,
+        "requests": requests,
+        "requests_per_s": round(requests / wall, 2),
+        "peak_rss_mb": round(rusage.ru_maxrss * scale / 1e6, 1),
+    }
+
+
+def tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            if not f.startswith("."):
+                total += os.path.getsize(os.path.join(dirpath, f))
+    return total
+
+
+def run_benchmarks(args) -> dict:
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "opal-bench-data")
+    print(f"seeding {data_dir}", file=sys.stderr)
+    params = seed(
+        data_dir,
+        small_count=args.small_count,
+        small_size=args.small_size,
+        large_count=args.large_count,
+        large_size=args.large_size,
+        docker_size=args.docker_size,
+        rhel_size=args.rhel_size,
+    )
+    tag = params["tag"]
+
+    server = StandIn(Bucket(BUCKET, data_dir))
+    server.start()
+    work = tempfile.mkdtemp(prefix="opal-bench-")
+    env = dict(
+        os.environ,
+        AWS_ENDPOINT_URL=server.endpoint_url,
+        # keep the release index out of the measurements
+        XDG_CACHE_HOME=os.path.join(work, "cache"),
+    )
+    jobs = ["-j", str(args.jobs)]
+    backend = ["--backend", args.backend]
+
+    release_bytes = tree_size(os.path.join(data_dir, tag))
+    all_bytes = tree_size(data_dir)
+    results = []
+    try:
+        for _ in range(args.repeat):
+            out = tempfile.mkdtemp(dir=work)
+            results.append(
+                run_command("list", ["list", BUCKET], cwd=out, env=env, server=server)
+            )
+            results.append(
+                run_command(
+                    "list_all",
+                    ["list", BUCKET, "--all"],
+                    cwd=out,
+                    env=env,
+                    server=server,
+                )
+            )
+            results.append(
+                run_command(
+                    "fetch",
+                    ["fetch", BUCKET, tag, "--dest", "images", *jobs, *backend],
+                    cwd=out,
+                    env=env,
+                    server=server,
+                    nbytes=release_bytes,
+                )
+            )
+            results.append(
+                run_command(
+                    "verify",
+                    ["verify", "images", "--search", "--rehash", *jobs],
+                    cwd=out,
+                    env=env,
+                    server=server,
+                    nbytes=release_bytes,
+                )
+            )
+            results.append(
+                run_command(
+                    "download",
+                    [BUCKET, tag, *jobs, *backend, *args.download_args],
+                    cwd=out,
+                    env=env,
+                    server=server,
+                    nbytes=all_bytes,
+                )
+            )
+            shutil.rmtree(out)
+    finally:
+        server.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "jobs": args.jobs,
+        "backend": args.backend,
+        "release": params,
+        "results": results,
+    }
+
+
+def print_table(report: dict):
+    print(
+        f"{'command':<10} {'wall s':>8} {'MB/s':>9} {'requests':>9} "
+        f"{'req/s':>9} {'peak RSS MB':>12}"
+    )
+    for r in report["results"]:
+        mb_per_s = "-" if r["mb_per_s"] is None else f"{r['mb_per_s']:.1f}"
+        print(
+            f"{r['name']:<10} {r['wall_s']:>8.2f} {mb_per_s:>9} {r['requests']:>9} "
+            f"{r['requests_per_s']:>9.1f} {r['peak_rss_mb']:>12.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser("bench")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument(
+        "--data-dir",
+        help="where to keep the synthetic release (reused between runs)",
+    )
+    parser.add_argument("--jobs", "-j", type=int, default=4)
+    parser.add_argument("--backend", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--small-count", type=int, default=200)
+    parser.add_argument("--small-size", type=parse_size, default="64KiB")
+    parser.add_argument("--large-count", type=int, default=3)
+    parser.add_argument("--large-size", type=parse_size, default="2GiB")
+    parser.add_argument("--docker-size", type=parse_size, default="256MiB")
+    parser.add_argument("--rhel-size", type=parse_size, default="1GiB")
+    parser.add_argument(
+        "download_args",
+        nargs=argparse.REMAINDER,
+        help="extra arguments for download_opal_artifacts, after --",
+    )
+    args = parser.parse_args()
+    if args.download_args[:1] == ["--"]:
+        args.download_args = args.download_args[1:]
+
+    report = run_benchmarks(args)
+    print_table(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
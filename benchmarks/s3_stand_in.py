@@ -0,0 +1,334 @@
+"""
+A minimal S3-compatible server for benchmarking, serving one directory tree
+as one bucket.
+
+It implements just what opal_release_downloader uses against a public
+bucket: ListObjectsV2 (prefix, delimiter, pagination), HeadObject and
+GetObject (Range, If-Match). Objects are streamed from disk, so multi-GB
+sparse files cost neither memory nor time to serve, and every request is
+counted so the benchmark can report requests per second.
+"""
+
+import datetime
+import email.utils
+import functools
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import threading
+import urllib.parse
+
+from xml.sax.saxutils import escape
+
+# ListObjectsV2 page size, as on S3
+MAX_KEYS = 1000
+# sidecar with the md5 of every object, written by seed()
+ETAGS = ".etags.json"
+COPY_BLOCK = 1024 * 1024
+
+
+def _http_date(ts: float) -> str:
+    return email.utils.formatdate(ts, usegmt=True)
+
+
+def _iso_date(ts: float) -> str:
+    dt = datetime.datetime.fromtimestamp(int(ts), tz=datetime.timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class Bucket:
+    def __init__(self, name: str, root: str):
+        self.name = name
+        self.root = root
+        with open(os.path.join(root, ETAGS)) as f:
+            self.etags = json.load(f)
+        self.keys = sorted(self.etags)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def list_objects(
+        self, prefix="", delimiter=None, start_after="", max_keys=MAX_KEYS
+    ):
+        contents = []
+        prefixes = []
+        truncated = False
+        last = None
+        for key in self.keys:
+            if not key.startswith(prefix) or key <= start_after:
+                continue
+            if len(contents) + len(prefixes) >= max_keys:
+                truncated = True
+                break
+
+            rest = key[len(prefix) :]
+            if delimiter and delimiter in rest:
+                common = prefix + rest.split(delimiter)[0] + delimiter
+                if prefixes and prefixes[-1] == common:
+                    continue
+                prefixes.append(common)
+                # skip the rest of this prefix on the next page
+                last = common + "\uffff"
+                continue
+            contents.append(key)
+            last = key
+        return contents, prefixes, truncated, last
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "s3-stand-in"
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self):
+        with self.server.lock:
+            self.server.requests += 1
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        body = f"<Error><Code>{code}</Code></Error>".encode()
+        self._send(status, body, {"Content-Type": "application/xml"})
+
+    def _route(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.lstrip("/").split("/", 1)
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        if parts[0] != self.server.bucket.name:
+            return None, None, query
+        key = urllib.parse.unquote(parts[1]) if len(parts) > 1 else ""
+        return self.server.bucket, key, query
+
+    def do_GET(self):
+        self._count()
+        bucket, key, query = self._route()
+        if bucket is None:
+            return self._error(404, "NoSuchBucket")
+        if not key:
+            return self._list(bucket, query)
+        return self._object(bucket, key)
+
+    def do_HEAD(self):
+        self._count()
+        bucket, key, _ = self._route()
+        if bucket is None or not key:
+            return self._error(404, "NoSuchBucket")
+        return self._object(bucket, key)
+
+    def _list(self, bucket, query):
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter") or None
+        start_after = query.get("continuation-token") or query.get("start-after", "")
+        max_keys = min(int(query.get("max-keys", MAX_KEYS)), MAX_KEYS)
+        contents, prefixes, truncated, last = bucket.list_objects(
+            prefix, delimiter, start_after, max_keys
+        )
+
+        xml = ['<?xml version="1.0" encoding="UTF-8"?>']
+        xml.append('<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">')
+        xml.append(f"<Name>{escape(bucket.name)}</Name>")
+        xml.append(f"<Prefix>{escape(prefix)}</Prefix>")
+        if delimiter:
+            xml.append(f"<Delimiter>{escape(delimiter)}</Delimiter>")
+        xml.append(f"<MaxKeys>{max_keys}</MaxKeys>")
+        xml.append(f"<KeyCount>{len(contents) + len(prefixes)}</KeyCount>")
+        xml.append(f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>")
+        if truncated:
+            xml.append(f"<NextContinuationToken>{escape(last)}</NextContinuationToken>")
+        for key in contents:
+            st = os.stat(bucket.path(key))
+            xml.append(
+                "<Contents>"
+                f"<Key>{escape(key)}</Key>"
+                f"<LastModified>{_iso_date(st.st_mtime)}</LastModified>"
+                f"<ETag>&quot;{bucket.etags[key]}&quot;</ETag>"
+                f"<Size>{st.st_size}</Size>"
+                "<StorageClass>STANDARD</StorageClass>"
+                "</Contents>"
+            )
+        for p in prefixes:
+            xml.append(f"<CommonPrefixes><Prefix>{escape(p)}</Prefix></CommonPrefixes>")
+        xml.append("</ListBucketResult>")
+
+        self._send(200, "".join(xml).encode(), {"Content-Type": "application/xml"})
+
+    def _object(self, bucket, key):
+        if key not in bucket.etags:
+            return self._error(404, "NoSuchKey")
+
+        path = bucket.path(key)
+        st = os.stat(path)
+        etag = f'"{bucket.etags[key]}"'
+        if_match = self.headers.get("If-Match")
+        if if_match is not None and if_match not in ("*", etag):
+            return self._error(412, "PreconditionFailed")
+
+        start, end = 0, st.st_size - 1
+        status = 200
+        headers = {
+            "ETag": etag,
+            "Last-Modified": _http_date(st.st_mtime),
+            "Accept-Ranges": "bytes",
+            "Content-Type": "application/octet-stream",
+        }
+        byte_range = self.headers.get("Range")
+        if byte_range is not None and byte_range.startswith("bytes="):
+            first, _, last = byte_range[len("bytes=") :].partition("-")
+            start = int(first)
+            if last:
+                end = min(int(last), st.st_size - 1)
+            if start > end:
+                return self._error(416, "InvalidRange")
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+
+        length = end - start + 1
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            while length > 0:
+                block = f.read(min(COPY_BLOCK, length))
+                if not block:
+                    break
+                self.wfile.write(block)
+                length -= len(block)
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bucket: Bucket, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.bucket = bucket
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def endpoint_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _write_sparse(path: str, size: int):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _write_random(path: str, size: int, seed: int):
+    # deterministic content, so a seeded tree can be reused between runs
+    block = hashlib.sha256(str(seed).encode()).digest() * (size // 32 + 1)
+    with open(path, "wb") as f:
+        f.write(block[:size])
+
+
+@functools.lru_cache(maxsize=None)
+def _md5(path: str) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def seed(
+    root: str,
+    *,
+    tag="2023.01.02",
+    small_count=200,
+    small_size=64 * 1024,
+    large_count=3,
+    large_size=2 * 1024**3,
+    docker_size=256 * 1024**2,
+    rhel_size=1024**3,
+) -> dict:
+    """
+    Lay out an OPAL-shaped release under root: a release tag with many
+    small files, several large sparse images, an md5sums file and a
+    manifest, plus the unpacker scripts, docker and RHEL artifacts.
+
+    A tree seeded earlier with the same parameters is reused as is.
+    """
+    params = dict(
+        tag=tag,
+        small_count=small_count,
+        small_size=small_size,
+        large_count=large_count,
+        large_size=large_size,
+        docker_size=docker_size,
+        rhel_size=rhel_size,
+    )
+    params_path = os.path.join(root, ".params.json")
+    if os.path.exists(os.path.join(root, ETAGS)):
+        with open(params_path) as f:
+            if json.load(f) == params:
+                return params
+        shutil.rmtree(root)
+
+    release = os.path.join(root, tag)
+    for d in (release, "unpacker", "docker", "redhat-iso"):
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    names = []
+    for i in range(small_count):
+        names.append(f"small_{i:04}.tar.gz")
+        _write_random(os.path.join(release, names[-1]), small_size, i)
+    for i in range(large_count):
+        names.append(f"image_{i:02}.tar.gz")
+        _write_sparse(os.path.join(release, names[-1]), large_size)
+
+    manifest = f"file_manifest_{tag}.yml"
+    with open(os.path.join(release, manifest), "w") as f:
+        f.writelines(f"- {n}\n" for n in names + [manifest])
+    names.append(manifest)
+    with open(os.path.join(release, f"md5sums_{tag}"), "w") as f:
+        f.writelines(f"{_md5(os.path.join(release, n))}  {n}\n" for n in names)
+
+    for script in ("unpacker.sh", "install-opal.sh"):
+        with open(os.path.join(root, "unpacker", script), "w") as f:
+            f.write("#!/bin/sh\n")
+    for d, name, size in (
+        ("docker", "docker.tgz", docker_size),
+        ("redhat-iso", "rhel.iso", rhel_size),
+    ):
+        _write_sparse(os.path.join(root, d, name), size)
+        with open(os.path.join(root, d, "md5checksum"), "w") as f:
+            f.write(f"{_md5(os.path.join(root, d, name))}  {name}\n")
+
+    etags = {}
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            key = os.path.relpath(path, root).replace(os.sep, "/")
+            if not key.startswith("."):
+                etags[key] = _md5(path)
+    with open(os.path.join(root, ETAGS), "w") as f:
+        json.dump(etags, f)
+    with open(params_path, "w") as f:
+        json.dump(params, f)
+    return params
@@ -1,37 +1,29 @@
+import importlib
 import sys
 import os
 
-from .list import main as list_main
-from .fetch import main as fetch_main
-from .verify import main as verify_main
-from .download import main as dl_main
 
-
-def main():
+def _run(module: str, argv: list):
+    # import only the subcommand being run, so that e.g. verify does not
+    # pay for loading boto3
     this_dir = os.path.dirname(__file__)
+    sys.argv = [os.path.join(this_dir, f"{module}.py"), *argv]
+    importlib.import_module(f".{module}", __package__).main()
 
+
+def main():
     if len(sys.argv) <= 1:
-        sys.argv = [os.path.join(this_dir, "download.py")]
-        dl_main()
+        _run("download", [])
         return
 
     cmdstr = sys.argv[1].lower()
-    subcmds = {
-        "list": {"filename": "list.py", "main": list_main},
-        "fetch": {"filename": "fetch.py", "main": fetch_main},
-        "verify": {"filename": "verify.py", "main": verify_main},
-    }
+    subcmds = ("list", "fetch", "verify")
 
     if cmdstr in subcmds:
-        cmd = subcmds[cmdstr]
-        fname = os.path.join(this_dir, cmd["filename"])
-        sys.argv = [fname, *sys.argv[2:]]
-        cmd["main"]()
+        _run(cmdstr, sys.argv[2:])
 
     else:
-        fname = os.path.join(this_dir, "download.py")
-        sys.argv = [fname, *sys.argv[1:]]
-        dl_main()
+        _run("download", sys.argv[1:])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+import asyncio
+import os
+
+import aiohttp
+
+from . import _metrics
+from ._display import progress, write
+from ._etag import etag_hasher
+from ._throttle import check_cancelled, throttle_delay
+from ._transfer import Checkpoint, HashingWriter, finish_download
+
+# bytes handed to the writer at a time
+CHUNK_SIZE = 1024 * 1024
+# seconds a connection may sit idle mid-download before it is abandoned
+READ_TIMEOUT = 300
+# times a download is resumed after a connection error or a RETRY_STATUSES
+# response, waiting RETRY_DELAY seconds before the first retry and twice as
+# long before each one after
+RETRIES = 3
+RETRY_DELAY = 1.0
+# transient server-side failures, which S3 asks clients to retry
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class ServerError(RuntimeError):
+    """An HTTP status in RETRY_STATUSES; the download is retried."""
+
+
+def object_url(s3_client, bucket_name: str, key: str) -> str:
+    """
+    The plain https url of an object, built by botocore so it uses the same
+    endpoint and addressing style as s3_client. The client is unsigned, so
+    the url carries no signature.
+    """
+    return s3_client.generate_presigned_url(
+        "get_object", Params={"Bucket": bucket_name, "Key": key}
+    )
+
+
+async def download_object(
+    session: aiohttp.ClientSession, url: str, s3_item: dict, local_name: str, tq
+) -> str:
+    """
+    Stream one object into local_name with a single GET and return its md5.
+
+    notes:
+    Like fetch.s3_download_with_progress this writes to a .part file,
+    resumes it from its checkpoint with a ranged GET, and only renames it
+    into place once the whole object has arrived. A connection error or a
+    5xx response (see RETRY_STATUSES) resumes the download from where it
+    stopped, up to RETRIES times.
+
+    Hashing and file writes run on a worker thread, so that other downloads
+    on the event loop are not held up by them, e.g. while the kept part of
+    a multi-GB .part file is hashed again.
+    """
+    checkpoint = Checkpoint(local_name, s3_item)
+    offset = checkpoint.load()
+    if offset:
+        _metrics.count("download_resumed")
+        write(f"Resuming download of {os.path.basename(local_name)} at byte {offset}")
+
+    with _metrics.timed(
+        "download", s3_item["Key"], nbytes=s3_item["Size"] - offset
+    ), open(checkpoint.part_name, "r+b" if offset else "wb") as f:
+        writer = HashingWriter(f, checkpoint=checkpoint, etag=etag_hasher(s3_item))
+        try:
+            if offset:
+                await asyncio.to_thread(writer.update_from, f, offset)
+                f.seek(offset)
+                f.truncate()
+                tq.update(offset)
+
+            retries = 0
+            while checkpoint.completed < s3_item["Size"]:
+                try:
+                    await _get(session, url, s3_item, checkpoint.completed, writer, tq)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ServerError) as e:
+                    if retries == RETRIES:
+                        raise
+                    _metrics.count("download_retried")
+                    await asyncio.sleep(RETRY_DELAY * 2**retries)
+                    retries += 1
+                    write(
+                        f"Retrying download of {os.path.basename(local_name)} "
+                        f"at byte {checkpoint.completed} after: {e}"
+                    )
+        except BaseException:
+            # keep what made it to disk for the next run
+            f.flush()
+            checkpoint.save()
+            raise
+
+    if checkpoint.completed != s3_item["Size"]:
+        raise RuntimeError(
+            f"received {checkpoint.completed} of {s3_item['Size']} bytes"
+        )
+
+    finish_download(local_name, s3_item, checkpoint, writer)
+    return writer.hexdigest()
+
+
+async def _get(session, url: str, s3_item: dict, offset: int, writer, tq):
+    headers = {}
+    if s3_item.get("ETag"):
+        # fail rather than splice together two versions of the object
+        headers["If-Match"] = s3_item["ETag"]
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    async with session.get(url, headers=headers) as resp:
+        if resp.status in RETRY_STATUSES:
+            raise ServerError(f"HTTP {resp.status} {resp.reason}")
+        if resp.status != (206 if offset else 200):
+            raise RuntimeError(f"HTTP {resp.status} {resp.reason}")
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            check_cancelled()
+            await asyncio.to_thread(writer.write, chunk)
+            tq.update(len(chunk))
+            delay = throttle_delay(len(chunk))
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+async def _download_objects(
+    s3_client, bucket_name: str, downloads: list, jobs: int, on_complete
+) -> dict:
+    digests = {}
+    failures = []
+    semaphore = asyncio.Semaphore(jobs)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=READ_TIMEOUT)
+
+    total = sum(s3_item["Size"] for s3_item, _ in downloads)
+    with progress("downloading", total) as tq:
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=jobs), timeout=timeout
+        ) as session:
+
+            async def _download(s3_item, local_name):
+                async with semaphore:
+                    if failures:
+                        return
+                    url = object_url(s3_client, bucket_name, s3_item["Key"])
+                    try:
+                        digest = await download_object(
+                            session, url, s3_item, local_name, tq
+                        )
+                    except Exception as e:
+                        failures.append(
+                            RuntimeError(f"download of {s3_item['Key']} failed: {e}")
+                        )
+                        return
+
+                digests[local_name] = digest
+                if on_complete is not None:
+                    on_complete(local_name, digest)
+                write(f"Downloaded {os.path.basename(local_name)}")
+
+            await asyncio.gather(*(_download(it, ln) for it, ln in downloads))
+
+    if failures:
+        raise failures[0]
+    return digests
+
+
+def download_objects(
+    s3_client, bucket_name: str, downloads: list, *, jobs=1, on_complete=None
+) -> dict:
+    """
+    Download a list of (s3_item, local_name) pairs on one event loop, with
+    up to `jobs` requests in flight, and return a dict of local_name to md5
+    hex digest. Behaves like fetch.download_objects otherwise.
+
+    notes:
+    Every object is one streamed GET, so this suits many small files on a
+    high-latency link; fetch.download_objects splits large objects into
+    parts and is the better choice for those.
+    """
+    return asyncio.run(
+        _download_objects(s3_client, bucket_name, downloads, max(1, jobs), on_complete)
+    )
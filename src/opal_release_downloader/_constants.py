@@ -1 +1,43 @@
 DEFAULT_REGION = "us-gov-west-1"
+
+# boto3 is only installed with the s3 extra, so that verify_opal_artifacts
+# can be installed on its own on an offline machine
+S3_EXTRA_HINT = (
+    "listing and downloading artifacts needs boto3; install it with "
+    "pip install opal_release_downloader[s3]"
+)
+
+# botocore's default pool size
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+# multipart downloads use parts of at least MIN_PART_SIZE bytes and, unless
+# told otherwise, at most MAX_AUTO_CONCURRENCY parts in flight per object
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_AUTO_CONCURRENCY = 16
+
+# parts of a download that arrive ahead of the one being written wait in
+# memory (see _transfer.HashingWriter); unless told otherwise, each download
+# keeps at most about DOWNLOAD_BUFFER_SIZE bytes of them, and part sizes are
+# chosen so that this still leaves MIN_AUTO_CONCURRENCY parts in flight
+DOWNLOAD_BUFFER_SIZE = 32 * 1024 * 1024
+MIN_AUTO_CONCURRENCY = 4
+
+# bytes fetched in all to measure throughput for a plan, however many
+# connections share them
+PROBE_BYTES = 16 * 1024 * 1024
+
+# downloads are written to <name>.part and renamed into place when complete;
+# <name>.part.json records how much of the .part file is usable on resume
+PART_SUFFIX = ".part"
+CHECKPOINT_SUFFIX = ".part.json"
+
+# every fetched directory keeps a record of what was downloaded into it, and
+# every verified directory a cache of the digests computed for it; both are
+# bookkeeping, not artifacts, so verification ignores them
+FETCH_RECORD = ".opal_fetch.json"
+VERIFY_CACHE = ".opal_verify_cache.json"
+STATE_FILES = (FETCH_RECORD, VERIFY_CACHE)
+
+# the command line tools keep bucket listings in a local index and trust
+# them for this many seconds before listing the bucket again
+DEFAULT_INDEX_TTL = 15 * 60
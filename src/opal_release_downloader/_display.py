@@ -1,9 +1,25 @@
 import io
+import queue
+import shutil
 import sys
+import threading
+import time
 
 from contextlib import contextmanager
 
 import colorama
+import tqdm
+
+# seconds between redraws of the dashboard on a terminal, and between the
+# plain progress lines written instead when progress goes to a log
+REFRESH_INTERVAL = 0.25
+LOG_INTERVAL = 10.0
+
+# active transfers listed under the dashboard's aggregate bar
+MAX_ACTIVE = 8
+
+# set by display() when per-file bars are replaced by a Dashboard
+_dashboard = None
 
 
 def init():
@@ -12,32 +28,370 @@ def init():
 
 def fini():
     colorama.deinit()
-    sys.stderr.write(colorama.Style.RESET_ALL)
-    sys.stderr.flush()
-    sys.stdout.write(colorama.Style.RESET_ALL)
-    sys.stdout.flush()
+    # only terminals need resetting; a reset code would corrupt json output
+    # that is piped or redirected
+    for stream in (sys.stderr, sys.stdout):
+        if stream.isatty():
+            stream.write(colorama.Style.RESET_ALL)
+        stream.flush()
+
+
+@contextmanager
+def _suspended():
+    if _dashboard is None:
+        yield
+    else:
+        with _dashboard.suspend():
+            yield
 
 
 def warn(*args, **kwargs):
     s = io.StringIO()
     s.write(*args, **kwargs)
-    sys.stdout.write(colorama.Fore.YELLOW + s.getvalue())
-    sys.stdout.write(colorama.Style.RESET_ALL + "\n")
-    sys.stdout.flush()
+    with _suspended():
+        sys.stdout.write(colorama.Fore.YELLOW + s.getvalue())
+        sys.stdout.write(colorama.Style.RESET_ALL + "\n")
+        sys.stdout.flush()
 
 
 def error(*args, **kwargs):
     s = io.StringIO()
     s.write(*args, **kwargs)
-    sys.stderr.write(colorama.Fore.RED + s.getvalue())
-    sys.stderr.write(colorama.Style.RESET_ALL + "\n")
-    sys.stderr.flush()
+    with _suspended():
+        sys.stderr.write(colorama.Fore.RED + s.getvalue())
+        sys.stderr.write(colorama.Style.RESET_ALL + "\n")
+        sys.stderr.flush()
+
+
+def write(s: str):
+    """
+    Print a line without breaking up the progress bars or dashboard.
+    """
+    if _dashboard is None:
+        tqdm.tqdm.write(s)
+        return
+    with _dashboard.suspend():
+        sys.stdout.write(s + "\n")
+        sys.stdout.flush()
+
+
+class ProgressSlots:
+    """
+    Hands out fixed tqdm line positions to worker threads, so that
+    concurrent progress bars do not draw over one another.
+    """
+
+    def __init__(self, count: int):
+        self._free = queue.Queue()
+        for i in range(count):
+            self._free.put(i)
+
+    @contextmanager
+    def slot(self):
+        position = self._free.get()
+        try:
+            yield position
+        finally:
+            self._free.put(position)
+
+
+class Transfer:
+    """
+    The progress of one file on a Dashboard. update is called by the threads
+    moving the data and only adds to a counter; all formatting and output is
+    left to the dashboard's render thread.
+    """
+
+    def __init__(self, desc: str, total: int, initial: int = 0):
+        self.desc = desc
+        self.total = total
+        self.initial = initial
+        self.n = initial
+        self.start = time.monotonic()
+        # only shared by the threads moving this one file
+        self._lock = threading.Lock()
+
+    def update(self, n: int = 1):
+        with self._lock:
+            self.n += n
+
+
+class Dashboard:
+    """
+    One aggregate progress bar for every file being transferred or hashed,
+    followed by a bar for each of up to max_active of them, redrawn by a
+    render thread every REFRESH_INTERVAL seconds.
+
+    notes:
+    If stream is not a terminal, a plain progress line is written every
+    LOG_INTERVAL seconds instead.
+
+    The render thread is started by the first transfer, so a dashboard
+    that is never used writes nothing.
+    """
+
+    def __init__(self, stream=None, interval=None, max_active=MAX_ACTIVE):
+        self._stream = sys.stderr if stream is None else stream
+        self._tty = self._stream.isatty()
+        if interval is None:
+            interval = REFRESH_INTERVAL if self._tty else LOG_INTERVAL
+        self._interval = interval
+        self._max_active = max_active
+
+        # guards everything below as well as writes to the terminal
+        self._lock = threading.RLock()
+        self._active = []
+        self._files = 0
+        self._finished = 0
+        self._total = 0
+        self._initial = 0
+        self._done = 0
+        self._start = None
+        self._rate = None
+        self._last = None
+        self._logged = None
+        self._lines = 0
+        self._suspended = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @contextmanager
+    def transfer(self, desc: str, total: int, initial: int = 0):
+        t = Transfer(desc, total, initial)
+        with self._lock:
+            if self._thread is None:
+                self._start = time.monotonic()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._active.append(t)
+            self._files += 1
+            self._total += total
+            self._initial += initial
+        try:
+            yield t
+        finally:
+            with self._lock:
+                self._active.remove(t)
+                self._finished += 1
+                self._done += t.n
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.render()
+
+    def render(self):
+        with self._lock:
+            if self._tty:
+                self._clear()
+                self._draw()
+            else:
+                self._log()
+
+    def close(self):
+        """
+        Stop the render thread and leave the final totals on screen.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            if self._tty:
+                self._clear()
+                # the totals are left with the average rate rather than the
+                # recent one
+                moved = self._done - self._initial
+                self._rate = moved / max(time.monotonic() - self._start, 1e-9)
+                self._last = None
+                self._stream.write(self._lines_now()[0] + "\n")
+                self._stream.flush()
+            else:
+                self._log(final=True)
+
+    @contextmanager
+    def suspend(self):
+        """
+        Take the dashboard off the terminal while the with block prints
+        something, then draw it again below that.
+        """
+        with self._lock:
+            self._suspended += 1
+            if self._tty and self._suspended == 1:
+                self._clear()
+            try:
+                yield
+            finally:
+                self._suspended -= 1
+                if self._tty and self._suspended == 0 and self._thread is not None:
+                    self._draw()
+
+    @property
+    def on_terminal(self) -> bool:
+        return self._tty
+
+    def _sample(self):
+        now = time.monotonic()
+        done = self._done + sum(t.n for t in self._active)
+        moved = done - self._initial
+        if self._last is not None and now > self._last[0]:
+            rate = (moved - self._last[1]) / (now - self._last[0])
+            self._rate = rate if self._rate is None else 0.3 * rate + 0.7 * self._rate
+        self._last = (now, moved)
+        return now, done
+
+    def _lines_now(self) -> list:
+        now, done = self._sample()
+        width = max(shutil.get_terminal_size().columns - 1, 20)
+        lines = [
+            tqdm.tqdm.format_meter(
+                done,
+                self._total,
+                now - self._start,
+                ncols=width,
+                prefix=f"{self._finished}/{self._files} files",
+                unit="B",
+                unit_scale=True,
+                rate=self._rate,
+            )
+        ]
+        for t in self._active[: self._max_active]:
+            lines.append(
+                tqdm.tqdm.format_meter(
+                    t.n,
+                    t.total,
+                    now - t.start,
+                    ncols=width,
+                    prefix="  " + t.desc,
+                    unit="B",
+                    unit_scale=True,
+                    initial=t.initial,
+                )
+            )
+        hidden = len(self._active) - self._max_active
+        if hidden > 0:
+            lines.append(f"  ... and {hidden} more")
+        return [line[:width] for line in lines]
+
+    def _draw(self):
+        lines = self._lines_now()
+        self._stream.write("\n".join(lines))
+        self._stream.flush()
+        self._lines = len(lines)
+
+    def _clear(self):
+        # back to the start of the first line drawn, and clear down from there
+        if self._lines:
+            up = f"\x1b[{self._lines - 1}A" if self._lines > 1 else ""
+            self._stream.write("\r" + up + "\x1b[J")
+            self._lines = 0
+
+    def _log(self, final=False):
+        now, done = self._sample()
+        state = (done, self._finished)
+        if state == self._logged:
+            return
+        self._logged = state
+
+        size = tqdm.tqdm.format_sizeof
+        percent = 100 * done / self._total if self._total else 100
+        line = (
+            f"progress: {size(done, 'B')}/{size(self._total, 'B')} "
+            f"({percent:.0f}%), {self._finished}/{self._files} files"
+        )
+        if final:
+            rate = (done - self._initial) / max(now - self._start, 1e-9)
+            line += f", {size(rate, 'B/s')} average"
+        else:
+            if self._rate is not None:
+                line += f", {size(self._rate, 'B/s')}"
+            line += f", {len(self._active)} active"
+        self._stream.write(line + "\n")
+        self._stream.flush()
+
+
+class _Suspending:
+    """
+    Stands in for sys.stdout or sys.stderr while a Dashboard is drawn on the
+    terminal, so that lines printed by other code appear above it instead
+    of over it. Each thread's output is held until it completes a line.
+    """
+
+    def __init__(self, stream, dashboard: Dashboard):
+        self._stream = stream
+        self._dashboard = dashboard
+        self._local = threading.local()
+
+    def write(self, s: str):
+        text = getattr(self._local, "pending", "") + s
+        *lines, self._local.pending = text.split("\n")
+        if lines:
+            with self._dashboard.suspend():
+                self._stream.write("\n".join(lines) + "\n")
+                self._stream.flush()
+        return len(s)
+
+    def flush(self):
+        self._stream.flush()
+
+    def release(self):
+        # whatever the calling thread left without a newline
+        pending = getattr(self._local, "pending", "")
+        if pending:
+            self._stream.write(pending)
+        return self._stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+@contextmanager
+def progress(desc: str, total: int, initial: int = None, position: int = None):
+    """
+    Track the progress of one file transfer or hash on the dashboard, if
+    display() started one, or else on its own tqdm bar at position. Yields
+    an object with an update(nbytes) method.
+    """
+    if _dashboard is not None:
+        with _dashboard.transfer(desc, total, initial or 0) as t:
+            yield t
+        return
+
+    kwargs = {} if initial is None else {"initial": initial}
+    with tqdm.tqdm(
+        total=total,
+        unit="B",
+        unit_scale=True,
+        desc=desc,
+        position=position,
+        leave=position is None,
+        **kwargs,
+    ) as tq:
+        yield tq
 
 
 @contextmanager
-def display(*args, **kwargs):
+def display(concurrent=False):
+    """
+    notes:
+    Files are shown on a Dashboard instead of a tqdm bar each when several
+    are transferred at once (concurrent) or when progress goes to a log
+    rather than a terminal.
+    """
+    global _dashboard
     try:
         init()
+        if concurrent or not sys.stderr.isatty():
+            _dashboard = Dashboard()
+            if _dashboard.on_terminal:
+                sys.stdout = _Suspending(sys.stdout, _dashboard)
+                sys.stderr = _Suspending(sys.stderr, _dashboard)
         yield
     finally:
+        if _dashboard is not None:
+            _dashboard.close()
+            if isinstance(sys.stdout, _Suspending):
+                sys.stdout = sys.stdout.release()
+            if isinstance(sys.stderr, _Suspending):
+                sys.stderr = sys.stderr.release()
+            _dashboard = None
         fini()
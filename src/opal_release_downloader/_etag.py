@@ -0,0 +1,136 @@
+import hashlib
+import math
+import re
+
+MIB = 1024 * 1024
+
+# a multipart ETag can only be checked if the part size used for the upload
+# is known; whole-MiB part sizes that give the ETag's part count are tried,
+# unless there are more of them than this
+MAX_PART_SIZES = 4
+
+_ETAG_RE = re.compile(r'"?([0-9a-f]{32})(?:-([0-9]+))?"?')
+
+
+def parse_etag(etag: str):
+    """
+    Split an S3 ETag into its hex digest and multipart part count (None for
+    a single-part upload). Returns None for ETags that are not in that form.
+
+    notes:
+    The ETag of an object encrypted with SSE-KMS is also 32 hex digits but
+    not the md5 of the data; it cannot be told apart here.
+    """
+    m = _ETAG_RE.fullmatch(etag or "")
+    if m is None:
+        return None
+    return m[1], int(m[2]) if m[2] else None
+
+
+def part_sizes(size: int, parts: int) -> list:
+    """
+    Whole-MiB part sizes that split size bytes into exactly `parts` parts,
+    i.e. the part sizes a multipart upload with that many parts could have
+    used.
+    """
+    if parts < 1 or size < parts:
+        return []
+    if parts == 1:
+        # the part size makes no difference to a single part
+        return [max(size, 1)]
+
+    smallest = math.ceil(size / parts)
+    largest = math.ceil(size / (parts - 1)) - 1
+    first = math.ceil(smallest / MIB) * MIB
+    return list(range(first, largest + 1, MIB))
+
+
+class MultipartETag:
+    """
+    Computes the ETag S3 gives a multipart upload of the data passed to
+    update, for several candidate part sizes at once: the md5 of the
+    concatenated md5 digests of the parts, followed by the part count.
+    """
+
+    def __init__(self, part_sizes: list):
+        # per part size: [hash of the current part, bytes in it, part digests]
+        self._parts = {p: [hashlib.md5(), 0, []] for p in part_sizes}
+
+    def update(self, data):
+        view = memoryview(data)
+        for part_size, state in self._parts.items():
+            pos = 0
+            while pos < len(view):
+                take = min(part_size - state[1], len(view) - pos)
+                state[0].update(view[pos : pos + take])
+                state[1] += take
+                pos += take
+                if state[1] == part_size:
+                    state[2].append(state[0].digest())
+                    state[0] = hashlib.md5()
+                    state[1] = 0
+
+    def etags(self) -> dict:
+        """
+        Map each part size to the ETag of the data so far.
+        """
+        etags = {}
+        for part_size, (hash_, filled, digests) in self._parts.items():
+            if filled:
+                digests = [*digests, hash_.digest()]
+            combined = hashlib.md5(b"".join(digests)).hexdigest()
+            etags[part_size] = f"{combined}-{len(digests)}"
+        return etags
+
+
+def etag_hasher(s3_item: dict):
+    """
+    Return a MultipartETag for checking s3_item's multipart ETag, or None if
+    it is a single-part ETag (the object's md5, so no extra hashing is
+    needed) or cannot be checked (see etag_checkable).
+    """
+    parsed = parse_etag(s3_item.get("ETag"))
+    if parsed is None or parsed[1] is None:
+        return None
+    sizes = part_sizes(s3_item["Size"], parsed[1])
+    if not sizes or len(sizes) > MAX_PART_SIZES:
+        return None
+    return MultipartETag(sizes)
+
+
+def etag_checkable(s3_item: dict) -> bool:
+    """
+    True if a download of s3_item can be checked against its ETag.
+    """
+    parsed = parse_etag(s3_item.get("ETag"))
+    if parsed is None:
+        return False
+    return parsed[1] is None or etag_hasher(s3_item) is not None
+
+
+def check_etag(s3_item: dict, md5_hex: str, hasher: MultipartETag = None) -> bool:
+    """
+    Check the downloaded data, with md5 digest md5_hex and fed through
+    hasher (from etag_hasher), against s3_item's ETag. Returns True if it
+    matches and False if it could not be checked.
+
+    notes:
+    Only a single-part ETag mismatch raises. A multipart ETag is checked
+    against guessed part sizes, so one that matches none of them is not
+    evidence of a bad download; the upload may have used a part size that
+    is not a whole number of MiB.
+    """
+    parsed = parse_etag(s3_item.get("ETag"))
+    if parsed is None:
+        return False
+
+    etag = s3_item["ETag"].strip('"')
+    if parsed[1] is None:
+        if md5_hex != parsed[0]:
+            raise RuntimeError(
+                f"{s3_item['Key']} does not match its ETag {etag}; if it was "
+                "uploaded again recently, retry with --refresh-index"
+            )
+        return True
+
+    return hasher is not None and etag in hasher.etags().values()
@@ -0,0 +1,77 @@
+import datetime
+import os
+import threading
+import time
+
+from . import _metrics
+from ._state import load_record, save_record
+
+_index_ttl = None
+_index_lock = threading.Lock()
+
+
+def set_index_ttl(ttl):
+    """
+    Keep bucket listings in a local index and reuse them for ttl seconds.
+    With 0 the bucket is always listed again (and the index refreshed);
+    with None, the default, the index is not used at all.
+    """
+    global _index_ttl
+    _index_ttl = ttl
+
+
+def index_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "opal-release-downloader")
+
+
+def index_path(bucket_name: str, region_name: str) -> str:
+    return os.path.join(index_dir(), f"{bucket_name}.{region_name}.json")
+
+
+def _from_json(item):
+    # LastModified is stored as str(datetime); give callers a datetime back
+    if isinstance(item, dict) and isinstance(item.get("LastModified"), str):
+        item = dict(item)
+        item["LastModified"] = datetime.datetime.fromisoformat(item["LastModified"])
+    return item
+
+
+def cached_listing(bucket_name: str, region_name: str, key: str, load) -> list:
+    """
+    Return the listing stored under key in the bucket's index if it is
+    younger than the index ttl, otherwise call load() and store the list it
+    returns.
+
+    notes:
+    Empty listings are not stored, so a release that is still being
+    uploaded is looked up again next time. The index is only an
+    optimisation: if it cannot be written, the listing is still returned.
+    """
+    if _index_ttl is None:
+        return load()
+
+    path = index_path(bucket_name, region_name)
+    with _index_lock:
+        entry = load_record(path).get(key)
+
+    if isinstance(entry, dict) and isinstance(entry.get("value"), list):
+        age = time.time() - entry.get("fetched", 0)
+        if 0 <= age < _index_ttl:
+            _metrics.count("index_hit")
+            return [_from_json(it) for it in entry["value"]]
+
+    _metrics.count("index_miss")
+    value = load()
+    if value:
+        with _index_lock:
+            index = load_record(path)
+            index[key] = {"fetched": time.time(), "value": value}
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                save_record(path, index)
+            except OSError:
+                pass
+    return value
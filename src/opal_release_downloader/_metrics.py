@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_start = time.time()
+_phases = {}
+_counters = {}
+_events = []
+
+
+def reset():
+    global _start
+    with _lock:
+        _start = time.time()
+        _phases.clear()
+        _counters.clear()
+        _events.clear()
+
+
+def count(counter: str, n: int = 1):
+    with _lock:
+        _counters[counter] = _counters.get(counter, 0) + n
+
+
+@contextmanager
+def timed(phase: str, name: str = None, nbytes: int = 0):
+    """
+    Time the body of the with block as one occurrence of phase. If name is
+    given (an object key or file name), the occurrence is also kept as an
+    event in the report. nbytes is the amount of data it moved, if any.
+    """
+    started = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        with _lock:
+            p = _phases.setdefault(
+                phase, {"count": 0, "errors": 0, "seconds": 0.0, "bytes": 0}
+            )
+            p["count"] += 1
+            p["seconds"] += seconds
+            p["bytes"] += nbytes
+            if error is not None:
+                p["errors"] += 1
+            if name is not None:
+                event = {
+                    "phase": phase,
+                    "name": name,
+                    "start": round(started - _start, 6),
+                    "seconds": round(seconds, 6),
+                    "bytes": nbytes,
+                }
+                if error is not None:
+                    event["error"] = error
+                _events.append(event)
+
+
+def report() -> dict:
+    """
+    Everything recorded so far. Phase times are summed over every
+    occurrence, so phases running on several threads at once can add up to
+    more than the wall time.
+    """
+    with _lock:
+        phases = {}
+        for phase, p in sorted(_phases.items()):
+            phases[phase] = dict(p, seconds=round(p["seconds"], 6))
+            if p["bytes"] and p["seconds"] > 0:
+                phases[phase]["mb_per_s"] = round(p["bytes"] / 1e6 / p["seconds"], 3)
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(_start)),
+            "wall_seconds": round(time.time() - _start, 6),
+            "phases": phases,
+            "counters": dict(sorted(_counters.items())),
+            "events": list(_events),
+        }
+
+
+def write_report(path: str):
+    tmp_name = path + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(report(), f, indent=1)
+    os.replace(tmp_name, path)
+
+
+@contextmanager
+def reporting(path: str = None):
+    """
+    Write the metrics report to path when the with block exits, even if it
+    fails. Does nothing if path is None.
+    """
+    try:
+        yield
+    finally:
+        if path is not None:
+            write_report(path)
+
+
+def add_metrics_argument(parser):
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="write timings and counters for this run to a JSON file",
+    )
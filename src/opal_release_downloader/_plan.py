@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import sys
+
+import tqdm
+
+from ._constants import PROBE_BYTES
+from ._display import warn
+
+PLAN_FORMATS = ("text", "json")
+
+
+def free_space(path: str) -> int:
+    """
+    Free bytes on the filesystem that path is, or would be created, on.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+def summarize(
+    stages: list,
+    *,
+    free_bytes: int,
+    throughput: float = None,
+    max_bandwidth=None,
+    probe_error: str = None,
+) -> dict:
+    """
+    Combine the per-prefix plans from fetch.plan_files into one plan with
+    totals, the disk space left after the transfer and an estimate of how
+    long it will take.
+
+    notes:
+    The estimate uses the measured throughput, capped at max_bandwidth; it
+    is None if nothing could be measured. probe_error is why the throughput
+    could not be measured, if it was tried.
+    """
+    transfer = sum(s["bytes"] for s in stages)
+    rate = throughput
+    if max_bandwidth is not None and (rate is None or rate > max_bandwidth):
+        rate = max_bandwidth
+
+    eta = None
+    if transfer == 0:
+        eta = 0.0
+    elif rate:
+        eta = transfer / rate
+
+    return {
+        "stages": stages,
+        "objects": sum(len(s["download"]) for s in stages),
+        "bytes": transfer,
+        "skipped_objects": sum(len(s["skip"]) for s in stages),
+        "skipped_bytes": sum(s["skipped_bytes"] for s in stages),
+        "free_bytes": free_bytes,
+        "headroom_bytes": free_bytes - transfer,
+        "throughput": throughput,
+        "eta_seconds": eta,
+        "probe_error": probe_error,
+    }
+
+
+def _size(n) -> str:
+    return tqdm.tqdm.format_sizeof(n, "B")
+
+
+def print_plan(plan: dict, format: str = "text"):
+    if format == "json":
+        json.dump(plan, sys.stdout, indent=2, default=str)
+        sys.stdout.write("\n")
+        return
+
+    for stage in plan["stages"]:
+        name = stage.get("stage", stage["prefix"])
+        print(f"{name}: {stage['prefix']} -> {os.path.relpath(stage['dest'])}")
+        for it in stage["download"]:
+            resume = ""
+            if it["bytes"] != it["Size"]:
+                resume = f", resuming at {_size(it['Size'] - it['bytes'])}"
+            print(f"  download  {it['Key']}  {_size(it['bytes'])}{resume}")
+        for it in stage["skip"]:
+            print(f"  skip      {it['Key']}  {_size(it['Size'])} ({it['reason']})")
+
+    print()
+    print(f"to download: {plan['objects']} objects, {_size(plan['bytes'])}")
+    print(
+        f"skipped:     {plan['skipped_objects']} objects, "
+        f"{_size(plan['skipped_bytes'])}"
+    )
+    print(
+        f"free disk:   {_size(plan['free_bytes'])}, "
+        f"{_size(max(plan['headroom_bytes'], 0))} left afterwards"
+    )
+    if plan.get("probe_error"):
+        warn(f"WARNING: unable to measure throughput: {plan['probe_error']}")
+    if plan["throughput"] is not None:
+        print(f"throughput:  {_size(plan['throughput'])}/s (measured)")
+    if plan["eta_seconds"] is not None:
+        print(f"estimate:    {tqdm.tqdm.format_interval(plan['eta_seconds'])}")
+    if plan["headroom_bytes"] < 0:
+        warn(f"WARNING: {_size(-plan['headroom_bytes'])} more disk space is needed")
+
+
+def add_plan_argument(parser):
+    parser.add_argument(
+        "--plan",
+        "--dry-run",
+        nargs="?",
+        const="text",
+        choices=PLAN_FORMATS,
+        default=None,
+        help="only show what would be downloaded, how long it should take "
+        "and whether it fits on disk, as text (default) or json; the time "
+        f"estimate downloads up to {PROBE_BYTES // 1024**2}MiB of the largest "
+        "file to measure throughput",
+    )
@@ -0,0 +1,28 @@
+import json
+import os
+
+
+def load_record(path: str) -> dict:
+    """
+    Load a json state file, treating a missing or unreadable file as empty.
+    """
+    try:
+        with open(path, "r") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(record, dict):
+        return {}
+    return record
+
+
+def save_record(path: str, record: dict):
+    """
+    Write a json state file atomically, so an interrupted run never leaves a
+    half-written record behind.
+    """
+    tmp_name = path + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(record, f, indent=1, default=str)
+    os.replace(tmp_name, path)
@@ -0,0 +1,105 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by every thread that calls it.
+
+    Callers take tokens for bytes they have already received; when the
+    bucket runs dry they are told to wait until the bytes would have been
+    allowed, so the long-run rate never exceeds `rate` bytes per second
+    while bursts of up to `burst` bytes pass without waiting.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> float:
+        """
+        Take nbytes worth of tokens and return how many seconds the caller
+        should wait before using them.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= nbytes
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def consume(self, nbytes: int):
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+
+_bandwidth = None
+
+# set when the run is interrupted, so that transfers in flight on other
+# threads stop at their next chunk instead of running to the end
+_cancelled = threading.Event()
+
+
+def set_max_bandwidth(rate: float = None):
+    """
+    Limit the combined rate of all downloads to rate bytes per second, or
+    remove the limit with None.
+    """
+    global _bandwidth
+    _bandwidth = None if rate is None else TokenBucket(rate)
+
+
+def max_bandwidth():
+    """
+    The current bandwidth limit in bytes per second, or None.
+    """
+    return None if _bandwidth is None else _bandwidth.rate
+
+
+def set_cancelled(cancelled: bool = True):
+    """
+    Tell every transfer in flight to stop (see check_cancelled), or allow
+    transfers again with False.
+    """
+    if cancelled:
+        _cancelled.set()
+    else:
+        _cancelled.clear()
+
+
+def check_cancelled():
+    """
+    Called by download threads for every chunk received; raises once
+    set_cancelled has been called.
+    """
+    if _cancelled.is_set():
+        raise RuntimeError("interrupted")
+
+
+def throttle(nbytes: int):
+    """
+    Called by download threads for every chunk received; blocks while the
+    downloads are over the bandwidth limit.
+    """
+    if _bandwidth is not None:
+        _bandwidth.consume(nbytes)
+
+
+def throttle_delay(nbytes: int) -> float:
+    """
+    Like throttle, but returns the time to wait instead of sleeping, for
+    callers on an event loop.
+    """
+    if _bandwidth is None:
+        return 0.0
+    return _bandwidth.reserve(nbytes)
@@ -0,0 +1,155 @@
+import hashlib
+import os
+
+from ._constants import CHECKPOINT_SUFFIX, PART_SUFFIX
+from ._display import warn
+from ._etag import MultipartETag, check_etag
+from ._state import load_record, save_record
+
+# how many downloaded bytes may be lost if a download is interrupted
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024
+
+
+class Checkpoint:
+    """
+    Sidecar record of how much of a .part file is safely on disk, so that an
+    interrupted download can continue with ranged GETs instead of starting
+    over.
+
+    Downloads are written in order, so the completed ranges are always one
+    [0, n) range, but the record keeps them as a list of [start, end) ranges.
+    """
+
+    def __init__(self, local_name: str, s3_item: dict, interval=CHECKPOINT_INTERVAL):
+        self.part_name = local_name + PART_SUFFIX
+        self.path = local_name + CHECKPOINT_SUFFIX
+        self._record = {
+            "Key": s3_item["Key"],
+            "Size": s3_item["Size"],
+            "ETag": s3_item.get("ETag"),
+        }
+        self._interval = interval
+        self.completed = 0
+        self._saved = 0
+
+    def load(self) -> int:
+        """
+        Return how many leading bytes of the .part file can be reused, or 0
+        if there is no checkpoint for this version of the object.
+        """
+        record = load_record(self.path)
+        try:
+            part_size = os.path.getsize(self.part_name)
+        except OSError:
+            return 0
+
+        for k, v in self._record.items():
+            if record.get(k) != v:
+                return 0
+
+        completed = 0
+        for start, end in sorted(record.get("ranges", [])):
+            if start > completed:
+                break
+            completed = max(completed, end)
+
+        completed = min(completed, part_size, self._record["Size"])
+        self.completed = self._saved = completed
+        return completed
+
+    def advance(self, fileobj, nbytes: int):
+        self.completed += nbytes
+        if self.completed - self._saved >= self._interval:
+            fileobj.flush()
+            self.save()
+
+    def save(self):
+        save_record(self.path, dict(self._record, ranges=[[0, self.completed]]))
+        self._saved = self.completed
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class HashingWriter:
+    """
+    Write-only file wrapper that feeds every byte written through md5, and
+    through etag (see _etag.etag_hasher) if given.
+
+    It deliberately reports itself as not seekable so that s3transfer hands
+    over the parts of a multipart download in order, which is what lets the
+    digest be computed while the download is in progress. The price is that
+    parts arriving ahead of the one being written are buffered in memory;
+    fetch.get_transfer_config bounds that to DOWNLOAD_BUFFER_SIZE.
+    """
+
+    def __init__(
+        self, fileobj, checkpoint: Checkpoint = None, etag: MultipartETag = None
+    ):
+        self._fileobj = fileobj
+        self._hash = hashlib.md5()
+        self._checkpoint = checkpoint
+        self.etag = etag
+
+    def write(self, data):
+        self._hash.update(data)
+        if self.etag is not None:
+            self.etag.update(data)
+        written = self._fileobj.write(data)
+        if self._checkpoint is not None:
+            self._checkpoint.advance(self._fileobj, len(data))
+        return written
+
+    def seekable(self):
+        return False
+
+    def update_from(self, fileobj, nbytes: int, block_size=1024 * 1024):
+        """
+        Hash the first nbytes of fileobj without writing them, e.g. the part
+        of a .part file kept from an interrupted download.
+        """
+        while nbytes > 0:
+            block = fileobj.read(min(block_size, nbytes))
+            if not block:
+                raise RuntimeError(f"{fileobj.name} is shorter than expected")
+            self._hash.update(block)
+            if self.etag is not None:
+                self.etag.update(block)
+            nbytes -= len(block)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def finish_download(
+    local_name: str, s3_item: dict, checkpoint: Checkpoint, writer: HashingWriter
+):
+    """
+    Check a completed .part file against the ETag in s3_item's listing and
+    move it into place, setting s3_item["ETagVerified"] to whether the check
+    was possible and passed. A .part file that does not match a single-part
+    ETag is removed, so the next attempt starts over.
+
+    notes:
+    The md5 (and multipart ETag) were computed while downloading, so this
+    costs neither a request nor a read.
+
+    A file that matches none of the guessed multipart ETags is kept
+    unverified and left to the checksum files (see _etag.check_etag).
+    """
+    try:
+        verified = check_etag(s3_item, writer.hexdigest(), writer.etag)
+    except RuntimeError:
+        os.unlink(checkpoint.part_name)
+        checkpoint.remove()
+        raise
+    if not verified and writer.etag is not None:
+        warn(
+            f"WARNING: {os.path.basename(local_name)} could not be checked "
+            f"against its multipart ETag {s3_item['ETag']}; leaving it to the "
+            "checksum files"
+        )
+    s3_item["ETagVerified"] = verified
+    os.replace(checkpoint.part_name, local_name)
+    checkpoint.remove()
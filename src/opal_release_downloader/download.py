@@ -1,13 +1,36 @@
 import argparse
+import concurrent.futures
+import functools
 import os
 import sys
+import time
 
 import colorama
+import tqdm
 
-from .list import get_latest
-from .fetch import get_files
-from .verify import verify_directory
-from ._display import display, error, warn
+from . import _metrics
+from .list import (
+    add_index_arguments,
+    get_latest,
+    get_s3_client,
+    set_index_ttl,
+    set_max_pool_connections,
+)
+from .fetch import (
+    add_transfer_arguments,
+    get_files,
+    fetched_digests,
+    fetched_sizes,
+    fetched_verified,
+    plan_files,
+    plan_summary,
+    pool_size_for_jobs,
+    set_max_bandwidth,
+)
+from .verify import checksum_files, verify_directory
+from ._display import ProgressSlots, display, error
+from ._plan import add_plan_argument, print_plan
+from ._throttle import set_cancelled
 
 
 def bright(s: str, color: str = colorama.Fore.WHITE):
@@ -16,35 +39,225 @@ def bright(s: str, color: str = colorama.Fore.WHITE):
     sys.stdout.flush()
 
 
-def get_images(bucket_name, release_tag, no_overwrite):
-    get_files(bucket_name, release_tag, dest="images", no_overwrite=no_overwrite)
+# the stage functions put their files under root, which must be an absolute
+# path when stages run concurrently (verify_directory changes directory)
+def get_images(bucket_name, release_tag, no_overwrite, root=".", **fetch_kwargs):
+    fetched = get_files(
+        bucket_name,
+        release_tag,
+        dest=os.path.join(root, "images"),
+        no_overwrite=no_overwrite,
+        **fetch_kwargs,
+    )
     print()
+    # verify against every kind of checksum file the release ships, e.g.
+    # both md5sums_<tag> and sha256sums_<tag>
+    checksums = checksum_files(fetched) or f"md5sums_{release_tag}"
     verify_directory(
-        "images",
-        checksum=f"md5sums_{release_tag}",
+        os.path.join(root, "images"),
+        checksum=checksums,
         manifest=f"file_manifest_{release_tag}.yml",
+        digests=fetched_digests(fetched),
+        sizes=fetched_sizes(fetched),
     )
+    return fetched
 
 
-def get_scripts(bucket_name, release_tag, no_overwrite):
+def get_scripts(bucket_name, release_tag, no_overwrite, root=".", **fetch_kwargs):
     # TODO: why don't scripts have checksums?
-    get_files(bucket_name, "unpacker", dest=".", no_overwrite=no_overwrite)
+    return get_files(
+        bucket_name, "unpacker", dest=root, no_overwrite=no_overwrite, **fetch_kwargs
+    )
 
 
-def get_docker(bucket_name, no_overwrite):
-    get_files(bucket_name, "docker", no_overwrite=no_overwrite)
+def get_docker(bucket_name, no_overwrite, root=".", **fetch_kwargs):
+    fetched = get_files(
+        bucket_name,
+        "docker",
+        dest=os.path.join(root, "docker"),
+        no_overwrite=no_overwrite,
+        **fetch_kwargs,
+    )
     print()
+    # md5checksum does not list every file; the ones it leaves out are
+    # covered by their ETag, which was checked while they downloaded
     verify_directory(
-        "docker", checksum=f"md5checksum", require_manifest=False, strict_checksum=False
-    )  # TODO: BAD JUJU
+        os.path.join(root, "docker"),
+        checksum=f"md5checksum",
+        require_manifest=False,
+        strict_checksum=False,
+        digests=fetched_digests(fetched),
+        sizes=fetched_sizes(fetched),
+        verified=fetched_verified(fetched),
+    )
+    return fetched
 
 
-def get_rhel(bucket_name, no_overwrite):
-    get_files(bucket_name, "redhat-iso", dest="rhel", no_overwrite=no_overwrite)
+def get_rhel(bucket_name, no_overwrite, root=".", **fetch_kwargs):
+    fetched = get_files(
+        bucket_name,
+        "redhat-iso",
+        dest=os.path.join(root, "rhel"),
+        no_overwrite=no_overwrite,
+        **fetch_kwargs,
+    )
     print()
+    # md5checksum does not list every file; the ones it leaves out are
+    # covered by their ETag, which was checked while they downloaded
     verify_directory(
-        "rhel", checksum=f"md5checksum", require_manifest=False, strict_checksum=False
-    )  # TODO: BAD JUJU
+        os.path.join(root, "rhel"),
+        checksum=f"md5checksum",
+        require_manifest=False,
+        strict_checksum=False,
+        digests=fetched_digests(fetched),
+        sizes=fetched_sizes(fetched),
+        verified=fetched_verified(fetched),
+    )
+    return fetched
+
+
+def stage_count(download_docker=True, download_rhel=True) -> int:
+    """
+    Number of stages bootstrap runs: images and scripts, plus docker and rhel
+    when requested.
+    """
+    return 2 + int(download_docker) + int(download_rhel)
+
+
+def run_stages(stages: list) -> list:
+    """
+    Run (name, function) stages on one thread each and return a
+    (name, fetched, error, seconds) tuple per stage, in the order given.
+
+    A failing stage does not stop the others; every stage runs to the end so
+    the summary covers all of them. If the calling thread is interrupted, the
+    stages are told to stop at their next chunk (see _throttle.set_cancelled)
+    instead of running to the end.
+    """
+
+    def _run(name, func):
+        start = time.monotonic()
+        try:
+            with _metrics.timed("stage", name):
+                return func(), None, time.monotonic() - start
+        except Exception as e:
+            return None, e, time.monotonic() - start
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(stages))
+    try:
+        futures = [(name, pool.submit(_run, name, func)) for name, func in stages]
+        results = [(name, *fut.result()) for name, fut in futures]
+    except BaseException:
+        set_cancelled()
+        # only waits for the stages to abort; s3transfer cannot wind its
+        # transfers down once the interpreter has started to exit
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+    return results
+
+
+def print_stage_summary(results: list):
+    width = max(len(name) for name, *_ in results)
+    for name, fetched, e, seconds in results:
+        if e is not None:
+            status = f"FAILED {e}"
+        else:
+            size = sum(it.get("Size", 0) for it in fetched.values())
+            size = tqdm.tqdm.format_sizeof(size, "B")
+            status = f"ok     {len(fetched)} files ({size})"
+        print(f"{name:<{width}}  {seconds:7.1f}s  {status}")
+
+
+def bootstrap_pipeline(
+    bucket_name,
+    release_tag,
+    *,
+    download_docker,
+    download_rhel,
+    no_overwrite,
+    **fetch_kwargs,
+):
+    """
+    notes:
+    Runs every stage at once, so the total time approaches that of the
+    largest stage. Each stage verifies its directory once all of its own
+    downloads have finished, while the other stages keep downloading.
+    verify_directory changes the working directory, so verifications of
+    different stages take turns rather than overlapping one another.
+
+    This should run from within the opal_artifacts directory.
+    """
+    root = os.getcwd()
+    jobs = fetch_kwargs.get("jobs", 1)
+    fetch_kwargs["slots"] = ProgressSlots(
+        jobs * stage_count(download_docker, download_rhel)
+    )
+
+    def stage(func, *args):
+        return functools.partial(func, *args, no_overwrite, root=root, **fetch_kwargs)
+
+    stages = [
+        ("images", stage(get_images, bucket_name, release_tag)),
+        ("scripts", stage(get_scripts, bucket_name, release_tag)),
+    ]
+    if download_docker:
+        stages.append(("docker", stage(get_docker, bucket_name)))
+    if download_rhel:
+        stages.append(("rhel", stage(get_rhel, bucket_name)))
+
+    bright("Downloading and Verifying " + ", ".join(name for name, _ in stages))
+    results = run_stages(stages)
+
+    print()
+    bright("Summary")
+    print_stage_summary(results)
+
+    failed = [name for name, _, e, _ in results if e is not None]
+    if failed:
+        raise Exception(f"stage(s) failed: {', '.join(failed)}")
+
+
+def stage_locations(release_tag, download_docker, download_rhel, root) -> list:
+    """
+    The (name, bucket prefix, local directory) that each stage downloads,
+    as the stage functions above lay them out under root.
+    """
+    stages = [
+        ("images", release_tag, os.path.join(root, "images")),
+        ("scripts", "unpacker", root),
+    ]
+    if download_docker:
+        stages.append(("docker", "docker", os.path.join(root, "docker")))
+    if download_rhel:
+        stages.append(("rhel", "redhat-iso", os.path.join(root, "rhel")))
+    return stages
+
+
+def plan_bootstrap(
+    bucket_name,
+    release_tag,
+    *,
+    download_docker,
+    download_rhel,
+    no_overwrite,
+    sync=False,
+    jobs=1,
+) -> dict:
+    """
+    Work out what bootstrap would download into ./opal_artifacts, without
+    creating or changing anything (see fetch.plan_files).
+    """
+    root = os.path.join(os.getcwd(), "opal_artifacts")
+    stages = []
+    for name, prefix, dest in stage_locations(
+        release_tag, download_docker, download_rhel, root
+    ):
+        plan = plan_files(
+            bucket_name, prefix, dest=dest, no_overwrite=no_overwrite, sync=sync
+        )
+        stages.append(dict(plan, stage=name))
+    return plan_summary(get_s3_client(), bucket_name, stages, root, jobs=jobs)
 
 
 # it's assumed that colorama.init() is called before this function
@@ -55,30 +268,83 @@ def bootstrap(
     download_docker=True,
     download_rhel=True,
     no_overwrite=False,
+    sync=False,
+    jobs=1,
+    part_size=None,
+    max_concurrency=None,
+    max_io_queue=None,
+    pipeline=False,
+    backend="threads",
+    plan=None,
 ):
+    """
+    notes:
+    With plan ("text" or "json"), only print what would be downloaded (see
+    plan_bootstrap) and change nothing.
+    """
 
     if release_tag is None:
         release_tag = get_latest(bucket_name)
 
+    if plan is not None:
+        print_plan(
+            plan_bootstrap(
+                bucket_name,
+                release_tag,
+                download_docker=download_docker,
+                download_rhel=download_rhel,
+                no_overwrite=no_overwrite,
+                sync=sync,
+                jobs=jobs,
+            ),
+            plan,
+        )
+        return
+
     cur_dir = os.getcwd()
     os.makedirs("opal_artifacts", exist_ok=True)
     os.chdir("opal_artifacts")
 
+    fetch_kwargs = {
+        "sync": sync,
+        "jobs": jobs,
+        "part_size": part_size,
+        "max_concurrency": max_concurrency,
+        "max_io_queue": max_io_queue,
+        "backend": backend,
+    }
+
     try:
+        if pipeline:
+            bootstrap_pipeline(
+                bucket_name,
+                release_tag,
+                download_docker=download_docker,
+                download_rhel=download_rhel,
+                no_overwrite=no_overwrite,
+                **fetch_kwargs,
+            )
+            bright("SUCCESS", colorama.Fore.GREEN)
+            return
+
         bright("Downloading and Verifying OPAL artifacts")
-        get_images(bucket_name, release_tag, no_overwrite)
+        with _metrics.timed("stage", "images"):
+            get_images(bucket_name, release_tag, no_overwrite, **fetch_kwargs)
         print()
 
         bright("Downloading and Verifying installation scripts")
-        get_scripts(bucket_name, release_tag, no_overwrite)
+        with _metrics.timed("stage", "scripts"):
+            get_scripts(bucket_name, release_tag, no_overwrite, **fetch_kwargs)
         if download_docker:
             print()
             bright("Downloading and Verifying docker")
-            get_docker(bucket_name, no_overwrite)
+            with _metrics.timed("stage", "docker"):
+                get_docker(bucket_name, no_overwrite, **fetch_kwargs)
         if download_rhel:
             print()
             bright("Downloading and Verifying RHEL-8")
-            get_rhel(bucket_name, no_overwrite)
+            with _metrics.timed("stage", "rhel"):
+                get_rhel(bucket_name, no_overwrite, **fetch_kwargs)
 
     finally:
         os.chdir(cur_dir)
@@ -113,9 +379,52 @@ def main():
         action="store_true",
         help="do not download an artifact that already exists",
     )
+    parser.add_argument(
+        "--sync",
+        default=False,
+        action="store_true",
+        help="only download artifacts that changed since they were last downloaded",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="number of files to download concurrently",
+    )
+    parser.add_argument(
+        "--pipeline",
+        default=False,
+        action="store_true",
+        help="download images, scripts, docker and RHEL concurrently; each is "
+        "verified once its own downloads finish, one verification at a time",
+    )
+    parser.add_argument(
+        "--max-pool-connections",
+        type=int,
+        default=None,
+        help="size of the shared s3 connection pool (default: scales with --jobs)",
+    )
+    add_transfer_arguments(parser)
+    add_index_arguments(parser)
+    add_plan_argument(parser)
+    _metrics.add_metrics_argument(parser)
 
     args = parser.parse_args()
-    with display():
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    jobs_in_flight = args.jobs
+    if args.pipeline:
+        jobs_in_flight *= stage_count(not args.no_docker, not args.no_rhel)
+    set_max_pool_connections(
+        args.max_pool_connections
+        or pool_size_for_jobs(jobs_in_flight, args.max_concurrency)
+    )
+    set_index_ttl(0 if args.refresh_index else args.index_ttl)
+    set_max_bandwidth(args.max_bandwidth)
+
+    many_at_once = args.jobs > 1 or args.pipeline
+    with display(concurrent=many_at_once), _metrics.reporting(args.metrics_file):
         try:
             bootstrap(
                 args.bucket_name,
@@ -123,6 +432,14 @@ def main():
                 download_docker=not args.no_docker,
                 download_rhel=not args.no_rhel,
                 no_overwrite=args.no_overwrite,
+                sync=args.sync,
+                jobs=args.jobs,
+                part_size=args.part_size,
+                max_concurrency=args.max_concurrency,
+                max_io_queue=args.max_io_queue,
+                pipeline=args.pipeline,
+                backend=args.backend,
+                plan=args.plan,
             )
         except Exception as e:
             error(f"FAILURE: {str(e)}")
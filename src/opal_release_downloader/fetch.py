@@ -1,20 +1,168 @@
 import argparse
-import boto3
-import botocore as bc
+import collections
+import concurrent.futures
+import itertools
+import math
 import os
+import re
 import sys
+import threading
+import time
 
-import tqdm
 
-from ._constants import DEFAULT_REGION
-from ._display import display, error, warn
-from .list import get_latest, list_bucket_objects, get_s3_client
+from . import _metrics
+from ._constants import (
+    DEFAULT_MAX_POOL_CONNECTIONS,
+    DEFAULT_REGION,
+    DOWNLOAD_BUFFER_SIZE,
+    FETCH_RECORD,
+    MAX_AUTO_CONCURRENCY,
+    MIN_AUTO_CONCURRENCY,
+    MIN_PART_SIZE,
+    PROBE_BYTES,
+    S3_EXTRA_HINT,
+)
+
+try:
+    from boto3.s3.transfer import TransferConfig
+except ImportError as e:
+    raise ImportError(S3_EXTRA_HINT) from e
+from ._display import ProgressSlots, display, error, progress, warn, write
+from ._etag import etag_hasher
+from ._plan import add_plan_argument, free_space, print_plan, summarize
+from ._state import load_record, save_record
+from ._throttle import (
+    check_cancelled,
+    max_bandwidth,
+    set_cancelled,
+    set_max_bandwidth,
+    throttle,
+)
+from ._transfer import Checkpoint, HashingWriter, finish_download
+from .list import (
+    add_index_arguments,
+    get_latest,
+    list_bucket_objects,
+    get_s3_client,
+    set_index_ttl,
+    set_max_pool_connections,
+)
+
+# read size for ranged GETs when resuming, as progress (and thus throttling and
+# cancellation) is reported per read
+RANGE_READ_SIZE = 256 * 1024
+
+# "threads" uses s3transfer on a thread pool; "asyncio" streams every object
+# with aiohttp on one event loop (see _aio.py)
+BACKENDS = ("threads", "asyncio")
 
 
 def get_files(
-    bucket_name, path_spec, *, region_name=DEFAULT_REGION, dest=None, no_overwrite=False
+    bucket_name,
+    path_spec,
+    *,
+    region_name=DEFAULT_REGION,
+    dest=None,
+    no_overwrite=False,
+    sync=False,
+    jobs=1,
+    part_size=None,
+    max_concurrency=None,
+    max_io_queue=None,
+    slots=None,
+    backend="threads",
 ):
+    """
+    notes:
+    Every download is recorded in FETCH_RECORD in dest. With sync, files
+    whose size, ETag, LastModified and local mtime still match that record
+    are not downloaded again.
+
+    backend is one of BACKENDS; the transfer options and slots only apply
+    to the "threads" backend.
+    """
+    if backend not in BACKENDS:
+        raise RuntimeError(f"unknown download backend {backend}")
+
+    path_spec, dest = resolve_destination(bucket_name, path_spec, dest, region_name)
+
+    item_list = list_bucket_objects(
+        bucket_name, prefix=path_spec, region_name=region_name
+    )
+    s3 = get_s3_client(region_name=region_name)
+
+    rel_dest = os.path.relpath(dest)
+    print(f"Downloading files to {rel_dest}")
+    record_path = os.path.join(dest, FETCH_RECORD)
+    record = load_record(record_path)
+    fetched = {}
+    downloads = []
+    # the copies handed to the downloads, which finish_download marks with
+    # ETagVerified
+    download_items = {}
+    for it in item_list:
+        # existing files are not removed up front: each download goes to a
+        # .part file that only replaces the old copy once it is complete
+        local_name = prepare_local_path(dest, it, no_overwrite=True)
+        entry = record.get(os.path.basename(local_name))
+        fetched[local_name] = dict(it)
+        item_exists = os.path.exists(local_name)
+        if sync and item_exists and is_unchanged(local_name, it, entry):
+            print(f"Skipping unchanged file {local_name}")
+            _metrics.count("download_skipped")
+            fetched[local_name]["MD5"] = entry["MD5"]
+            fetched[local_name]["ETagVerified"] = entry.get("ETagVerified", False)
+        elif not (no_overwrite and item_exists):
+            if item_exists:
+                warn(f"WARNING: overwriting file {local_name}")
+            download_items[local_name] = dict(it)
+            downloads.append((download_items[local_name], local_name))
+        elif item_exists and no_overwrite:
+            print(f"Skipping download of existing file {local_name}")
+            _metrics.count("download_skipped")
+
+    # small files (checksums, manifests, scripts) first, so they are not
+    # held up behind multi-GB images
+    downloads.sort(key=lambda d: d[0]["Size"])
+
+    def _completed(local_name, digest):
+        fetched[local_name]["MD5"] = digest
+        fetched[local_name]["ETagVerified"] = download_items[local_name].get(
+            "ETagVerified", False
+        )
+        entry = record_entry(local_name, fetched[local_name], digest)
+        record[os.path.basename(local_name)] = entry
+
+    try:
+        with _metrics.timed("fetch", path_spec):
+            if backend == "asyncio":
+                download_objects_async(
+                    s3, bucket_name, downloads, jobs=jobs, on_complete=_completed
+                )
+            else:
+                download_objects(
+                    s3,
+                    bucket_name,
+                    downloads,
+                    jobs=jobs,
+                    on_complete=_completed,
+                    slots=slots,
+                    part_size=part_size,
+                    max_concurrency=max_concurrency,
+                    max_io_queue=max_io_queue,
+                )
+    finally:
+        # keep whatever did finish, even if the batch failed
+        save_record(record_path, record)
+
+    return {os.path.basename(k): v for k, v in fetched.items()}
 
+
+def resolve_destination(bucket_name, path_spec, dest, region_name=DEFAULT_REGION):
+    """
+    Fill in the defaults for get_files: the latest release if there is no
+    path_spec, and a directory named after it if there is no dest.
+    """
     # TODO:  i think this shouldn't be so helpfull fetch.get_files(...)
     #       should always have a path_spec
     if path_spec is None:
@@ -25,28 +173,364 @@ def get_files(
         if not dest:
             dest = path_spec
 
-    dest = os.path.realpath(dest)
+    return path_spec, os.path.realpath(dest)
+
 
+def plan_files(
+    bucket_name,
+    path_spec,
+    *,
+    region_name=DEFAULT_REGION,
+    dest=None,
+    no_overwrite=False,
+    sync=False,
+) -> dict:
+    """
+    Work out what get_files with the same arguments would do, without
+    downloading or changing anything: which objects it would download and
+    how many bytes that is (less whatever .part files it would resume
+    from), and which it would skip.
+    """
+    path_spec, dest = resolve_destination(bucket_name, path_spec, dest, region_name)
     item_list = list_bucket_objects(
         bucket_name, prefix=path_spec, region_name=region_name
     )
-    s3 = get_s3_client(region_name=region_name)
+    record = load_record(os.path.join(dest, FETCH_RECORD))
 
-    rel_dest = os.path.relpath(dest)
-    print(f"Downloading files to {rel_dest}")
+    download, skip = [], []
     for it in item_list:
-        local_name = prepare_local_path(dest, it, no_overwrite=no_overwrite)
+        local_name = local_path(dest, it)
+        entry = record.get(os.path.basename(local_name))
+        item = {"Key": it["Key"], "Size": it["Size"]}
         item_exists = os.path.exists(local_name)
-        if not (no_overwrite and item_exists):
-            s3_download_with_progress(s3, bucket_name, it, local_name)
-        elif item_exists and no_overwrite:
-            print(f"Skipping download of existing file {local_name}")
+        if sync and item_exists and is_unchanged(local_name, it, entry):
+            skip.append(dict(item, reason="unchanged"))
+        elif no_overwrite and item_exists:
+            skip.append(dict(item, reason="exists"))
+        else:
+            offset = Checkpoint(local_name, it).load()
+            download.append(dict(item, bytes=it["Size"] - offset))
 
+    return {
+        "prefix": path_spec,
+        "dest": dest,
+        "download": download,
+        "skip": skip,
+        "bytes": sum(it["bytes"] for it in download),
+        "skipped_bytes": sum(it["Size"] for it in skip),
+    }
 
-def prepare_local_path(dest: str, s3_item: dict, no_overwrite=False):
+
+def probe_throughput(
+    s3_client, bucket_name: str, s3_item: dict, connections=1, nbytes=PROBE_BYTES
+):
+    """
+    Measure the download rate in bytes per second by reading up to nbytes
+    of s3_item, split across `connections` connections at once.
+    """
+    size = min(s3_item["Size"], nbytes)
+    if size <= 0:
+        return None
+    step = math.ceil(size / connections)
+    ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+    def _get(byte_range):
+        resp = s3_client.get_object(
+            Bucket=bucket_name,
+            Key=s3_item["Key"],
+            Range=f"bytes={byte_range[0]}-{byte_range[1]}",
+        )
+        return len(resp["Body"].read())
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        received = sum(pool.map(_get, ranges))
+    return received / max(time.monotonic() - start, 1e-9)
+
+
+def plan_summary(s3_client, bucket_name, stages: list, path: str, jobs=1) -> dict:
+    """
+    Total up the plan_files results in stages, with the free space at path
+    and a throughput probe against the largest object to be downloaded.
+
+    notes:
+    The probe only feeds an estimate, so if it fails the plan carries the
+    error instead of failing; nothing is printed, to keep json plans intact.
+    """
+    items = [it for s in stages for it in s["download"]]
+    throughput = None
+    probe_error = None
+    if items:
+        largest = max(items, key=lambda it: it["Size"])
+        try:
+            throughput = probe_throughput(
+                s3_client, bucket_name, largest, connections=max(1, jobs)
+            )
+        except Exception as e:
+            probe_error = str(e)
+    return summarize(
+        stages,
+        free_bytes=free_space(path),
+        throughput=throughput,
+        max_bandwidth=max_bandwidth(),
+        probe_error=probe_error,
+    )
+
+
+def record_entry(local_name: str, s3_item: dict, digest: str) -> dict:
+    return {
+        "Key": s3_item["Key"],
+        "Size": s3_item["Size"],
+        "ETag": s3_item.get("ETag"),
+        "LastModified": str(s3_item.get("LastModified")),
+        "mtime_ns": os.stat(local_name).st_mtime_ns,
+        "MD5": digest,
+        "ETagVerified": s3_item.get("ETagVerified", False),
+    }
+
+
+def is_unchanged(local_name: str, s3_item: dict, entry: dict) -> bool:
+    """
+    True if local_name is the copy of s3_item that an earlier download
+    recorded in entry, and it has not been modified since.
+    """
+    if not entry or "MD5" not in entry:
+        return False
+
+    try:
+        st = os.stat(local_name)
+    except OSError:
+        return False
+
+    return (
+        st.st_size == s3_item["Size"]
+        and entry.get("Size") == s3_item["Size"]
+        and entry.get("ETag") == s3_item.get("ETag")
+        and entry.get("LastModified") == str(s3_item.get("LastModified"))
+        and entry.get("mtime_ns") == st.st_mtime_ns
+    )
+
+
+def fetched_digests(fetched: dict) -> dict:
+    """
+    Map file names to the md5 computed while they were downloaded, for the
+    records returned by get_files. Files that were skipped are not included.
+    """
+    return {k: v["MD5"] for k, v in fetched.items() if "MD5" in v}
+
+
+def fetched_verified(fetched: dict) -> list:
+    """
+    The file names, for the records returned by get_files, whose download
+    was checked against the ETag in the bucket listing.
+    """
+    return [k for k, v in fetched.items() if v.get("ETagVerified")]
+
+
+def fetched_sizes(fetched: dict) -> dict:
+    """
+    Map file names to their size in the bucket listing, for the records
+    returned by get_files.
+    """
+    return {k: v["Size"] for k, v in fetched.items() if "Size" in v}
+
+
+def download_objects(
+    s3_client,
+    bucket_name: str,
+    downloads: list,
+    *,
+    jobs=1,
+    on_complete=None,
+    slots=None,
+    **transfer_options,
+):
+    """
+    Download a list of (s3_item, local_name) pairs, using up to `jobs`
+    worker threads, and return a dict of local_name to md5 hex digest.
+
+    on_complete(local_name, digest) is called as each download finishes,
+    from the worker thread that ran it. transfer_options are passed on to
+    get_transfer_config for each object. slots lets several concurrent calls
+    share one set of progress bar positions.
+
+    If any download fails, no further downloads are started and the first
+    failure is raised once the downloads already in flight have finished.
+    If the calling thread is interrupted, e.g. by Ctrl-C, the downloads in
+    flight are told to stop at their next chunk (see _throttle.set_cancelled)
+    rather than run to the end; their .part checkpoints let the next run
+    resume them.
+    """
+    digests = {}
+    if slots is None and (jobs <= 1 or len(downloads) <= 1):
+        for s3_item, local_name in downloads:
+            digests[local_name] = s3_download_with_progress(
+                s3_client, bucket_name, s3_item, local_name, **transfer_options
+            )
+            if on_complete is not None:
+                on_complete(local_name, digests[local_name])
+        return digests
+
+    if slots is None:
+        slots = ProgressSlots(jobs)
+    failed = threading.Event()
+
+    def _download(s3_item, local_name):
+        if failed.is_set():
+            return
+        check_cancelled()
+        try:
+            with slots.slot() as position:
+                digests[local_name] = s3_download_with_progress(
+                    s3_client,
+                    bucket_name,
+                    s3_item,
+                    local_name,
+                    position=position,
+                    **transfer_options,
+                )
+        except Exception as e:
+            failed.set()
+            raise RuntimeError(f"download of {s3_item['Key']} failed: {e}") from e
+        if on_complete is not None:
+            on_complete(local_name, digests[local_name])
+        write(f"Downloaded {os.path.basename(local_name)}")
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = [pool.submit(_download, it, ln) for it, ln in downloads]
+        for fut in concurrent.futures.as_completed(futures):
+            fut.result()
+    except Exception:
+        failed.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    except BaseException:
+        failed.set()
+        set_cancelled()
+        # only waits for the transfers to abort; s3transfer cannot wind them
+        # down once the interpreter has started to exit
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+    return digests
+
+
+def download_objects_async(s3_client, bucket_name: str, downloads: list, **kwargs):
+    """
+    Run _aio.download_objects, which needs the optional aiohttp package.
+    """
+    if not downloads:
+        return {}
+    try:
+        from ._aio import download_objects as _download_objects
+    except ImportError as e:
+        raise RuntimeError(
+            f"the asyncio backend needs aiohttp ({e}); install it with "
+            "pip install opal_release_downloader[async]"
+        ) from e
+    return _download_objects(s3_client, bucket_name, downloads, **kwargs)
+
+
+def pool_size_for_jobs(jobs: int, max_concurrency: int = None) -> int:
+    """
+    Connection pool size that lets `jobs` concurrent downloads each keep
+    max_concurrency parts in flight.
+    """
+    if max_concurrency is None:
+        max_concurrency = MAX_AUTO_CONCURRENCY
+    per_job = max(DEFAULT_MAX_POOL_CONNECTIONS, max_concurrency)
+    return per_job * max(jobs, 1)
+
+
+def parse_size(s: str) -> int:
+    """
+    Parse a byte count such as "8388608", "16MB" or "1.5GiB". Decimal units
+    (KB, MB, GB) are powers of 1000, binary units (KiB, MiB, GiB) of 1024.
+    """
+    m = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*(?:([KMGT])(i?))?B?\s*", s, re.IGNORECASE)
+    if m is None:
+        raise ValueError(f"invalid size {s}")
+
+    number, unit, binary = m.groups()
+    base = 1024 if binary else 1000
+    exponent = "KMGT".index(unit.upper()) + 1 if unit else 0
+    return int(float(number) * base**exponent)
+
+
+def parse_rate(s: str) -> int:
+    """
+    Parse a transfer rate in bytes per second, e.g. "200MB/s" or "50MiB".
+    """
+    s = s.strip()
+    if s.lower().endswith("/s"):
+        s = s[:-2]
+    rate = parse_size(s)
+    if rate <= 0:
+        raise ValueError(f"invalid rate {s}")
+    return rate
+
+
+def get_transfer_config(
+    size: int, *, part_size=None, max_concurrency=None, max_io_queue=None
+) -> TransferConfig:
+    """
+    Build the multipart TransferConfig for an object of `size` bytes.
+
+    Options left as None are chosen from the size: parts grow with the
+    object (about 512 parts, never less than MIN_PART_SIZE) so multi-GB
+    objects are not split into thousands of requests, and every part of
+    smaller objects can be in flight at once, up to MAX_AUTO_CONCURRENCY.
+    Both are also held to what DOWNLOAD_BUFFER_SIZE allows, see below.
+
+    notes:
+    Parts are written in order, so parts that arrive early are held in
+    memory. Parts in flight ahead of the part being written are limited to
+    DOWNLOAD_BUFFER_SIZE bytes (and at least one part), or to
+    max_concurrency parts when that is given, so a download holds at most
+    about max(DOWNLOAD_BUFFER_SIZE, max_concurrency * part_size) bytes, plus
+    max_io_queue chunks of 256 KiB waiting for the disk. Parts only grow
+    while that budget still fits MIN_AUTO_CONCURRENCY of them.
+    """
+    if part_size is None:
+        part_size = MIN_PART_SIZE
+        while (
+            part_size * 512 < size
+            and part_size * 2 * MIN_AUTO_CONCURRENCY <= DOWNLOAD_BUFFER_SIZE
+        ):
+            part_size *= 2
+
+    # s3transfer's window for non-seekable downloads, 10 parts by default
+    buffered_parts = max(1, DOWNLOAD_BUFFER_SIZE // part_size)
+    if max_concurrency is None:
+        parts = max(1, math.ceil(size / part_size))
+        max_concurrency = min(parts, MAX_AUTO_CONCURRENCY, buffered_parts)
+    else:
+        # an explicit concurrency is taken as leave to buffer that many parts
+        buffered_parts = max(buffered_parts, max_concurrency)
+
+    kwargs = {}
+    if max_io_queue is not None:
+        kwargs["max_io_queue"] = max_io_queue
+
+    config = TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max_concurrency,
+        **kwargs,
+    )
+    config.max_in_memory_download_chunks = buffered_parts
+    return config
+
+
+def local_path(dest: str, s3_item: dict) -> str:
     key = s3_item["Key"]
     item_path = os.path.join(key.split("/")[-1])
-    local_name = os.path.realpath(os.path.join(dest, item_path))
+    return os.path.realpath(os.path.join(dest, item_path))
+
+
+def prepare_local_path(dest: str, s3_item: dict, no_overwrite=False):
+    local_name = local_path(dest, s3_item)
     local_dir = os.path.dirname(local_name)
 
     os.makedirs(local_dir, exist_ok=True)
@@ -59,18 +543,157 @@ def prepare_local_path(dest: str, s3_item: dict, no_overwrite=False):
     return local_name
 
 
+def download_range(
+    s3_client,
+    bucket_name: str,
+    s3_item: dict,
+    start: int,
+    writer,
+    config: TransferConfig,
+    callback=None,
+):
+    """
+    Download s3_item from byte `start` to the end with ranged GETs of
+    config.multipart_chunksize bytes, keeping up to
+    config.max_request_concurrency of them (and no more than
+    config.max_in_memory_download_chunks) in flight, and write them to
+    writer in order. callback is called from the request threads as data
+    arrives, as s3transfer does.
+    """
+    size = s3_item["Size"]
+    part_size = config.multipart_chunksize
+    ranges = iter(
+        (offset, min(offset + part_size, size) - 1)
+        for offset in range(start, size, part_size)
+    )
+
+    extra_args = {}
+    if s3_item.get("ETag"):
+        # fail rather than splice together two versions of the object
+        extra_args["IfMatch"] = s3_item["ETag"]
+
+    def _get(byte_range):
+        resp = s3_client.get_object(
+            Bucket=bucket_name,
+            Key=s3_item["Key"],
+            Range=f"bytes={byte_range[0]}-{byte_range[1]}",
+            **extra_args,
+        )
+        body = resp["Body"]
+        chunks = []
+        for chunk in iter(lambda: body.read(RANGE_READ_SIZE), b""):
+            chunks.append(chunk)
+            if callback is not None:
+                callback(len(chunk))
+        return b"".join(chunks)
+
+    window = max(
+        1, min(config.max_request_concurrency, config.max_in_memory_download_chunks)
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=window) as pool:
+        pending = collections.deque(
+            pool.submit(_get, r) for r in itertools.islice(ranges, window)
+        )
+        try:
+            while pending:
+                data = pending.popleft().result()
+                writer.write(data)
+                for r in itertools.islice(ranges, 1):
+                    pending.append(pool.submit(_get, r))
+        except BaseException:
+            for fut in pending:
+                fut.cancel()
+            raise
+
+
 def s3_download_with_progress(
-    s3_client, bucket_name: str, s3_item: dict, local_name: str
+    s3_client,
+    bucket_name: str,
+    s3_item: dict,
+    local_name: str,
+    position=None,
+    **transfer_options,
 ):
     s3_key = s3_item["Key"]
     size = s3_item["Size"]
     desc_path = os.path.basename(local_name)
-    with tqdm.tqdm(total=size, unit="B", unit_scale=True, desc=desc_path) as tq:
+
+    checkpoint = Checkpoint(local_name, s3_item)
+    offset = checkpoint.load()
+    if offset:
+        write(f"Resuming download of {desc_path} at byte {offset}")
+        _metrics.count("download_resumed")
+
+    with _metrics.timed("download", s3_key, nbytes=size - offset), progress(
+        desc_path, size, initial=offset, position=position
+    ) as tq:
 
         def update(sz):
+            # raising here aborts the transfer, which keeps its checkpoint
+            check_cancelled()
             tq.update(sz)
+            throttle(sz)
 
-        s3_client.download_file(bucket_name, s3_key, local_name, Callback=update)
+        config = get_transfer_config(size, **transfer_options)
+        with open(checkpoint.part_name, "r+b" if offset else "wb") as f:
+            writer = HashingWriter(f, checkpoint=checkpoint, etag=etag_hasher(s3_item))
+            try:
+                if offset:
+                    writer.update_from(f, offset)
+                    f.seek(offset)
+                    f.truncate()
+                    download_range(
+                        s3_client, bucket_name, s3_item, offset, writer, config, update
+                    )
+                else:
+                    s3_client.download_fileobj(
+                        bucket_name, s3_key, writer, Callback=update, Config=config
+                    )
+            except BaseException:
+                # keep what made it to disk for the next run
+                f.flush()
+                checkpoint.save()
+                raise
+
+    finish_download(local_name, s3_item, checkpoint, writer)
+    return writer.hexdigest()
+
+
+def add_transfer_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="threads",
+        help="download engine; asyncio keeps many small requests in flight "
+        "on high-latency links (needs aiohttp)",
+    )
+    parser.add_argument(
+        "--part-size",
+        type=parse_size,
+        default=None,
+        help="multipart chunk size, e.g. 16MiB (default: chosen per object size)",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="parts of one object to download at once (default: chosen per "
+        "object); parts that arrive out of order wait in memory, so each "
+        "download may hold up to this many parts, i.e. up to max-concurrency "
+        f"x part-size bytes (default: about {DOWNLOAD_BUFFER_SIZE // 1024**2}MiB)",
+    )
+    parser.add_argument(
+        "--max-io-queue",
+        type=int,
+        default=None,
+        help="maximum number of downloaded chunks waiting to be written",
+    )
+    parser.add_argument(
+        "--max-bandwidth",
+        type=parse_rate,
+        default=None,
+        help="limit the combined download rate, e.g. 200MB/s",
+    )
 
 
 def main():
@@ -78,11 +701,65 @@ def main():
     parser.add_argument("bucket_name", help="name of bucket")
     parser.add_argument("path_spec", nargs="?", default=None, help="path_spec")
     parser.add_argument("--dest", "-d", help="destination directory")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="number of files to download concurrently",
+    )
+    parser.add_argument(
+        "--max-pool-connections",
+        type=int,
+        default=None,
+        help="size of the shared s3 connection pool (default: scales with --jobs)",
+    )
+    parser.add_argument(
+        "--sync",
+        default=False,
+        action="store_true",
+        help="only download files that changed since they were last downloaded",
+    )
+    add_transfer_arguments(parser)
+    add_index_arguments(parser)
+    add_plan_argument(parser)
+    _metrics.add_metrics_argument(parser)
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    set_max_pool_connections(
+        args.max_pool_connections or pool_size_for_jobs(args.jobs, args.max_concurrency)
+    )
+    set_index_ttl(0 if args.refresh_index else args.index_ttl)
+    set_max_bandwidth(args.max_bandwidth)
 
-    with display():
+    with display(concurrent=args.jobs > 1), _metrics.reporting(args.metrics_file):
         try:
-            get_files(args.bucket_name, args.path_spec, dest=args.dest)
+            if args.plan is not None:
+                plan = plan_files(
+                    args.bucket_name, args.path_spec, dest=args.dest, sync=args.sync
+                )
+                summary = plan_summary(
+                    get_s3_client(),
+                    args.bucket_name,
+                    [plan],
+                    plan["dest"],
+                    jobs=args.jobs,
+                )
+                print_plan(summary, args.plan)
+                return
+
+            get_files(
+                args.bucket_name,
+                args.path_spec,
+                dest=args.dest,
+                sync=args.sync,
+                jobs=args.jobs,
+                part_size=args.part_size,
+                max_concurrency=args.max_concurrency,
+                max_io_queue=args.max_io_queue,
+                backend=args.backend,
+            )
         except Exception as e:
             error(f"FAILURE: {str(e)}")
             sys.exit(1)
@@ -1,43 +1,155 @@
 import argparse
-import boto3
 import datetime
 import sys
 import json
+import os
+import threading
 
-import botocore as bc
+from . import _metrics
+from ._constants import (
+    DEFAULT_INDEX_TTL,
+    DEFAULT_MAX_POOL_CONNECTIONS,
+    DEFAULT_REGION,
+    S3_EXTRA_HINT,
+)
 
-from ._constants import DEFAULT_REGION
+try:
+    import boto3
+    import botocore as bc
+except ImportError as e:
+    raise ImportError(S3_EXTRA_HINT) from e
 from ._date import date, date_fmt, date_tag
 from ._display import display, error
+from ._index import cached_listing, set_index_ttl
 
+# output formats for --all: one indented json document, or one json object
+# per line, written as the pages of the listing arrive
+FORMATS = ("json", "ndjson")
 
-def get_s3_client(region_name: str = DEFAULT_REGION):
-    s3 = boto3.client(
-        "s3",
-        region_name=region_name,
-        config=bc.config.Config(signature_version=bc.UNSIGNED),
-    )
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+_max_pool_connections = DEFAULT_MAX_POOL_CONNECTIONS
+
+
+def set_max_pool_connections(max_pool_connections: int):
+    """
+    Set the connection pool size used by clients created after this call.
+    """
+    global _max_pool_connections
+    _max_pool_connections = max_pool_connections
+
+
+def clear_s3_clients():
+    with _s3_clients_lock:
+        _s3_clients.clear()
+
+
+def get_s3_client(region_name: str = DEFAULT_REGION, max_pool_connections=None):
+    """
+    Return the process-wide unsigned s3 client for a region and pool size,
+    creating it on first use. boto3 clients are thread safe, so listings and
+    downloads share one client and its keep-alive connections.
+    """
+    if max_pool_connections is None:
+        max_pool_connections = _max_pool_connections
+
+    key = (region_name, max_pool_connections)
+    with _s3_clients_lock:
+        s3 = _s3_clients.get(key)
+        if s3 is None:
+            s3 = boto3.client(
+                "s3",
+                region_name=region_name,
+                config=bc.config.Config(
+                    signature_version=bc.UNSIGNED,
+                    max_pool_connections=max_pool_connections,
+                ),
+            )
+            _s3_clients[key] = s3
     return s3
 
 
+def iter_bucket_pages(
+    bucket_name: str,
+    *,
+    prefix: str = "",
+    delimiter: str = None,
+    region_name: str = DEFAULT_REGION,
+):
+    """
+    Yield the raw list_objects_v2 responses for every page under prefix, so
+    listings are not truncated at 1000 keys.
+    """
+    s3 = get_s3_client(region_name=region_name)
+    paginator = s3.get_paginator("list_objects_v2")
+    kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+    if delimiter is not None:
+        kwargs["Delimiter"] = delimiter
+    pages = iter(paginator.paginate(**kwargs))
+    while True:
+        # time the request alone, not whatever the caller does with the page
+        with _metrics.timed("list_page"):
+            page = next(pages, None)
+        if page is None:
+            return
+        yield page
+
+
+def iter_bucket_objects(
+    bucket_name: str, *, prefix: str = "", region_name: str = DEFAULT_REGION
+):
+    for page in iter_bucket_pages(bucket_name, prefix=prefix, region_name=region_name):
+        yield from page.get("Contents", [])
+
+
+def iter_common_prefixes(
+    bucket_name: str,
+    *,
+    prefix: str = "",
+    delimiter: str = "/",
+    region_name: str = DEFAULT_REGION,
+):
+    """
+    Yield the common prefixes directly below prefix (e.g. the release tags
+    at the top of the bucket) without listing the objects beneath them.
+    """
+    for page in iter_bucket_pages(
+        bucket_name, prefix=prefix, delimiter=delimiter, region_name=region_name
+    ):
+        for p in page.get("CommonPrefixes", []):
+            yield p["Prefix"]
+
+
 def list_bucket_objects(
     bucket_name: str, *, prefix: str = "", region_name: str = DEFAULT_REGION
-) -> dict:
-    s3 = get_s3_client(region_name=region_name)
-    obj_list = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-    if obj_list["KeyCount"] == 0:
+) -> list:
+    obj_list = cached_listing(
+        bucket_name,
+        region_name,
+        f"objects/{prefix}",
+        lambda: list(
+            iter_bucket_objects(bucket_name, prefix=prefix, region_name=region_name)
+        ),
+    )
+    if not obj_list:
         raise RuntimeError(
             f"No objects found in bucket {bucket_name} with prefix {prefix}"
         )
-    return obj_list["Contents"]
+    return obj_list
 
 
 def get_list(bucket_name, *, region_name=DEFAULT_REGION):
-    obj_list = list_bucket_objects(bucket_name, region_name=region_name)
+    prefixes = cached_listing(
+        bucket_name,
+        region_name,
+        "prefixes/",
+        lambda: list(iter_common_prefixes(bucket_name, region_name=region_name)),
+    )
+
     s = set()
-    for o in obj_list:
+    for p in prefixes:
         try:
-            key = o["Key"].split("/")[0]
+            key = p.split("/")[0]
             s.add(date(key))
         except:
             continue
@@ -55,11 +167,61 @@ def get_all(bucket_name, *, prefix="", region_name=DEFAULT_REGION):
     return obj_list
 
 
-def print_all(bucket_name, *, prefix="", region_name=DEFAULT_REGION):
+def project(obj: dict, fields: list = None) -> dict:
+    """
+    Keep only the given fields of a listed object, in the order given.
+    """
+    if fields is None:
+        return obj
+    return {f: obj[f] for f in fields if f in obj}
+
+
+def print_all(
+    bucket_name, *, prefix="", region_name=DEFAULT_REGION, format="json", fields=None
+):
+    if format == "ndjson":
+        stream_all(bucket_name, prefix=prefix, region_name=region_name, fields=fields)
+        return
+
     obj_list = get_all(bucket_name, prefix=prefix, region_name=region_name)
+    if fields is not None:
+        obj_list = [project(o, fields) for o in obj_list]
     json.dump(obj_list, sys.stdout, indent=2, default=str)
 
 
+def stream_all(bucket_name, *, prefix="", region_name=DEFAULT_REGION, fields=None):
+    """
+    Write every object under prefix to stdout as one json object per line,
+    flushing after each page of the listing, so a consumer can start before
+    the listing is complete and memory use does not grow with the bucket.
+
+    notes:
+    This always lists the bucket; the listing index holds whole listings
+    and would defeat the point.
+    """
+    count = 0
+    for page in iter_bucket_pages(bucket_name, prefix=prefix, region_name=region_name):
+        for obj in page.get("Contents", []):
+            sys.stdout.write(json.dumps(project(obj, fields), default=str) + "\n")
+            count += 1
+        sys.stdout.flush()
+
+    if not count:
+        raise RuntimeError(
+            f"No objects found in bucket {bucket_name} with prefix {prefix}"
+        )
+
+
+def parse_fields(s: str) -> list:
+    """
+    Parse a comma separated list of object fields, e.g. "Key,Size,ETag".
+    """
+    fields = [f.strip() for f in s.split(",") if f.strip()]
+    if not fields:
+        raise ValueError(f"invalid field list {s}")
+    return fields
+
+
 def print_files(bucket_name, *, prefix="", region_name=DEFAULT_REGION):
     obj_list = get_all(bucket_name, prefix=prefix, region_name=region_name)
     for o in obj_list:
@@ -67,7 +229,26 @@ def print_files(bucket_name, *, prefix="", region_name=DEFAULT_REGION):
 
 
 def get_latest(bucket_name, *, region_name=DEFAULT_REGION):
-    return next(get_list(bucket_name, region_name=region_name))
+    latest = next(get_list(bucket_name, region_name=region_name), None)
+    if latest is None:
+        raise RuntimeError(f"No releases found in bucket {bucket_name}")
+    return latest
+
+
+def add_index_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--index-ttl",
+        type=float,
+        default=DEFAULT_INDEX_TTL,
+        help="seconds to reuse bucket listings cached by an earlier run "
+        f"(default: {DEFAULT_INDEX_TTL})",
+    )
+    parser.add_argument(
+        "--refresh-index",
+        default=False,
+        action="store_true",
+        help="list the bucket again instead of using cached listings",
+    )
 
 
 def main():
@@ -77,18 +258,41 @@ def main():
     parser.add_argument(
         "--all", "-a", help="show all", action="store_true", default=False
     )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="json",
+        help="output format for --all; ndjson writes one object per line as "
+        "the listing arrives",
+    )
+    parser.add_argument(
+        "--fields",
+        type=parse_fields,
+        default=None,
+        help="comma separated object fields to show with --all, e.g. Key,Size,ETag",
+    )
+    add_index_arguments(parser)
+    _metrics.add_metrics_argument(parser)
     args = parser.parse_args()
+    if not args.all and (args.format != "json" or args.fields is not None):
+        parser.error("--format and --fields only apply with --all")
+    set_index_ttl(0 if args.refresh_index else args.index_ttl)
 
-    with display():
+    with display(), _metrics.reporting(args.metrics_file):
         try:
             if args.all:
-                print_all(args.bucket_name)
+                print_all(args.bucket_name, format=args.format, fields=args.fields)
                 return
             elif args.path_spec:
                 print_files(args.bucket_name, prefix=date_tag(args.path_spec))
                 return
 
             print_list(args.bucket_name)
+        except BrokenPipeError:
+            # the reader went away, e.g. piped into head; say nothing more
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            sys.exit(1)
         except Exception as e:
             error(f"FAILURE: {str(e)}")
             sys.exit(1)
@@ -1,33 +1,102 @@
 import argparse
+import concurrent.futures
+import fnmatch
 import glob
 import hashlib
 import os
 import sys
+import threading
+import time
 import yaml
 import types
 
 import tqdm
 import colorama
 
-from ._display import display, error, warn
+from . import _metrics
+from ._constants import (
+    CHECKPOINT_SUFFIX,
+    FETCH_RECORD,
+    PART_SUFFIX,
+    STATE_FILES,
+    VERIFY_CACHE,
+)
+from ._display import ProgressSlots, display, error, progress, warn, write
+from ._state import load_record, save_record
+from ._throttle import check_cancelled
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# seconds between progress bar updates while hashing
+PROGRESS_INTERVAL = 0.1
+
+# the checksum files verify looks for, by the hashlib algorithm they hold
+CHECKSUM_FILES = {
+    "md5": "md5sums_*",
+    "sha256": "sha256sums_*",
+    "blake2b": "b2sums_*",
+}
+# how to tell the algorithm of a checksum file with any other name
+DIGEST_LENGTHS = {32: "md5", 64: "sha256", 128: "blake2b"}
+
+_block_size = DEFAULT_BLOCK_SIZE
+
+# verify_directory works from inside the directory it verifies; the working
+# directory is shared by every thread, so only one verify may run at a time
+_chdir_lock = threading.Lock()
+
+
+def set_block_size(block_size: int):
+    """
+    Set the read size used by hash_file.
+    """
+    global _block_size
+    _block_size = block_size
 
 
-def md5sum(filename):
-    hash_ = hashlib.md5()
+def md5sum(filename, position=None):
+    return hash_file(filename, ["md5"], position=position)["md5"]
 
-    file_size = os.path.getsize(filename)
-    with tqdm.tqdm(total=file_size, unit="B", unit_scale=True, desc=filename) as tq:
-        with open(filename, "rb") as f:
-            block = f.read(4096)
-            bytes_read = len(block)
-            while block:
-                hash_.update(block)
-                tq.update(bytes_read)
 
-                block = f.read(4096)
-                bytes_read = len(block)
+def hash_file(filename, algorithms: list, position=None) -> dict:
+    """
+    Compute the hex digest of filename for every hashlib algorithm in
+    algorithms and return them as a dict, reading the file only once.
+
+    notes:
+    Reads into one reusable buffer and only updates the progress bar every
+    PROGRESS_INTERVAL seconds, so hashing is limited by the disk rather than
+    by per-block python overhead.
+    """
+    hashes = {alg: getattr(hashlib, alg)() for alg in algorithms}
+    buf = bytearray(_block_size)
+    view = memoryview(buf)
 
-    return hash_.hexdigest()
+    file_size = os.path.getsize(filename)
+    with _metrics.timed("hash", filename, nbytes=file_size), progress(
+        filename, file_size, position=position
+    ) as tq:
+        with open(filename, "rb", buffering=0) as f:
+            pending = 0
+            last_update = time.monotonic()
+            bytes_read = f.readinto(buf)
+            while bytes_read:
+                block = view[:bytes_read]
+                for hash_ in hashes.values():
+                    hash_.update(block)
+                pending += bytes_read
+
+                now = time.monotonic()
+                if now - last_update >= PROGRESS_INTERVAL:
+                    check_cancelled()
+                    tq.update(pending)
+                    pending = 0
+                    last_update = now
+
+                bytes_read = f.readinto(buf)
+            if pending:
+                tq.update(pending)
+
+    return {alg: hash_.hexdigest() for alg, hash_ in hashes.items()}
 
 
 def read_checksums_from_file(checksum: str) -> dict:
@@ -40,7 +109,8 @@ def read_checksums_from_file(checksum: str) -> dict:
             if len(parts) != 2:
                 raise Exception(f"malformed line in {checksum}")
 
-            filename = os.path.basename(parts[1])
+            # "*" marks a file hashed in binary mode
+            filename = os.path.basename(parts[1].lstrip("*"))
             hash_ = parts[0]
             sums[filename] = hash_
 
@@ -48,33 +118,316 @@ def read_checksums_from_file(checksum: str) -> dict:
     return sums
 
 
-def check_checksums_operator(sums: dict, strict: bool) -> types.FunctionType:
+def checksum_algorithm(checksum: str, sums: dict) -> str:
+    """
+    Tell which algorithm the checksum file holds, from its name if it is one
+    of CHECKSUM_FILES and otherwise from the length of its digests. Files
+    that cannot be told apart are taken to hold md5 sums.
+    """
+    for alg, pattern in CHECKSUM_FILES.items():
+        if fnmatch.fnmatchcase(checksum, pattern):
+            return alg
+
+    lengths = {len(s) for s in sums.values()}
+    if len(lengths) == 1:
+        return DIGEST_LENGTHS.get(lengths.pop(), "md5")
+    return "md5"
+
+
+def read_checksums(checksums: list) -> dict:
+    """
+    Read several checksum files, e.g. an md5sums and a sha256sums file, into
+    one dict of file name to {algorithm: hex digest}.
+    """
+    sums = {}
+    for checksum in checksums:
+        file_sums = read_checksums_from_file(checksum)
+        alg = checksum_algorithm(checksum, file_sums)
+        for f, sum_ in file_sums.items():
+            sums.setdefault(f, {})[alg] = sum_.lower()
+    return sums
+
+
+def read_expected_sizes(manifest: str = None, sizes: dict = None) -> dict:
+    """
+    Collect the expected size of each file from, in increasing priority:
+    the bucket listing recorded by fetch in FETCH_RECORD, the manifest if it
+    maps file names to sizes rather than just listing them, and sizes.
+
+    notes:
+    This should run from within the directory being verified
+    """
+    expected = {}
+    for f, entry in load_record(FETCH_RECORD).items():
+        if isinstance(entry, dict) and "Size" in entry:
+            expected[f] = entry["Size"]
+
+    if manifest is not None:
+        with open(manifest, "r") as f:
+            listed = yaml.load(f, Loader=yaml.SafeLoader)
+        if isinstance(listed, dict):
+            expected.update({k: v for k, v in listed.items() if v is not None})
+
+    if sizes is not None:
+        expected.update(sizes)
+    return expected
+
+
+def check_sizes(sizes: dict, snapshot: dict):
+    """
+    Compare the sizes in a scan_directory snapshot with the expected sizes,
+    so that truncated or wrong files are reported before anything is hashed.
+    Files missing from the snapshot are left to the manifest and checksum
+    checks.
+    """
+    wrong = []
+    for f in sorted(sizes):
+        if f in snapshot and snapshot[f].st_size != int(sizes[f]):
+            wrong.append(f"{f}: {snapshot[f].st_size} bytes, expected {sizes[f]}")
+
+    if wrong:
+        raise Exception(
+            f"{len(wrong)} file(s) have the wrong size\n" + "\n".join(wrong)
+        )
+
+
+def cache_entry(st: os.stat_result, digest) -> dict:
+    """
+    Build a verify cache entry tying a digest to the identity of the file it
+    was computed from. digest is an md5 hex digest or a dict of algorithm to
+    hex digest.
+    """
+    if isinstance(digest, str):
+        digest = {"md5": digest}
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "inode": st.st_ino,
+        **digest,
+    }
+
+
+def cached_digests(cache: dict, f: str, st: os.stat_result) -> dict:
+    """
+    Return the cached digests of f by algorithm, or an empty dict if f is
+    not cached or has changed (different size, mtime or inode) since it was
+    hashed.
+    """
+    entry = cache.get(f)
+    if not isinstance(entry, dict):
+        return {}
+
+    identity = cache_entry(st, {})
+    if any(entry.get(k) != v for k, v in identity.items()):
+        return {}
+    return {
+        alg: sum_
+        for alg, sum_ in entry.items()
+        if alg in CHECKSUM_FILES and isinstance(sum_, str) and sum_
+    }
+
+
+def cached_digest(cache: dict, f: str, st: os.stat_result):
+    """
+    Return the cached md5 of f, or None (see cached_digests).
+    """
+    return cached_digests(cache, f, st).get("md5")
+
+
+def check_checksums_operator(
+    sums: dict,
+    strict: bool,
+    digests: dict = None,
+    slots: ProgressSlots = None,
+    cache: dict = None,
+    stats: dict = None,
+    verified: list = None,
+) -> types.FunctionType:
+    """
+    notes:
+    sums maps file names to their expected md5 sum, or to a dict of
+    algorithm to expected digest (see read_checksums); every digest a file
+    needs is computed from a single read of it
+
+    digests maps file names to md5 sums that are already known, e.g. computed
+    while the file was downloaded, so that those files are not read again
+
+    slots is needed when the operator is called from several threads at once
+
+    cache is a verify cache (see cache_entry); unchanged files are not read
+    again, and the digest of every checked file is stored back into it
+
+    stats maps file names to stat results already taken by scan_directory
+
+    verified lists files whose download was already checked against their S3
+    ETag; they pass even if no checksum file covers them
+    """
+    if digests is None:
+        digests = {}
+    if stats is None:
+        stats = {}
+    verified = set(verified or [])
+
     def _check_checksums_operator(f: str):
         if not f in sums:
+            if f in verified:
+                _metrics.count("etag_verified")
+                return
             if strict:
                 raise Exception(f'file "{f}" no checksum found.')
             else:
                 warn(f'WARNING: no checksum found for "{f}"')
                 return
 
-        sum_ = md5sum(f)
-        if sum_ != sums[f]:
-            raise Exception(f'file "{f}" checksum {sum_}')
+        expected = sums[f] if isinstance(sums[f], dict) else {"md5": sums[f]}
+        found = {}
+        if "md5" in expected and digests.get(f) is not None:
+            found["md5"] = digests[f]
+            _metrics.count("hash_known_digest")
+
+        st = None
+        cached = {}
+        if cache is not None:
+            st = stats[f] if f in stats else os.stat(f)
+            cached = cached_digests(cache, f, st)
+            if any(alg not in found for alg in expected if alg in cached):
+                _metrics.count("hash_cache_hit")
+            found = {**cached, **found}
+
+        missing = [alg for alg in expected if alg not in found]
+        if missing:
+            if slots is not None:
+                with slots.slot() as position:
+                    found.update(hash_file(f, missing, position=position))
+            else:
+                found.update(hash_file(f, missing))
+
+        if cache is not None:
+            cache[f] = cache_entry(st, found)
+        for alg, sum_ in expected.items():
+            if found[alg] != sum_:
+                raise Exception(f'file "{f}" checksum {found[alg]}')
 
     return _check_checksums_operator
 
 
-def check_checksums(checksum, *, excluded_files=[], strict=True):
+def check_checksums(
+    checksum,
+    *,
+    excluded_files=[],
+    strict=True,
+    digests=None,
+    jobs=1,
+    cache=None,
+    snapshot=None,
+    verified=None,
+):
     """
     notes:
     This should run from within the directory where the checksum file and
     rest of the files are
+
+    checksum is one checksum file or a list of them; with several, e.g. an
+    md5sums and a sha256sums file, each file is still only read once.
+
+    snapshot is the result of scan_directory("."); if given, the directory
+    is not listed again.
+
+    With jobs > 1, files are hashed on that many threads (hashlib releases
+    the GIL), and every file is checked before failures are reported.
     """
-    sums = read_checksums_from_file(checksum)
+    sums = read_checksums([checksum] if isinstance(checksum, str) else checksum)
     print("verifying checksums")
 
-    operator = check_checksums_operator(sums, strict)
-    operate_on_files(".", operator, fail_if_subdirs=True, excluded_files=excluded_files)
+    if jobs <= 1:
+        operator = check_checksums_operator(
+            sums,
+            strict,
+            digests=digests,
+            cache=cache,
+            stats=snapshot,
+            verified=verified,
+        )
+        operate_on_files(
+            ".",
+            operator,
+            fail_if_subdirs=True,
+            excluded_files=excluded_files,
+            snapshot=snapshot,
+        )
+        return
+
+    files = []
+    operate_on_files(
+        ".",
+        files.append,
+        fail_if_subdirs=True,
+        excluded_files=excluded_files,
+        snapshot=snapshot,
+    )
+
+    operator = check_checksums_operator(
+        sums,
+        strict,
+        digests=digests,
+        slots=ProgressSlots(jobs),
+        cache=cache,
+        stats=snapshot,
+        verified=verified,
+    )
+    start = time.monotonic()
+    operate_on_files_parallel(files, operator, jobs)
+    elapsed = time.monotonic() - start
+
+    if snapshot is None:
+        total = sum(os.path.getsize(f) for f in files)
+    else:
+        total = sum(snapshot[f].st_size for f in files)
+    rate = tqdm.tqdm.format_sizeof(total / max(elapsed, 1e-9), "B/s")
+    size = tqdm.tqdm.format_sizeof(total, "B")
+    write(f"verified {len(files)} files ({size}) in {elapsed:.1f}s, {rate}")
+
+
+def operate_on_files_parallel(files: list, operator: types.FunctionType, jobs: int):
+    """
+    Apply operator to every file on `jobs` threads. All files are processed
+    even if some fail; failures are then raised together, sorted by file
+    name, so the result does not depend on thread scheduling.
+    """
+    failures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(operator, f): f for f in files}
+        for fut in concurrent.futures.as_completed(futures):
+            e = fut.exception()
+            if e is not None:
+                failures[futures[fut]] = e
+
+    if failures:
+        lines = [f"{f}: {failures[f]}" for f in sorted(failures)]
+        raise Exception(
+            f"{len(failures)} file(s) failed verification\n" + "\n".join(lines)
+        )
+
+
+def scan_directory(root_dir: str) -> dict:
+    """
+    List a flat directory in one os.scandir pass and return a dict of file
+    name to stat result. Raises if root_dir contains a directory.
+
+    notes:
+    Every file is still stat()ed once: only on Windows does the directory
+    listing carry the stat result itself. What this saves is the repeated
+    listings and stat calls of the checks that used to walk the directory
+    on their own; they all share this snapshot instead.
+    """
+    snapshot = {}
+    with os.scandir(root_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                cur_dir = os.path.join(os.getcwd(), root_dir)
+                raise Exception(f"unexpected directory layout in {cur_dir}")
+            snapshot[entry.name] = entry.stat()
+    return snapshot
 
 
 def operate_on_files(
@@ -83,8 +436,22 @@ def operate_on_files(
     fail_if_subdirs: bool = False,
     excluded_files: list = [],
     expected_files=[],
+    snapshot: dict = None,
 ):
-    for root, dirs, files in os.walk(root_dir):
+    """
+    notes:
+    snapshot is the result of scan_directory(root_dir); if given, its file
+    names are used instead of walking root_dir again.
+    """
+    excluded_files = set(excluded_files)
+    expected_files = set(expected_files)
+
+    if snapshot is None:
+        listing = os.walk(root_dir)
+    else:
+        listing = [(root_dir, [], list(snapshot))]
+
+    for root, dirs, files in listing:
         if fail_if_subdirs and dirs:
             cur_dir = os.path.join(os.getcwd(), root)
             raise Exception(f"unexpected directory layout in {cur_dir}")
@@ -106,11 +473,14 @@ def check_manifest_operator(files_found: dict, tq: tqdm.tqdm):
     return _check_manifest_operator
 
 
-def check_manifest(manifest, *, excluded_files=[]):
+def check_manifest(manifest, *, excluded_files=[], snapshot=None):
     """
     notes:
     This should run from within the directory where the manifest and files are
 
+    snapshot is the result of scan_directory("."); if given, the directory
+    is not listed again.
+
     This should fail for 2 reasons
     - a file is in the folder that shouldn't be there
     - a file is missing from the folder
@@ -118,7 +488,9 @@ def check_manifest(manifest, *, excluded_files=[]):
     with open(manifest, "r") as f:
         expected_files = yaml.load(f, Loader=yaml.SafeLoader)
 
-    with tqdm.tqdm(desc="checking_manifest", total=len(expected_files)) as tq:
+    with _metrics.timed("manifest", manifest), tqdm.tqdm(
+        desc="checking_manifest", total=len(expected_files)
+    ) as tq:
         files_found = {}
 
         for f in expected_files:
@@ -131,6 +503,7 @@ def check_manifest(manifest, *, excluded_files=[]):
             fail_if_subdirs=True,
             excluded_files=excluded_files,
             expected_files=expected_files,
+            snapshot=snapshot,
         )
 
         for k, v in files_found.items():
@@ -138,6 +511,14 @@ def check_manifest(manifest, *, excluded_files=[]):
                 raise Exception(f'file "{k}" not found')
 
 
+def partial_download(name: str) -> bool:
+    """
+    True for the .part and .part.json files an interrupted download leaves
+    behind; they are resumed by the next fetch and are not artifacts.
+    """
+    return name.endswith((PART_SUFFIX, CHECKPOINT_SUFFIX))
+
+
 def find_file_and_confirm(
     glob_str: str, file_name: str = None, search: bool = False
 ) -> bool:
@@ -151,7 +532,7 @@ def find_file_and_confirm(
     if (not search) and (file_name is None):
         raise Exception(f"File name not provided and search disabled")
     if search and (file_name is None):
-        files = glob.glob(glob_str)
+        files = [f for f in glob.glob(glob_str) if not partial_download(f)]
         if len(files) != 1:
             raise Exception("Unable to find checksum file")
         found_file = files[0]
@@ -163,6 +544,44 @@ def find_file_and_confirm(
     return found_file
 
 
+def checksum_files(names) -> list:
+    """
+    Return the names that are checksum files (see CHECKSUM_FILES), sorted.
+    """
+    return sorted(
+        name
+        for name in names
+        if any(fnmatch.fnmatchcase(name, p) for p in CHECKSUM_FILES.values())
+    )
+
+
+def find_checksum_files(checksum=None, search: bool = False) -> list:
+    """
+    Confirm and return the checksum files to verify against: checksum, a
+    file name or a list of them, or, when searching, the md5sums_*,
+    sha256sums_* and b2sums_* file (at most one of each) in the directory.
+
+    Assumes cwd is the search path.
+    """
+    if search and checksum is None:
+        found = []
+        for pattern in CHECKSUM_FILES.values():
+            files = [f for f in glob.glob(pattern) if not partial_download(f)]
+            if len(files) > 1:
+                raise Exception(f"found more than one {pattern} checksum file")
+            found.extend(files)
+        if not found:
+            raise Exception("Unable to find checksum file")
+        return found
+
+    if checksum is None or isinstance(checksum, str):
+        checksum = [checksum]
+    return [
+        find_file_and_confirm(CHECKSUM_FILES["md5"], file_name=c, search=search)
+        for c in checksum
+    ]
+
+
 def verify_directory(
     directory,
     *,
@@ -171,32 +590,94 @@ def verify_directory(
     search=False,
     require_manifest=True,
     strict_checksum=True,
+    digests=None,
+    jobs=1,
+    rehash=False,
+    sizes=None,
+    verified=None,
 ):
+    """
+    notes:
+    checksum is a checksum file or a list of them; with search and no
+    checksum, every kind of checksum file in CHECKSUM_FILES is looked for.
 
-    cur_dir = os.getcwd()
+    Before anything is hashed, file sizes are checked against sizes, the
+    sizes recorded by fetch and any sizes in the manifest (see
+    read_expected_sizes).
 
-    if not os.path.exists(directory):
-        raise Exception("Unable to find directory")
+    Digests are cached in VERIFY_CACHE inside the directory, so files that
+    have not changed since the last run are not hashed again. rehash ignores
+    the cached digests (the cache is still refreshed).
 
-    if not os.path.isdir(directory):
-        raise Exception(f"directory {directory} is not a valid directory")
+    verified lists files already checked against their S3 ETag while they
+    were downloaded (see fetch.fetched_verified); a checksum file does not
+    need to cover them.
 
-    try:
-        os.chdir(directory)
-        checksum = find_file_and_confirm("md5sums_*", file_name=checksum, search=search)
+    This changes the working directory while it runs, so anything running
+    alongside it in other threads must only use absolute paths.
+    """
 
-        if require_manifest:
-            manifest = find_file_and_confirm(
-                "file_manifest_*.yml", file_name=manifest, search=search
-            )
+    with _chdir_lock, _metrics.timed("verify", directory):
+        cur_dir = os.getcwd()
 
-            check_manifest(manifest, excluded_files=[checksum])
-            print()
+        if not os.path.exists(directory):
+            raise Exception("Unable to find directory")
 
-        check_checksums(checksum, excluded_files=[checksum], strict=strict_checksum)
+        if not os.path.isdir(directory):
+            raise Exception(f"directory {directory} is not a valid directory")
 
-    finally:
-        os.chdir(cur_dir)
+        try:
+            os.chdir(directory)
+            checksums = find_checksum_files(checksum, search=search)
+
+            # one listing of the directory serves every check below
+            snapshot = scan_directory(".")
+            for f in sorted(filter(partial_download, snapshot)):
+                warn(f"WARNING: ignoring partial download {f}")
+                del snapshot[f]
+
+            if require_manifest:
+                manifest = find_file_and_confirm(
+                    "file_manifest_*.yml", file_name=manifest, search=search
+                )
+
+                check_manifest(
+                    manifest,
+                    excluded_files=[*checksums, *STATE_FILES],
+                    snapshot=snapshot,
+                )
+                print()
+
+            with _metrics.timed("size_check"):
+                expected_sizes = read_expected_sizes(
+                    manifest if require_manifest else None, sizes
+                )
+                check_sizes(expected_sizes, snapshot)
+
+            cache = {} if rehash else load_record(VERIFY_CACHE)
+            try:
+                check_checksums(
+                    checksums,
+                    excluded_files=[*checksums, *STATE_FILES],
+                    strict=strict_checksum,
+                    digests=digests,
+                    jobs=jobs,
+                    cache=cache,
+                    snapshot=snapshot,
+                    verified=verified,
+                )
+            finally:
+                # forget files that have since been removed
+                cache = {f: e for f, e in cache.items() if f in snapshot}
+                try:
+                    save_record(VERIFY_CACHE, cache)
+                except OSError:
+                    # the cache is only an optimization; the directory may
+                    # be read-only, e.g. a mounted DVD
+                    pass
+
+        finally:
+            os.chdir(cur_dir)
 
 
 def main():
@@ -223,10 +704,36 @@ def main():
         action="store_true",
         help="don't fail if a file is not in the checksum list",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="number of files to hash concurrently",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=DEFAULT_BLOCK_SIZE,
+        help="number of bytes to read at a time while hashing",
+    )
+    parser.add_argument(
+        "--rehash",
+        "--no-cache",
+        default=False,
+        action="store_true",
+        help="hash every file, ignoring digests cached by earlier runs",
+    )
+    _metrics.add_metrics_argument(parser)
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.block_size < 1:
+        parser.error("--block-size must be at least 1")
+    set_block_size(args.block_size)
 
-    with display():
+    with display(concurrent=args.jobs > 1), _metrics.reporting(args.metrics_file):
         try:
             verify_directory(
                 args.directory,
@@ -235,6 +742,8 @@ def main():
                 search=bool(args.search),
                 require_manifest=not bool(args.no_manifest),
                 strict_checksum=not bool(args.relaxed_checksum),
+                jobs=args.jobs,
+                rehash=args.rehash,
             )
         except Exception as e:
             error(f"FAILURE: {str(e)}")
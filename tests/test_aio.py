@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import json
+
+import pytest
+from unittest.mock import patch, Mock, call
+
+aiohttp = pytest.importorskip("aiohttp")
+
+from opal_release_downloader._aio import *
+
+
+class FakeContent:
+    def __init__(self, chunks, error=None):
+        self._chunks = chunks
+        self._error = error
+
+    async def iter_chunked(self, n):
+        for chunk in self._chunks:
+            yield chunk
+        if self._error is not None:
+            raise self._error
+
+
+class FakeResponse:
+    def __init__(self, status, chunks, error=None):
+        self.status = status
+        self.reason = "reason"
+        self.content = FakeContent(chunks, error)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self._responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append((url, headers))
+        return self._responses.pop(0)
+
+
+class TestAio:
+    def test_object_url(self):
+        s3 = Mock()
+        s3.generate_presigned_url.return_value = "https://b.s3/k"
+
+        assert object_url(s3, "b", "k") == "https://b.s3/k"
+        s3.generate_presigned_url.assert_called_once_with(
+            "get_object", Params={"Bucket": "b", "Key": "k"}
+        )
+
+    def test_download_object(self, tmp_path):
+        local_name = str(tmp_path / "a.sh")
+        s3_item = {"Key": "unpacker/a.sh", "Size": 11, "ETag": '"abc"'}
+        session = FakeSession(FakeResponse(200, [b"hello", b" world"]))
+        tq = Mock()
+
+        digest = asyncio.run(download_object(session, "url", s3_item, local_name, tq))
+
+        assert digest == hashlib.md5(b"hello world").hexdigest()
+        assert session.requests == [("url", {"If-Match": '"abc"'})]
+        with open(local_name, "rb") as f:
+            assert f.read() == b"hello world"
+        assert not os.path.exists(local_name + ".part")
+        assert tq.update.mock_calls == [call(5), call(6)]
+
+    def test_download_object_resume(self, tmp_path):
+        local_name = str(tmp_path / "a.sh")
+        s3_item = {"Key": "unpacker/a.sh", "Size": 11, "ETag": '"abc"'}
+        with open(local_name + ".part", "wb") as f:
+            f.write(b"hello garbage")
+        with open(local_name + ".part.json", "w") as f:
+            json.dump(dict(s3_item, ranges=[[0, 5]]), f)
+        session = FakeSession(FakeResponse(206, [b" world"]))
+
+        digest = asyncio.run(
+            download_object(session, "url", s3_item, local_name, Mock())
+        )
+
+        assert digest == hashlib.md5(b"hello world").hexdigest()
+        assert session.requests == [("url", {"If-Match": '"abc"', "Range": "bytes=5-"})]
+        with open(local_name, "rb") as f:
+            assert f.read() == b"hello world"
+        assert not os.path.exists(local_name + ".part.json")
+
+    @patch("opal_release_downloader._aio.RETRY_DELAY", 0)
+    def test_download_object_retry(self, tmp_path):
+        local_name = str(tmp_path / "a.sh")
+        s3_item = {"Key": "unpacker/a.sh", "Size": 11, "ETag": '"abc"'}
+        session = FakeSession(
+            FakeResponse(200, [b"hello"], error=aiohttp.ClientPayloadError("reset")),
+            FakeResponse(206, [b" world"]),
+        )
+
+        with patch("opal_release_downloader._aio.write"):
+            digest = asyncio.run(
+                download_object(session, "url", s3_item, local_name, Mock())
+            )
+
+        assert digest == hashlib.md5(b"hello world").hexdigest()
+        assert session.requests == [
+            ("url", {"If-Match": '"abc"'}),
+            ("url", {"If-Match": '"abc"', "Range": "bytes=5-"}),
+        ]
+        with open(local_name, "rb") as f:
+            assert f.read() == b"hello world"
+
+    @patch("opal_release_downloader._aio.RETRIES", 0)
+    def test_download_object_interrupted(self, tmp_path):
+        local_name = str(tmp_path / "a.sh")
+        s3_item = {"Key": "unpacker/a.sh", "Size": 11}
+        session = FakeSession(
+            FakeResponse(200, [b"hello"], error=aiohttp.ClientPayloadError("reset"))
+        )
+
+        with pytest.raises(aiohttp.ClientPayloadError):
+            asyncio.run(download_object(session, "url", s3_item, local_name, Mock()))
+
+        assert not os.path.exists(local_name)
+        with open(local_name + ".part.json") as f:
+            assert json.load(f)["ranges"] == [[0, 5]]
+
+    @patch("opal_release_downloader._aio.RETRY_DELAY", 0)
+    def test_download_object_server_error(self, tmp_path):
+        local_name = str(tmp_path / "a.sh")
+        s3_item = {"Key": "unpacker/a.sh", "Size": 11, "ETag": '"abc"'}
+        session = FakeSession(
+            FakeResponse(200, [b"hello"], error=aiohttp.ClientPayloadError("reset")),
+            FakeResponse(503, []),
+            FakeResponse(206, [b" world"]),
+        )
+
+        with patch("opal_release_downloader._aio.write") as mock_write:
+            digest = asyncio.run(
+                download_object(session, "url", s3_item, local_name, Mock())
+            )
+
+        assert digest == hashlib.md5(b"hello world").hexdigest()
+        resume = ("url", {"If-Match": '"abc"', "Range": "bytes=5-"})
+        assert session.requests[1:] == [resume, resume]
+        assert "HTTP 503 reason" in mock_write.call_args_list[1].args[0]
+        with open(local_name, "rb") as f:
+            assert f.read() == b"hello world"
+
+    @patch("opal_release_downloader._aio.RETRIES", 1)
+    @patch("opal_release_downloader._aio.RETRY_DELAY", 0)
+    def test_download_object_server_error_retries_exhausted(self, tmp_path):
+        local_name = str(tmp_path / "a.sh")
+        s3_item = {"Key": "unpacker/a.sh", "Size": 11}
+        session = FakeSession(FakeResponse(500, []), FakeResponse(500, []))
+
+        with patch("opal_release_downloader._aio.write"), pytest.raises(
+            ServerError, match="HTTP 500 reason"
+        ):
+            asyncio.run(download_object(session, "url", s3_item, local_name, Mock()))
+
+        assert len(session.requests) == 2
+        assert not os.path.exists(local_name)
+
+    def test_download_object_http_error(self, tmp_path):
+        local_name = str(tmp_path / "a.sh")
+        s3_item = {"Key": "unpacker/a.sh", "Size": 11, "ETag": '"abc"'}
+        session = FakeSession(FakeResponse(412, []))
+
+        with pytest.raises(RuntimeError) as e:
+            asyncio.run(download_object(session, "url", s3_item, local_name, Mock()))
+
+        assert str(e.value) == "HTTP 412 reason"
+        assert not os.path.exists(local_name)
+
+    @patch("opal_release_downloader._aio.object_url")
+    @patch("opal_release_downloader._aio.download_object")
+    def test_download_objects(self, mock_download_object, mock_object_url):
+        downloads = [({"Key": f"unpacker/f{i}", "Size": 10}, f"f{i}") for i in range(6)]
+        in_flight = []
+        peak = []
+
+        async def fake_download(session, url, s3_item, local_name, tq):
+            in_flight.append(local_name)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(local_name)
+            return "digest-" + local_name
+
+        mock_download_object.side_effect = fake_download
+        on_complete = Mock()
+
+        digests = download_objects(
+            "s3 client", "b", downloads, jobs=2, on_complete=on_complete
+        )
+
+        assert digests == {ln: "digest-" + ln for _, ln in downloads}
+        assert max(peak) == 2
+        assert on_complete.call_count == 6
+
+    @patch("opal_release_downloader._aio.object_url")
+    @patch("opal_release_downloader._aio.download_object")
+    def test_download_objects_failure(self, mock_download_object, mock_object_url):
+        downloads = [({"Key": f"unpacker/f{i}", "Size": 10}, f"f{i}") for i in range(4)]
+        mock_download_object.side_effect = RuntimeError("HTTP 503 Slow Down")
+
+        with pytest.raises(RuntimeError) as e:
+            download_objects("s3 client", "b", downloads, jobs=1)
+
+        assert str(e.value) == "download of unpacker/f0 failed: HTTP 503 Slow Down"
+        mock_download_object.assert_called_once()
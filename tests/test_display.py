@@ -0,0 +1,177 @@
+import io
+import threading
+
+from unittest.mock import patch
+
+from opal_release_downloader import _display
+from opal_release_downloader._display import *
+
+
+class Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+class TestDisplay:
+    def test_progress_slots(self):
+        slots = ProgressSlots(2)
+
+        with slots.slot() as first:
+            with slots.slot() as second:
+                assert {first, second} == {0, 1}
+        with slots.slot() as again:
+            assert again in (0, 1)
+
+    def test_progress_slots_threads(self):
+        slots = ProgressSlots(3)
+        in_use = set()
+        lock = threading.Lock()
+        errors = []
+
+        def worker():
+            for _ in range(50):
+                with slots.slot() as position:
+                    with lock:
+                        if position in in_use:
+                            errors.append(position)
+                        in_use.add(position)
+                    with lock:
+                        in_use.discard(position)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert errors == []
+
+    def test_transfer_update_threads(self):
+        t = Transfer("a.tar.gz", 40000)
+
+        def worker():
+            for _ in range(1000):
+                t.update(10)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        assert t.n == 40000
+
+    def test_dashboard_log(self):
+        stream = io.StringIO()
+        dashboard = Dashboard(stream, interval=3600)
+
+        with dashboard.transfer("a.tar.gz", 100, initial=20) as t:
+            t.update(20)
+            dashboard.render()
+            # nothing moved since the last line
+            dashboard.render()
+        with dashboard.transfer("b.tar.gz", 100) as t:
+            t.update(100)
+        dashboard.close()
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 2
+        assert lines[0].startswith("progress: 40.0B/100B (40%), 0/1 files")
+        assert lines[0].endswith("1 active")
+        assert lines[1].startswith("progress: 140B/200B (70%), 2/2 files")
+        assert "\x1b" not in stream.getvalue()
+
+    def test_dashboard_unused(self):
+        stream = io.StringIO()
+        dashboard = Dashboard(stream)
+
+        dashboard.close()
+
+        assert stream.getvalue() == ""
+
+    def test_dashboard_terminal(self):
+        stream = Terminal()
+        dashboard = Dashboard(stream, interval=3600, max_active=1)
+
+        with dashboard.transfer("a.tar.gz", 100), dashboard.transfer("b.tar.gz", 50):
+            dashboard.render()
+            first = stream.getvalue()
+            with dashboard.suspend():
+                stream.write("Downloaded c.tar.gz\n")
+        dashboard.close()
+
+        lines = first.split("\n")
+        assert len(lines) == 3
+        assert lines[0].startswith("0/2 files")
+        assert lines[1].startswith("  a.tar.gz")
+        assert lines[2] == "  ... and 1 more"
+        # the dashboard is cleared for the message and drawn again below it
+        rest = stream.getvalue()[len(first) :]
+        assert rest.startswith("\r\x1b[2A\x1b[JDownloaded c.tar.gz\n0/2 files")
+        # the final totals are left on screen
+        assert rest.rsplit("\x1b[J", 1)[1].startswith("2/2 files")
+        assert rest.endswith("\n")
+
+    @patch("tqdm.tqdm")
+    def test_progress_tqdm(self, mock_tqdm):
+        with progress("a.tar.gz", 100, initial=10, position=2) as tq:
+            tq.update(5)
+
+        mock_tqdm.assert_called_once_with(
+            total=100,
+            initial=10,
+            unit="B",
+            unit_scale=True,
+            desc="a.tar.gz",
+            position=2,
+            leave=False,
+        )
+        mock_tqdm.return_value.__enter__.return_value.update.assert_called_once_with(5)
+
+    @patch("tqdm.tqdm")
+    def test_progress_dashboard(self, mock_tqdm, monkeypatch):
+        dashboard = Dashboard(io.StringIO(), interval=3600)
+        monkeypatch.setattr(_display, "_dashboard", dashboard)
+
+        with progress("a.tar.gz", 100, position=2) as t:
+            t.update(5)
+        dashboard.close()
+
+        mock_tqdm.assert_not_called()
+        assert t.n == 5
+
+    @patch("tqdm.tqdm.write")
+    def test_write(self, mock_write, monkeypatch, capsys):
+        write("Downloaded a.tar.gz")
+        mock_write.assert_called_once_with("Downloaded a.tar.gz")
+
+        monkeypatch.setattr(_display, "_dashboard", Dashboard(io.StringIO()))
+        write("Downloaded b.tar.gz")
+        assert capsys.readouterr().out == "Downloaded b.tar.gz\n"
+        mock_write.assert_called_once()
+
+    def test_display_concurrent(self):
+        with display(concurrent=True):
+            assert isinstance(_display._dashboard, Dashboard)
+        assert _display._dashboard is None
+
+    def test_suspending_stream(self):
+        stream = Terminal()
+        out = io.StringIO()
+        dashboard = Dashboard(stream, interval=3600)
+        wrapped = _display._Suspending(out, dashboard)
+
+        with dashboard.transfer("a.tar.gz", 100):
+            dashboard.render()
+            print("Downloading files", end="", file=wrapped)
+            drawn = stream.getvalue()
+            print(" to images", file=wrapped)
+            # the dashboard is only taken down once a whole line is printed
+            assert drawn.count("\x1b[J") == 0
+            assert stream.getvalue().count("\x1b[J") == 1
+            print("unfinished", end="", file=wrapped)
+        dashboard.close()
+
+        assert out.getvalue() == "Downloading files to images\n"
+        assert wrapped.release() is out
+        assert out.getvalue().endswith("unfinished")
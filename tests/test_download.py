@@ -1,12 +1,24 @@
 import pytest
-from unittest.mock import patch, Mock, call
+from unittest.mock import patch, Mock, call, ANY
 
 from opal_release_downloader.download import *
+from opal_release_downloader._throttle import check_cancelled, set_cancelled
 
 import sys
+import threading
+import time
 import builtins
 import colorama
 
+DEFAULT_FETCH_KWARGS = {
+    "sync": False,
+    "jobs": 1,
+    "part_size": None,
+    "max_concurrency": None,
+    "max_io_queue": None,
+    "backend": "threads",
+}
+
 
 class TestDownload:
     @patch("sys.stdout")
@@ -30,22 +42,48 @@ class TestDownload:
         bucket_name = "my bucket"
         release_tag = "2022.10.31"
         no_overwrite = True
+        fetched = {
+            "a.tar.gz": {"Key": f"{release_tag}/a.tar.gz", "Size": 4, "MD5": "x"},
+            "b.tar.gz": {"Key": f"{release_tag}/b.tar.gz", "Size": 4},
+        }
+        mock_get_files.return_value = fetched
 
         get_images(bucket_name, release_tag, no_overwrite)
 
         mock_get_files.assert_called_with(
-            bucket_name, release_tag, dest="images", no_overwrite=no_overwrite
+            bucket_name, release_tag, dest="./images", no_overwrite=no_overwrite
         )
         mock_get_files.assert_called_once()
         mock_print.assert_called_once()
         assert mock_print.mock_calls == [call()]
         mock_verify_dir.assert_called_with(
-            "images",
+            "./images",
             checksum=f"md5sums_{release_tag}",
             manifest=f"file_manifest_{release_tag}.yml",
+            digests={"a.tar.gz": "x"},
+            sizes={"a.tar.gz": 4, "b.tar.gz": 4},
         )
         mock_verify_dir.assert_called_once()
 
+    @patch("builtins.print")
+    @patch("opal_release_downloader.download.verify_directory")
+    @patch("opal_release_downloader.download.get_files")
+    def test_get_images_checksum_files(self, mock_get_files, mock_verify_dir, _):
+        release_tag = "2022.10.31"
+        mock_get_files.return_value = {
+            "a.tar.gz": {"Size": 4},
+            f"md5sums_{release_tag}": {"Size": 4},
+            f"sha256sums_{release_tag}": {"Size": 4},
+        }
+
+        get_images("my bucket", release_tag, False)
+
+        _, kwargs = mock_verify_dir.call_args
+        assert kwargs["checksum"] == [
+            f"md5sums_{release_tag}",
+            f"sha256sums_{release_tag}",
+        ]
+
     @patch("opal_release_downloader.download.get_files")
     def test_get_scripts(self, mock_get_files):
         bucket_name = "my bucket"
@@ -65,20 +103,26 @@ class TestDownload:
     def test_get_docker(self, mock_get_files, mock_verify_dir, mock_print):
         bucket_name = "my bucket"
         no_overwrite = True
+        mock_get_files.return_value = {
+            "docker.tgz": {"Key": "docker/docker.tgz", "ETagVerified": True}
+        }
 
         get_docker(bucket_name, no_overwrite)
 
         mock_get_files.assert_called_with(
-            bucket_name, "docker", no_overwrite=no_overwrite
+            bucket_name, "docker", dest="./docker", no_overwrite=no_overwrite
         )
         mock_get_files.assert_called_once()
         mock_print.assert_called_once()
         assert mock_print.mock_calls == [call()]
         mock_verify_dir.assert_called_with(
-            "docker",
+            "./docker",
             checksum=f"md5checksum",
             require_manifest=False,
             strict_checksum=False,
+            digests={},
+            sizes={},
+            verified=["docker.tgz"],
         )
         mock_verify_dir.assert_called_once()
 
@@ -88,20 +132,24 @@ class TestDownload:
     def test_get_rhel(self, mock_get_files, mock_verify_dir, mock_print):
         bucket_name = "my bucket"
         no_overwrite = True
+        mock_get_files.return_value = {"rhel.iso": {"Key": "redhat-iso/rhel.iso"}}
 
         get_rhel(bucket_name, no_overwrite)
 
         mock_get_files.assert_called_with(
-            bucket_name, "redhat-iso", dest="rhel", no_overwrite=no_overwrite
+            bucket_name, "redhat-iso", dest="./rhel", no_overwrite=no_overwrite
         )
         mock_get_files.assert_called_once()
         mock_print.assert_called_once()
         assert mock_print.mock_calls == [call()]
         mock_verify_dir.assert_called_with(
-            "rhel",
+            "./rhel",
             checksum=f"md5checksum",
             require_manifest=False,
             strict_checksum=False,
+            digests={},
+            sizes={},
+            verified=[],
         )
         mock_verify_dir.assert_called_once()
 
@@ -149,10 +197,14 @@ class TestDownload:
             ]
         )
 
-        mock_get_images.assert_called_once_with(bucket_name, release_tag, no_overwrite)
+        mock_get_images.assert_called_once_with(
+            bucket_name, release_tag, no_overwrite, **DEFAULT_FETCH_KWARGS
+        )
         mock_print.assert_has_calls([call()])
 
-        mock_get_scripts.assert_called_once_with(bucket_name, release_tag, no_overwrite)
+        mock_get_scripts.assert_called_once_with(
+            bucket_name, release_tag, no_overwrite, **DEFAULT_FETCH_KWARGS
+        )
 
     @patch("builtins.print")
     @patch("opal_release_downloader.download.get_latest")
@@ -203,10 +255,14 @@ class TestDownload:
             ]
         )
 
-        mock_get_images.assert_called_once_with(bucket_name, release_tag, no_overwrite)
+        mock_get_images.assert_called_once_with(
+            bucket_name, release_tag, no_overwrite, **DEFAULT_FETCH_KWARGS
+        )
         mock_print.assert_has_calls([call()])
 
-        mock_get_scripts.assert_called_once_with(bucket_name, release_tag, no_overwrite)
+        mock_get_scripts.assert_called_once_with(
+            bucket_name, release_tag, no_overwrite, **DEFAULT_FETCH_KWARGS
+        )
 
     @patch("builtins.print")
     @patch("opal_release_downloader.download.get_rhel")
@@ -259,9 +315,198 @@ class TestDownload:
             ]
         )
 
-        mock_get_images.assert_called_once_with(bucket_name, release_tag, no_overwrite)
+        mock_get_images.assert_called_once_with(
+            bucket_name, release_tag, no_overwrite, **DEFAULT_FETCH_KWARGS
+        )
         mock_print.assert_has_calls([call(), call(), call()])
 
-        mock_get_docker.assert_called_once_with(bucket_name, no_overwrite)
+        mock_get_docker.assert_called_once_with(
+            bucket_name, no_overwrite, **DEFAULT_FETCH_KWARGS
+        )
         mock_get_rhel.asseret_called_once_with(bucket_name, no_overwrite)
-        mock_get_scripts.assert_called_once_with(bucket_name, release_tag, no_overwrite)
+        mock_get_scripts.assert_called_once_with(
+            bucket_name, release_tag, no_overwrite, **DEFAULT_FETCH_KWARGS
+        )
+
+    @patch("builtins.print")
+    def test_run_stages(self, mock_print):
+        def fail():
+            raise RuntimeError("no space left")
+
+        results = run_stages(
+            [
+                ("images", lambda: {"a.tar.gz": {"Size": 4}}),
+                ("docker", fail),
+                ("rhel", lambda: {}),
+            ]
+        )
+
+        assert [name for name, *_ in results] == ["images", "docker", "rhel"]
+        assert results[0][1:3] == ({"a.tar.gz": {"Size": 4}}, None)
+        assert results[1][1] is None
+        assert str(results[1][2]) == "no space left"
+        assert results[2][1:3] == ({}, None)
+
+        print_stage_summary(results)
+        lines = [c.args[0] for c in mock_print.mock_calls]
+        assert "ok     1 files (4.00B)" in lines[0]
+        assert "FAILED no space left" in lines[1]
+
+    def test_run_stages_interrupted(self):
+        started = threading.Event()
+        stopped = threading.Event()
+
+        def interrupted():
+            started.wait()
+            raise KeyboardInterrupt
+
+        def downloading():
+            # stands in for a transfer checking in after every chunk
+            started.set()
+            try:
+                while True:
+                    check_cancelled()
+                    time.sleep(0.01)
+            finally:
+                stopped.set()
+
+        try:
+            with pytest.raises(KeyboardInterrupt):
+                run_stages([("images", interrupted), ("docker", downloading)])
+            assert stopped.is_set()
+        finally:
+            set_cancelled(False)
+
+    @patch("builtins.print")
+    @patch("opal_release_downloader.download.get_rhel")
+    @patch("opal_release_downloader.download.get_docker")
+    @patch("opal_release_downloader.download.get_scripts")
+    @patch("opal_release_downloader.download.get_images")
+    @patch("opal_release_downloader.download.bright")
+    def test_bootstrap_pipeline(
+        self,
+        mock_bright,
+        mock_get_images,
+        mock_get_scripts,
+        mock_get_docker,
+        mock_get_rhel,
+        mock_print,
+        mock_os_makedirs,
+        mock_os_getcwd,
+        mock_os_chdir,
+    ):
+        bucket_name = "my bucket"
+        release_tag = "2022.10.31"
+        root = "/some/fake/dir/opal_artifacts"
+        mock_os_getcwd.side_effect = ["/some/fake/dir", root]
+        for mock_stage in (mock_get_images, mock_get_scripts, mock_get_rhel):
+            mock_stage.return_value = {}
+        mock_get_docker.side_effect = RuntimeError("bad docker")
+
+        with pytest.raises(Exception) as e:
+            bootstrap(
+                bucket_name,
+                release_tag=release_tag,
+                no_overwrite=True,
+                pipeline=True,
+            )
+        assert str(e.value) == "stage(s) failed: docker"
+
+        fetch_kwargs = dict(DEFAULT_FETCH_KWARGS, root=root, slots=ANY)
+        mock_get_images.assert_called_once_with(
+            bucket_name, release_tag, True, **fetch_kwargs
+        )
+        mock_get_scripts.assert_called_once_with(
+            bucket_name, release_tag, True, **fetch_kwargs
+        )
+        mock_get_docker.assert_called_once_with(bucket_name, True, **fetch_kwargs)
+        mock_get_rhel.assert_called_once_with(bucket_name, True, **fetch_kwargs)
+        slots = mock_get_images.call_args.kwargs["slots"]
+        assert slots is mock_get_rhel.call_args.kwargs["slots"]
+        assert slots._free.qsize() == 4
+        mock_os_chdir.assert_has_calls([call("opal_artifacts"), call("/some/fake/dir")])
+        assert call("SUCCESS", colorama.Fore.GREEN) not in mock_bright.mock_calls
+
+    def test_stage_count(self):
+        assert stage_count() == 4
+        assert stage_count(download_docker=False) == 3
+        assert stage_count(download_docker=False, download_rhel=False) == 2
+
+    def test_stage_locations(self):
+        assert stage_locations("2022.10.31", False, True, "/root") == [
+            ("images", "2022.10.31", "/root/images"),
+            ("scripts", "unpacker", "/root"),
+            ("rhel", "redhat-iso", "/root/rhel"),
+        ]
+
+    @patch("opal_release_downloader.download.get_s3_client")
+    @patch("opal_release_downloader.download.plan_summary")
+    @patch("opal_release_downloader.download.plan_files")
+    def test_plan_bootstrap(
+        self, mock_plan_files, mock_plan_summary, mock_gets3, mock_os_getcwd
+    ):
+        mock_os_getcwd.return_value = "/cwd"
+        mock_plan_files.side_effect = lambda b, prefix, **kw: {"prefix": prefix}
+
+        plan_bootstrap(
+            "my bucket",
+            "2022.10.31",
+            download_docker=False,
+            download_rhel=False,
+            no_overwrite=True,
+            jobs=4,
+        )
+
+        assert mock_plan_files.mock_calls == [
+            call(
+                "my bucket",
+                "2022.10.31",
+                dest="/cwd/opal_artifacts/images",
+                no_overwrite=True,
+                sync=False,
+            ),
+            call(
+                "my bucket",
+                "unpacker",
+                dest="/cwd/opal_artifacts",
+                no_overwrite=True,
+                sync=False,
+            ),
+        ]
+        mock_plan_summary.assert_called_once_with(
+            mock_gets3.return_value,
+            "my bucket",
+            [
+                {"prefix": "2022.10.31", "stage": "images"},
+                {"prefix": "unpacker", "stage": "scripts"},
+            ],
+            "/cwd/opal_artifacts",
+            jobs=4,
+        )
+
+    @patch("opal_release_downloader.download.print_plan")
+    @patch("opal_release_downloader.download.plan_bootstrap")
+    @patch("opal_release_downloader.download.get_images")
+    def test_bootstrap_plan(
+        self,
+        mock_get_images,
+        mock_plan_bootstrap,
+        mock_print_plan,
+        mock_os_makedirs,
+        mock_os_chdir,
+    ):
+        bootstrap(
+            "my bucket",
+            release_tag="2022.10.31",
+            download_docker=True,
+            download_rhel=True,
+            no_overwrite=False,
+            plan="json",
+        )
+
+        mock_print_plan.assert_called_once_with(
+            mock_plan_bootstrap.return_value, "json"
+        )
+        mock_get_images.assert_not_called()
+        mock_os_makedirs.assert_not_called()
+        mock_os_chdir.assert_not_called()
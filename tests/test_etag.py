@@ -0,0 +1,101 @@
+import hashlib
+
+import pytest
+
+from opal_release_downloader._etag import *
+
+
+def multipart_etag(data: bytes, part_size: int) -> str:
+    parts = [data[i : i + part_size] for i in range(0, len(data), part_size)]
+    digests = b"".join(hashlib.md5(p).digest() for p in parts)
+    return f'"{hashlib.md5(digests).hexdigest()}-{len(parts)}"'
+
+
+class TestETag:
+    def test_parse_etag(self):
+        md5 = hashlib.md5(b"a").hexdigest()
+
+        assert parse_etag(f'"{md5}"') == (md5, None)
+        assert parse_etag(f'"{md5}-12"') == (md5, 12)
+        assert parse_etag('"abc"') is None
+        assert parse_etag(None) is None
+
+    def test_part_sizes(self):
+        # 256MiB in 8MiB parts
+        assert part_sizes(256 * MIB, 32) == [8 * MIB]
+        # the last part may be short
+        assert part_sizes(100 * MIB + 1, 13) == [8 * MIB]
+        assert part_sizes(10 * MIB, 1) == [10 * MIB]
+        assert part_sizes(10, 20) == []
+        assert len(part_sizes(1024 * MIB, 2)) > MAX_PART_SIZES
+
+    @pytest.mark.parametrize("chunk", [1000, MIB, 3 * MIB + 7])
+    def test_multipart_etag(self, chunk):
+        data = bytes(range(256)) * (9 * MIB // 256) + b"tail"
+        hasher = MultipartETag([2 * MIB, 4 * MIB])
+
+        for i in range(0, len(data), chunk):
+            hasher.update(data[i : i + chunk])
+
+        assert hasher.etags() == {
+            2 * MIB: multipart_etag(data, 2 * MIB).strip('"'),
+            4 * MIB: multipart_etag(data, 4 * MIB).strip('"'),
+        }
+
+    def test_etag_checkable(self):
+        md5 = hashlib.md5(b"a").hexdigest()
+
+        assert etag_checkable({"Size": 1, "ETag": f'"{md5}"'})
+        assert etag_checkable({"Size": 20 * MIB, "ETag": f'"{md5}-3"'})
+        assert not etag_checkable({"Size": 20 * MIB, "ETag": f'"{md5}-2"'})
+        assert not etag_checkable({"Size": 1, "ETag": '"abc"'})
+        assert not etag_checkable({"Size": 1})
+
+    def test_check_etag(self):
+        data = b"some data"
+        md5 = hashlib.md5(data).hexdigest()
+        s3_item = {"Key": "docker/docker.tgz", "Size": len(data), "ETag": f'"{md5}"'}
+
+        assert check_etag(s3_item, md5)
+        with pytest.raises(RuntimeError) as e:
+            check_etag(s3_item, hashlib.md5(b"other").hexdigest())
+        assert "--refresh-index" in str(e.value)
+        # nothing to check against
+        assert not check_etag(dict(s3_item, ETag='"abc"'), "anything")
+
+    def test_check_etag_multipart(self):
+        data = bytes(range(256)) * (20 * MIB // 256)
+        s3_item = {
+            "Key": "redhat-iso/rhel.iso",
+            "Size": len(data),
+            "ETag": multipart_etag(data, 8 * MIB),
+        }
+        md5 = hashlib.md5(data).hexdigest()
+
+        hasher = etag_hasher(s3_item)
+        hasher.update(data)
+        assert check_etag(s3_item, md5, hasher)
+
+        # left unverified rather than failed, as the part size is a guess
+        hasher = etag_hasher(s3_item)
+        hasher.update(data[:-1] + b"x")
+        assert not check_etag(s3_item, md5, hasher)
+
+    def test_check_etag_multipart_other_part_size(self):
+        # uploaded in 2,000,000 byte parts; only 2MiB is guessed
+        data = bytes(range(256)) * (3_000_000 // 256)
+        s3_item = {
+            "Key": "redhat-iso/rhel.iso",
+            "Size": len(data),
+            "ETag": multipart_etag(data, 2_000_000),
+        }
+
+        hasher = etag_hasher(s3_item)
+        hasher.update(data)
+
+        assert not check_etag(s3_item, hashlib.md5(data).hexdigest(), hasher)
+
+    def test_etag_hasher_single_part(self):
+        md5 = hashlib.md5(b"a").hexdigest()
+
+        assert etag_hasher({"Size": 1, "ETag": f'"{md5}"'}) is None
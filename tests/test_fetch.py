@@ -1,12 +1,23 @@
 import pytest
-from unittest.mock import patch, Mock, call
+from unittest.mock import patch, Mock, call, ANY
 
 from opal_release_downloader.fetch import *
 
+import hashlib
+import io
+import json
+import os
 import sys
+import threading
 import builtins
 import colorama
 
+DEFAULT_TRANSFER_OPTIONS = {
+    "part_size": None,
+    "max_concurrency": None,
+    "max_io_queue": None,
+}
+
 
 class TestFetch:
     def test_prepare_local_path(self, mock_os_path, mock_os_makedirs):
@@ -83,27 +94,324 @@ class TestFetch:
         mock_os_path.exists.assert_called_once_with(realpath_retval)
         mock_os_unlink.assert_called_once_with(realpath_retval)
 
+    def test_pool_size_for_jobs(self):
+        assert pool_size_for_jobs(1) == 16
+        assert pool_size_for_jobs(4) == 64
+        assert pool_size_for_jobs(0) == 16
+        assert pool_size_for_jobs(4, max_concurrency=2) == 40
+        assert pool_size_for_jobs(2, max_concurrency=32) == 64
+
+    def test_parse_size(self):
+        assert parse_size("8388608") == 8388608
+        assert parse_size("16MB") == 16 * 1000**2
+        assert parse_size("16MiB") == 16 * 1024**2
+        assert parse_size("1.5GiB") == int(1.5 * 1024**3)
+        assert parse_size("200mb") == 200 * 1000**2
+        assert parse_size("2K") == 2000
+        with pytest.raises(ValueError):
+            parse_size("lots")
+
+    def test_parse_rate(self):
+        assert parse_rate("200MB/s") == 200 * 1000**2
+        assert parse_rate("50MiB") == 50 * 1024**2
+        assert parse_rate(" 1.5GB/S ") == 1500 * 1000**2
+        with pytest.raises(ValueError):
+            parse_rate("0MB/s")
+        with pytest.raises(ValueError):
+            parse_rate("fast")
+
+    def test_get_transfer_config_small(self):
+        config = get_transfer_config(20 * 1024**2)
+
+        assert config.multipart_chunksize == 8 * 1024**2
+        assert config.multipart_threshold == 8 * 1024**2
+        assert config.max_request_concurrency == 3
+
+    def test_get_transfer_config_large(self):
+        config = get_transfer_config(10 * 1024**3)
+
+        # larger parts would leave too few of them in flight within the buffer
+        assert config.multipart_chunksize == 8 * 1024**2
+        assert config.max_request_concurrency == 4
+        assert config.max_in_memory_download_chunks == 4
+
+    def test_get_transfer_config_overrides(self):
+        config = get_transfer_config(
+            10 * 1024**3, part_size=5 * 1024**2, max_concurrency=4, max_io_queue=500
+        )
+
+        assert config.multipart_chunksize == 5 * 1024**2
+        assert config.max_request_concurrency == 4
+        assert config.max_io_queue_size == 500
+        assert config.max_in_memory_download_chunks == 6
+
+        config = get_transfer_config(10 * 1024**3, max_concurrency=12)
+        assert config.max_in_memory_download_chunks == 12
+
+    @patch("opal_release_downloader.fetch.DOWNLOAD_BUFFER_SIZE", 3000)
+    def test_get_transfer_config_buffer_bound(self):
+        from boto3.s3.transfer import create_transfer_manager
+
+        part_size = 1000
+        data = bytes(range(256)) * 100
+        first_part = threading.Event()
+        overtaking = []
+
+        def head_object(Bucket, Key):
+            return {"ContentLength": len(data), "ETag": '"abc"'}
+
+        def get_object(Bucket, Key, Range, **kwargs):
+            start, end = Range[len("bytes=") :].split("-")
+            start, end = int(start), int(end or len(data) - 1)
+            if start == 0:
+                # a slow first part: every part fetched meanwhile waits in memory
+                first_part.wait(timeout=0.5)
+                first_part.set()
+            elif not first_part.is_set():
+                overtaking.append(start // part_size)
+            return {"Body": io.BytesIO(data[start : end + 1]), "ETag": '"abc"'}
+
+        mock_s3_client = Mock()
+        mock_s3_client.head_object.side_effect = head_object
+        mock_s3_client.get_object.side_effect = get_object
+        f = io.BytesIO()
+
+        config = get_transfer_config(len(data), part_size=part_size)
+        assert config.max_request_concurrency == 3
+        # the buffer holds back parts however many could be in flight
+        config.max_request_concurrency = 8
+        with create_transfer_manager(mock_s3_client, config) as manager:
+            manager.download("b", "k", HashingWriter(f)).result()
+
+        assert f.getvalue() == data
+        assert sorted(overtaking) == [1, 2]
+
+    def test_fetched_digests(self):
+        fetched = {
+            "a": {"Key": "2022.09.07/a", "Size": 1, "MD5": "0cc175b9c0f1b6a8"},
+            "b": {"Key": "2022.09.07/b", "Size": 2},
+        }
+
+        assert fetched_digests(fetched) == {"a": "0cc175b9c0f1b6a8"}
+
+    def test_fetched_verified(self):
+        fetched = {
+            "a": {"Key": "2022.09.07/a", "Size": 1, "ETagVerified": True},
+            "b": {"Key": "2022.09.07/b", "Size": 2, "ETagVerified": False},
+            "c": {"Key": "2022.09.07/c", "Size": 3},
+        }
+
+        assert fetched_verified(fetched) == ["a"]
+
+    def test_fetched_sizes(self):
+        fetched = {
+            "a": {"Key": "2022.09.07/a", "Size": 1, "MD5": "0cc175b9c0f1b6a8"},
+            "b": {"Key": "2022.09.07/b", "Size": 2},
+        }
+
+        assert fetched_sizes(fetched) == {"a": 1, "b": 2}
+
+    @patch("os.replace")
+    @patch("opal_release_downloader.fetch.Checkpoint")
+    @patch("builtins.open")
     @patch("tqdm.tqdm")
-    def test_s3_download_with_progress(self, mock_tqdm, mock_os_path):
+    def test_s3_download_with_progress(
+        self, mock_tqdm, mock_open, mock_checkpoint, mock_os_replace, mock_os_path
+    ):
         mock_s3_client = Mock()
         bucket_name = "b"
         s3_item = {"Key": "2022.09.07/blind", "Size": 200}
         local_name = "/home/user/a.b"
+        part_name = local_name + ".part"
 
         s3_key = s3_item["Key"]
         size = s3_item["Size"]
         mock_os_path.basename.return_value = "a.b"
+        checkpoint = mock_checkpoint.return_value
+        checkpoint.load.return_value = 0
+        checkpoint.part_name = part_name
 
         s3_download_with_progress(mock_s3_client, bucket_name, s3_item, local_name)
 
         mock_os_path.basename.assert_called_once_with(local_name)
+        mock_checkpoint.assert_called_once_with(local_name, s3_item)
         mock_tqdm.assert_called_once_with(
-            total=size, unit="B", unit_scale=True, desc="a.b"
+            total=size,
+            initial=0,
+            unit="B",
+            unit_scale=True,
+            desc="a.b",
+            position=None,
+            leave=True,
         )
 
+        mock_open.assert_called_once_with(part_name, "wb")
         # TODO: Fill in args including local-scope update function ref
-        mock_s3_client.download_file.assert_called_once()
+        mock_s3_client.download_fileobj.assert_called_once()
+        args = mock_s3_client.download_fileobj.call_args.args
+        assert args[:2] == (bucket_name, s3_key)
+        assert isinstance(args[2], HashingWriter)
+        config = mock_s3_client.download_fileobj.call_args.kwargs["Config"]
+        assert config.multipart_chunksize == 8 * 1024**2
+        mock_os_replace.assert_called_once_with(part_name, local_name)
+        checkpoint.remove.assert_called_once()
+
+    @patch("os.replace")
+    @patch("opal_release_downloader.fetch.Checkpoint")
+    @patch("builtins.open")
+    @patch("tqdm.tqdm")
+    def test_s3_download_with_progress_failure(
+        self, mock_tqdm, mock_open, mock_checkpoint, mock_os_replace, mock_os_path
+    ):
+        mock_s3_client = Mock()
+        mock_s3_client.download_fileobj.side_effect = ValueError("reset")
+        s3_item = {"Key": "2022.09.07/blind", "Size": 200}
+        local_name = "/home/user/a.b"
+        checkpoint = mock_checkpoint.return_value
+        checkpoint.load.return_value = 0
+
+        with pytest.raises(ValueError):
+            s3_download_with_progress(mock_s3_client, "b", s3_item, local_name)
+
+        checkpoint.save.assert_called_once()
+        checkpoint.remove.assert_not_called()
+        mock_os_replace.assert_not_called()
+
+    def test_s3_download_with_progress_resume(self, tmp_path):
+        data = bytes(range(256)) * 100
+        s3_item = {"Key": "2022.09.07/blind", "Size": len(data), "ETag": '"abc"'}
+        local_name = str(tmp_path / "blind")
+
+        # an earlier run got the first 1000 bytes, plus some unrecorded junk
+        checkpoint = Checkpoint(local_name, s3_item)
+        with open(checkpoint.part_name, "wb") as f:
+            f.write(data[:1000] + b"junk")
+        checkpoint.completed = 1000
+        checkpoint.save()
+
+        def get_object(Bucket, Key, Range, IfMatch):
+            start, end = (int(x) for x in Range[len("bytes=") :].split("-"))
+            return {"Body": io.BytesIO(data[start : end + 1])}
+
+        mock_s3_client = Mock()
+        mock_s3_client.get_object.side_effect = get_object
+
+        digest = s3_download_with_progress(
+            mock_s3_client, "b", s3_item, local_name, part_size=4096
+        )
+
+        mock_s3_client.download_fileobj.assert_not_called()
+        first = mock_s3_client.get_object.call_args_list[0].kwargs
+        assert first["Range"] == "bytes=1000-5095"
+        assert first["IfMatch"] == '"abc"'
+        with open(local_name, "rb") as f:
+            assert f.read() == data
+        assert digest == hashlib.md5(data).hexdigest()
+        assert not os.path.exists(checkpoint.part_name)
+        assert not os.path.exists(checkpoint.path)
+
+    def test_s3_download_with_progress_cancelled(self, tmp_path):
+        data = bytes(range(256)) * 100
+        s3_item = {"Key": "2022.09.07/blind", "Size": len(data)}
+        local_name = str(tmp_path / "blind")
+
+        def download_fileobj(bucket, key, writer, Callback, Config):
+            writer.write(data[:1000])
+            Callback(1000)
+            set_cancelled()
+            writer.write(data[1000:2000])
+            Callback(1000)
+            writer.write(data[2000:])
+
+        mock_s3_client = Mock()
+        mock_s3_client.download_fileobj.side_effect = download_fileobj
+
+        try:
+            with pytest.raises(RuntimeError, match="interrupted"):
+                s3_download_with_progress(mock_s3_client, "b", s3_item, local_name)
+        finally:
+            set_cancelled(False)
+
+        # the next run picks up where this one stopped
+        assert not os.path.exists(local_name)
+        assert Checkpoint(local_name, s3_item).load() == 2000
+
+    def test_s3_download_with_progress_etag_mismatch(self, tmp_path):
+        data = b"downloaded"
+        s3_item = {
+            "Key": "docker/docker.tgz",
+            "Size": len(data),
+            "ETag": f'"{hashlib.md5(b"uploaded").hexdigest()}"',
+        }
+        local_name = str(tmp_path / "docker.tgz")
+
+        def download_fileobj(bucket, key, fileobj, Callback, Config):
+            fileobj.write(data)
+
+        mock_s3_client = Mock()
+        mock_s3_client.download_fileobj.side_effect = download_fileobj
+
+        with pytest.raises(RuntimeError) as e:
+            s3_download_with_progress(mock_s3_client, "b", s3_item, local_name)
+
+        assert "does not match its ETag" in str(e.value)
+        # nothing is kept, so the next run downloads it again
+        assert os.listdir(tmp_path) == []
+
+    @patch("opal_release_downloader._transfer.warn")
+    def test_s3_download_with_progress_multipart_unverified(self, mock_warn, tmp_path):
+        data = bytes(range(256)) * (3_000_000 // 256)
+        # not the ETag of any whole-MiB part size
+        s3_item = {
+            "Key": "redhat-iso/rhel.iso",
+            "Size": len(data),
+            "ETag": f'"{hashlib.md5(b"parts").hexdigest()}-2"',
+        }
+        local_name = str(tmp_path / "rhel.iso")
+
+        def download_fileobj(bucket, key, fileobj, Callback, Config):
+            fileobj.write(data)
+
+        mock_s3_client = Mock()
+        mock_s3_client.download_fileobj.side_effect = download_fileobj
+
+        digest = s3_download_with_progress(mock_s3_client, "b", s3_item, local_name)
+
+        # kept, and left to the checksum files
+        assert digest == hashlib.md5(data).hexdigest()
+        assert os.listdir(tmp_path) == ["rhel.iso"]
+        assert s3_item["ETagVerified"] is False
+        mock_warn.assert_called_once()
+
+    @patch("opal_release_downloader.fetch.RANGE_READ_SIZE", 128)
+    def test_download_range(self):
+        data = bytes(range(256)) * 10
+        s3_item = {"Key": "2022.09.07/blind", "Size": len(data)}
+        config = get_transfer_config(len(data), part_size=300, max_concurrency=3)
+        written = []
+        progress = []
+
+        def get_object(Bucket, Key, Range):
+            start, end = (int(x) for x in Range[len("bytes=") :].split("-"))
+            return {"Body": io.BytesIO(data[start : end + 1])}
+
+        mock_s3_client = Mock()
+        mock_s3_client.get_object.side_effect = get_object
+        writer = Mock()
+        writer.write.side_effect = written.append
+
+        download_range(
+            mock_s3_client, "b", s3_item, 100, writer, config, progress.append
+        )
+
+        assert b"".join(written) == data[100:]
+        assert sum(progress) == len(data) - 100
+        assert max(progress) == 128
+        assert mock_s3_client.get_object.call_count == 9
 
+    @patch("opal_release_downloader.fetch.record_entry")
+    @patch("opal_release_downloader.fetch.save_record")
+    @patch("opal_release_downloader.fetch.load_record")
     @patch("opal_release_downloader.fetch.s3_download_with_progress")
     @patch("opal_release_downloader.fetch.prepare_local_path")
     @patch("opal_release_downloader.fetch.get_s3_client")
@@ -116,6 +424,9 @@ class TestFetch:
         mock_gets3,
         mock_prepare_local_path,
         mock_s3_download,
+        mock_load_record,
+        mock_save_record,
+        mock_record_entry,
         mock_os_path,
     ):
         bucket_name = "howdy-doody"
@@ -153,16 +464,24 @@ class TestFetch:
         mock_gets3.assert_called_once_with(region_name=region_name)
         mock_os_path.relpath.assert_called_once_with(realpath_retval)
         assert mock_prepare_local_path.mock_calls == [
-            call(realpath_retval, item_list[0], no_overwrite=False),
-            call(realpath_retval, item_list[1], no_overwrite=False),
-            call(realpath_retval, item_list[2], no_overwrite=False),
+            call(realpath_retval, item_list[0], no_overwrite=True),
+            call(realpath_retval, item_list[1], no_overwrite=True),
+            call(realpath_retval, item_list[2], no_overwrite=True),
         ]
         assert mock_s3_download.mock_calls == [
-            call(s3, bucket_name, item_list[0], prepare_local_path_retvals[0]),
-            call(s3, bucket_name, item_list[1], prepare_local_path_retvals[1]),
-            call(s3, bucket_name, item_list[2], prepare_local_path_retvals[2]),
+            call(
+                s3,
+                bucket_name,
+                item_list[i],
+                prepare_local_path_retvals[i],
+                **DEFAULT_TRANSFER_OPTIONS,
+            )
+            for i in range(3)
         ]
 
+    @patch("opal_release_downloader.fetch.record_entry")
+    @patch("opal_release_downloader.fetch.save_record")
+    @patch("opal_release_downloader.fetch.load_record")
     @patch("opal_release_downloader.fetch.s3_download_with_progress")
     @patch("opal_release_downloader.fetch.prepare_local_path")
     @patch("opal_release_downloader.fetch.get_s3_client")
@@ -173,6 +492,9 @@ class TestFetch:
         mock_gets3,
         mock_prepare_local_path,
         mock_s3_download,
+        mock_load_record,
+        mock_save_record,
+        mock_record_entry,
         mock_os_path,
     ):
         bucket_name = "howdy-doody"
@@ -195,8 +517,23 @@ class TestFetch:
         prepare_local_path_retvals = ["two", "three", "four"]
         mock_prepare_local_path.side_effect = prepare_local_path_retvals
 
-        get_files(bucket_name, path_spec, region_name=region_name, dest=dest)
-
+        mock_load_record.return_value = {}
+        mock_s3_download.return_value = "d41d8cd98f00b204e9800998ecf8427e"
+        mock_os_path.basename.side_effect = lambda p: p
+        mock_os_path.join.side_effect = lambda *p: "/".join(p)
+        mock_record_entry.side_effect = lambda ln, it, digest: {"MD5": digest}
+
+        fetched = get_files(bucket_name, path_spec, region_name=region_name, dest=dest)
+
+        mock_load_record.assert_called_once_with(dest + "/.opal_fetch.json")
+        mock_save_record.assert_called_once_with(
+            dest + "/.opal_fetch.json",
+            {
+                ln: {"MD5": mock_s3_download.return_value}
+                for ln in ["two", "three", "four"]
+            },
+        )
+        assert fetched["two"]["MD5"] == mock_s3_download.return_value
         mock_os_path.realpath.assert_called_once_with(dest)
         mock_list_objects.assert_called_once_with(
             bucket_name, prefix=path_spec, region_name=region_name
@@ -204,16 +541,24 @@ class TestFetch:
         mock_gets3.assert_called_once_with(region_name=region_name)
         mock_os_path.relpath.assert_called_once_with(dest)
         assert mock_prepare_local_path.mock_calls == [
-            call(dest, item_list[0], no_overwrite=False),
-            call(dest, item_list[1], no_overwrite=False),
-            call(dest, item_list[2], no_overwrite=False),
+            call(dest, item_list[0], no_overwrite=True),
+            call(dest, item_list[1], no_overwrite=True),
+            call(dest, item_list[2], no_overwrite=True),
         ]
         assert mock_s3_download.mock_calls == [
-            call(s3, bucket_name, item_list[0], prepare_local_path_retvals[0]),
-            call(s3, bucket_name, item_list[1], prepare_local_path_retvals[1]),
-            call(s3, bucket_name, item_list[2], prepare_local_path_retvals[2]),
+            call(
+                s3,
+                bucket_name,
+                item_list[i],
+                prepare_local_path_retvals[i],
+                **DEFAULT_TRANSFER_OPTIONS,
+            )
+            for i in range(3)
         ]
 
+    @patch("opal_release_downloader.fetch.record_entry")
+    @patch("opal_release_downloader.fetch.save_record")
+    @patch("opal_release_downloader.fetch.load_record")
     @patch("opal_release_downloader.fetch.s3_download_with_progress")
     @patch("opal_release_downloader.fetch.prepare_local_path")
     @patch("opal_release_downloader.fetch.get_s3_client")
@@ -224,6 +569,9 @@ class TestFetch:
         mock_gets3,
         mock_prepare_local_path,
         mock_s3_download,
+        mock_load_record,
+        mock_save_record,
+        mock_record_entry,
         mock_os_path,
     ):
         bucket_name = "howdy-doody"
@@ -267,6 +615,409 @@ class TestFetch:
             call(dest, item_list[2], no_overwrite=True),
         ]
         assert mock_s3_download.mock_calls == [
-            call(s3, bucket_name, item_list[0], prepare_local_path_retvals[0]),
-            call(s3, bucket_name, item_list[1], prepare_local_path_retvals[1]),
+            call(
+                s3,
+                bucket_name,
+                item_list[i],
+                prepare_local_path_retvals[i],
+                **DEFAULT_TRANSFER_OPTIONS,
+            )
+            for i in range(2)
+        ]
+
+    @patch("opal_release_downloader.fetch.s3_download_with_progress")
+    def test_download_objects_serial(self, mock_s3_download):
+        s3 = "s3 client"
+        bucket_name = "b"
+        downloads = [
+            ({"Key": "2022.09.07/three", "Size": 100}, "three"),
+            ({"Key": "2022.09.07/blind", "Size": 200}, "blind"),
+        ]
+
+        download_objects(s3, bucket_name, downloads, jobs=1)
+
+        assert mock_s3_download.mock_calls == [
+            call(s3, bucket_name, downloads[0][0], "three"),
+            call(s3, bucket_name, downloads[1][0], "blind"),
+        ]
+
+    @patch("tqdm.tqdm.write")
+    @patch("opal_release_downloader.fetch.s3_download_with_progress")
+    def test_download_objects_parallel(self, mock_s3_download, mock_write):
+        s3 = "s3 client"
+        bucket_name = "b"
+        downloads = [
+            ({"Key": f"2022.09.07/f{i}", "Size": 100}, f"f{i}") for i in range(8)
+        ]
+
+        download_objects(s3, bucket_name, downloads, jobs=3)
+
+        assert mock_s3_download.call_count == len(downloads)
+        downloaded = sorted(c.args[3] for c in mock_s3_download.mock_calls)
+        assert downloaded == sorted(ln for _, ln in downloads)
+        positions = {c.kwargs["position"] for c in mock_s3_download.mock_calls}
+        assert positions <= {0, 1, 2}
+
+    @patch("tqdm.tqdm.write")
+    @patch("opal_release_downloader.fetch.s3_download_with_progress")
+    def test_download_objects_shared_slots(self, mock_s3_download, mock_write):
+        downloads = [({"Key": "2022.09.07/f0", "Size": 100}, "f0")]
+        slots = ProgressSlots(4)
+        with slots.slot(), slots.slot():
+            download_objects("s3 client", "b", downloads, jobs=1, slots=slots)
+
+        mock_s3_download.assert_called_once_with(
+            "s3 client", "b", downloads[0][0], "f0", position=2
+        )
+
+    @patch("tqdm.tqdm.write")
+    @patch("opal_release_downloader.fetch.s3_download_with_progress")
+    def test_download_objects_parallel_failure(self, mock_s3_download, mock_write):
+        s3 = "s3 client"
+        bucket_name = "b"
+        downloads = [
+            ({"Key": f"2022.09.07/f{i}", "Size": 100}, f"f{i}") for i in range(8)
+        ]
+
+        def side_effect(s3_client, bucket, s3_item, local_name, position=None):
+            if local_name == "f0":
+                raise ValueError("connection reset")
+
+        mock_s3_download.side_effect = side_effect
+
+        with pytest.raises(RuntimeError, match="2022.09.07/f0"):
+            download_objects(s3, bucket_name, downloads, jobs=2)
+
+    @patch("tqdm.tqdm.write")
+    @patch("opal_release_downloader.fetch.s3_download_with_progress")
+    def test_download_objects_parallel_interrupted(self, mock_s3_download, mock_write):
+        downloads = [
+            ({"Key": f"2022.09.07/f{i}", "Size": 100}, f"f{i}") for i in range(8)
         ]
+        started = []
+
+        def side_effect(s3_client, bucket, s3_item, local_name, position=None):
+            started.append(local_name)
+            if local_name == "f0":
+                raise KeyboardInterrupt
+
+        mock_s3_download.side_effect = side_effect
+
+        try:
+            with pytest.raises(KeyboardInterrupt):
+                download_objects("s3 client", "b", downloads, jobs=2)
+            # downloads still running elsewhere are told to stop
+            with pytest.raises(RuntimeError, match="interrupted"):
+                check_cancelled()
+        finally:
+            set_cancelled(False)
+        assert len(started) < len(downloads)
+
+    @patch("opal_release_downloader.fetch.is_unchanged")
+    @patch("opal_release_downloader.fetch.record_entry")
+    @patch("opal_release_downloader.fetch.save_record")
+    @patch("opal_release_downloader.fetch.load_record")
+    @patch("opal_release_downloader.fetch.s3_download_with_progress")
+    @patch("opal_release_downloader.fetch.prepare_local_path")
+    @patch("opal_release_downloader.fetch.get_s3_client")
+    @patch("opal_release_downloader.fetch.list_bucket_objects")
+    def test_get_files_sync(
+        self,
+        mock_list_objects,
+        mock_gets3,
+        mock_prepare_local_path,
+        mock_s3_download,
+        mock_load_record,
+        mock_save_record,
+        mock_record_entry,
+        mock_is_unchanged,
+        mock_os_path,
+    ):
+        bucket_name = "howdy-doody"
+        path_spec = "2022.09.12"
+        dest = "/home/user/opal_download"
+
+        item_list = [
+            {"Key": "2022.09.07/three", "Size": 100},
+            {"Key": "2022.09.07/blind", "Size": 200},
+        ]
+        record = {
+            "three": {"Key": "2022.09.07/three", "MD5": "aaa"},
+            "blind": {"Key": "2022.09.07/blind", "MD5": "bbb"},
+        }
+        mock_os_path.realpath.return_value = dest
+        mock_os_path.basename.side_effect = lambda p: p
+        mock_os_path.exists.return_value = True
+        mock_list_objects.return_value = item_list
+        mock_prepare_local_path.side_effect = ["three", "blind"]
+        mock_load_record.return_value = record
+        mock_is_unchanged.side_effect = [True, False]
+        mock_s3_download.return_value = "ccc"
+        mock_record_entry.return_value = {"MD5": "ccc"}
+        old_entries = dict(record)
+
+        fetched = get_files(bucket_name, path_spec, dest=dest, sync=True)
+
+        assert mock_prepare_local_path.mock_calls == [
+            call(dest, item_list[0], no_overwrite=True),
+            call(dest, item_list[1], no_overwrite=True),
+        ]
+        assert mock_is_unchanged.mock_calls == [
+            call("three", item_list[0], old_entries["three"]),
+            call("blind", item_list[1], old_entries["blind"]),
+        ]
+        mock_s3_download.assert_called_once()
+        assert mock_s3_download.call_args.args[2:] == (item_list[1], "blind")
+        assert fetched_digests(fetched) == {"three": "aaa", "blind": "ccc"}
+        assert mock_save_record.call_args.args[1]["blind"] == {"MD5": "ccc"}
+
+    def test_record_entry_and_is_unchanged(self, tmp_path):
+        local_name = str(tmp_path / "blind")
+        with open(local_name, "wb") as f:
+            f.write(bytes(200))
+        s3_item = {
+            "Key": "2022.09.07/blind",
+            "Size": 200,
+            "ETag": '"abc"',
+            "LastModified": "2022-09-07 12:00:00+00:00",
+        }
+
+        entry = record_entry(local_name, s3_item, "md5")
+
+        assert entry["MD5"] == "md5"
+        assert is_unchanged(local_name, s3_item, entry)
+        assert not is_unchanged(local_name, s3_item, None)
+        assert not is_unchanged(local_name, dict(s3_item, ETag='"def"'), entry)
+        assert not is_unchanged(local_name, dict(s3_item, Size=201), entry)
+        assert not is_unchanged(
+            local_name, dict(s3_item, LastModified="2023-01-01"), entry
+        )
+
+        os.utime(local_name, ns=(0, entry["mtime_ns"] + 1000))
+        assert not is_unchanged(local_name, s3_item, entry)
+
+    def test_get_files_unknown_backend(self):
+        with pytest.raises(RuntimeError) as e:
+            get_files("b", "2022.09.07", backend="carrier-pigeon")
+        assert "unknown download backend" in str(e.value)
+
+    @patch("opal_release_downloader.fetch.save_record")
+    @patch("opal_release_downloader.fetch.load_record")
+    @patch("opal_release_downloader.fetch.download_objects")
+    @patch("opal_release_downloader.fetch.download_objects_async")
+    @patch("opal_release_downloader.fetch.prepare_local_path")
+    @patch("opal_release_downloader.fetch.get_s3_client")
+    @patch("opal_release_downloader.fetch.list_bucket_objects")
+    def test_get_files_asyncio_backend(
+        self,
+        mock_list_objects,
+        mock_gets3,
+        mock_prepare_local_path,
+        mock_download_async,
+        mock_download,
+        mock_load_record,
+        mock_save_record,
+    ):
+        item_list = [{"Key": "unpacker/a.sh", "Size": 10}]
+        mock_list_objects.return_value = item_list
+        mock_gets3.return_value = "s3 client"
+        mock_prepare_local_path.return_value = "/dest/a.sh"
+        mock_load_record.return_value = {}
+
+        get_files("b", "unpacker", dest="/dest", jobs=8, backend="asyncio")
+
+        mock_download.assert_not_called()
+        mock_download_async.assert_called_once_with(
+            "s3 client", "b", [(item_list[0], "/dest/a.sh")], jobs=8, on_complete=ANY
+        )
+
+    def test_download_objects_async_missing_aiohttp(self):
+        with patch.dict(sys.modules, {"opal_release_downloader._aio": None}):
+            with pytest.raises(RuntimeError) as e:
+                download_objects_async("s3 client", "b", [({"Key": "k"}, "k")])
+
+        assert "pip install opal_release_downloader[async]" in str(e.value)
+
+    @patch("opal_release_downloader.fetch.save_record")
+    @patch("opal_release_downloader.fetch.load_record")
+    @patch("opal_release_downloader.fetch.download_objects")
+    @patch("opal_release_downloader.fetch.prepare_local_path")
+    @patch("opal_release_downloader.fetch.get_s3_client")
+    @patch("opal_release_downloader.fetch.list_bucket_objects")
+    def test_get_files_small_files_first(
+        self,
+        mock_list_objects,
+        mock_gets3,
+        mock_prepare_local_path,
+        mock_download,
+        mock_load_record,
+        mock_save_record,
+    ):
+        item_list = [
+            {"Key": "2022.09.07/big.tar.gz", "Size": 5000},
+            {"Key": "2022.09.07/md5sums_2022.09.07", "Size": 100},
+            {"Key": "2022.09.07/small.tar.gz", "Size": 300},
+            {"Key": "2022.09.07/file_manifest_2022.09.07.yml", "Size": 100},
+        ]
+        mock_list_objects.return_value = item_list
+        mock_prepare_local_path.side_effect = lambda dest, it, **kw: it["Key"]
+        mock_load_record.return_value = {}
+
+        get_files("b", "2022.09.07", dest="/dest")
+
+        downloads = mock_download.call_args.args[2]
+        assert [it["Key"] for it, _ in downloads] == [
+            "2022.09.07/md5sums_2022.09.07",
+            "2022.09.07/file_manifest_2022.09.07.yml",
+            "2022.09.07/small.tar.gz",
+            "2022.09.07/big.tar.gz",
+        ]
+
+    @patch("opal_release_downloader.fetch.list_bucket_objects")
+    def test_plan_files(self, mock_list_objects, tmp_path):
+        dest = str(tmp_path)
+        item_list = [
+            {"Key": "2022.09.07/three", "Size": 100, "ETag": '"a"'},
+            {"Key": "2022.09.07/blind", "Size": 200, "ETag": '"b"'},
+            {"Key": "2022.09.07/mice", "Size": 300, "ETag": '"c"'},
+        ]
+        mock_list_objects.return_value = item_list
+        with open(tmp_path / "three", "wb") as f:
+            f.write(bytes(100))
+        save_record(
+            os.path.join(dest, FETCH_RECORD),
+            {"three": record_entry(str(tmp_path / "three"), item_list[0], "aaa")},
+        )
+        # half of blind is already downloaded
+        local_name = str(tmp_path / "blind")
+        with open(local_name + ".part", "wb") as f:
+            f.write(bytes(50))
+        checkpoint = Checkpoint(local_name, item_list[1])
+        checkpoint.completed = 50
+        checkpoint.save()
+
+        plan = plan_files("b", "2022.09.07", dest=dest, sync=True)
+
+        assert plan["dest"] == os.path.realpath(dest)
+        assert plan["skip"] == [
+            {"Key": "2022.09.07/three", "Size": 100, "reason": "unchanged"}
+        ]
+        assert plan["download"] == [
+            {"Key": "2022.09.07/blind", "Size": 200, "bytes": 150},
+            {"Key": "2022.09.07/mice", "Size": 300, "bytes": 300},
+        ]
+        assert plan["bytes"] == 450
+        assert plan["skipped_bytes"] == 100
+        # nothing was created or changed
+        assert sorted(os.listdir(dest)) == [
+            FETCH_RECORD,
+            "blind.part",
+            "blind.part.json",
+            "three",
+        ]
+
+    def test_probe_throughput(self):
+        s3 = Mock()
+        s3.get_object.side_effect = lambda **kw: {
+            "Body": io.BytesIO(bytes(int(kw["Range"].split("-")[1]) + 1))
+        }
+        item = {"Key": "k", "Size": 1000}
+
+        assert probe_throughput(s3, "b", item, connections=2, nbytes=600) > 0
+        ranges = sorted(c.kwargs["Range"] for c in s3.get_object.mock_calls)
+        assert ranges == ["bytes=0-299", "bytes=300-599"]
+
+    def test_probe_throughput_total_capped(self):
+        s3 = Mock()
+        s3.get_object.side_effect = lambda **kw: {"Body": io.BytesIO(b"")}
+        item = {"Key": "k", "Size": 10**6}
+
+        probe_throughput(s3, "b", item, connections=8, nbytes=400)
+
+        # more connections share the same bytes rather than fetching more
+        ranges = [c.kwargs["Range"] for c in s3.get_object.mock_calls]
+        assert len(ranges) == 8
+        assert max(int(r.split("-")[1]) for r in ranges) == 399
+
+    @patch("opal_release_downloader.fetch.free_space")
+    def test_plan_summary_probe_failure(self, mock_free_space, capsys):
+        s3 = Mock()
+        s3.get_object.side_effect = RuntimeError("denied")
+        mock_free_space.return_value = 1000
+        stage = {
+            "download": [{"Key": "k", "Size": 10, "bytes": 10}],
+            "skip": [],
+            "bytes": 10,
+            "skipped_bytes": 0,
+        }
+
+        plan = plan_summary(s3, "b", [stage], "/dest")
+
+        assert plan["throughput"] is None
+        assert plan["probe_error"] == "denied"
+        # nothing printed ahead of a json plan
+        assert capsys.readouterr().out == ""
+
+    @patch("opal_release_downloader.fetch.download_objects")
+    @patch("opal_release_downloader.fetch.get_s3_client")
+    @patch("opal_release_downloader.fetch.list_bucket_objects")
+    def test_get_files_keeps_existing_until_replaced(
+        self, mock_list_objects, mock_gets3, mock_download, tmp_path
+    ):
+        (tmp_path / "image_00.tar.gz").write_bytes(b"old image")
+        mock_list_objects.return_value = [
+            {"Key": "2022.09.07/image_00.tar.gz", "Size": 5000},
+            {"Key": "2022.09.07/md5sums_2022.09.07", "Size": 100},
+        ]
+        mock_download.side_effect = KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            get_files("b", "2022.09.07", dest=str(tmp_path))
+
+        # an interrupted run leaves the old copy in place
+        assert (tmp_path / "image_00.tar.gz").read_bytes() == b"old image"
+
+    @patch("opal_release_downloader.fetch.download_objects")
+    @patch("opal_release_downloader.fetch.get_s3_client")
+    @patch("opal_release_downloader.fetch.list_bucket_objects")
+    def test_get_files_sync_skip_then_verify(
+        self, mock_list_objects, mock_gets3, mock_download, tmp_path
+    ):
+        from opal_release_downloader.verify import verify_directory
+
+        data = b"image"
+        s3_item = {
+            "Key": "2022.09.07/image_00.tar.gz",
+            "Size": len(data),
+            "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+            "LastModified": "2022-09-07 12:00:00+00:00",
+        }
+        local_name = str(tmp_path / "image_00.tar.gz")
+        with open(local_name, "wb") as f:
+            f.write(data)
+        entry = dict(
+            record_entry(local_name, s3_item, hashlib.md5(data).hexdigest()),
+            ETagVerified=True,
+        )
+        save_record(str(tmp_path / FETCH_RECORD), {"image_00.tar.gz": entry})
+        (tmp_path / "md5sums_2022.09.07").write_text(
+            f"{hashlib.md5(data).hexdigest()}  image_00.tar.gz\n"
+        )
+        # an interrupted download of it again
+        with open(local_name + ".part", "wb") as f:
+            f.write(data[:2])
+        checkpoint = Checkpoint(local_name, s3_item)
+        checkpoint.completed = 2
+        checkpoint.save()
+        mock_list_objects.return_value = [s3_item]
+
+        with patch("builtins.print"):
+            fetched = get_files("b", "2022.09.07", dest=str(tmp_path), sync=True)
+            verify_directory(
+                str(tmp_path),
+                search=True,
+                require_manifest=False,
+                verified=fetched_verified(fetched),
+            )
+
+        assert mock_download.call_args.args[2] == []
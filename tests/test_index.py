@@ -0,0 +1,85 @@
+import datetime
+import json
+import os
+
+import pytest
+from unittest.mock import patch, Mock
+
+from opal_release_downloader._index import *
+
+
+@pytest.fixture
+def index_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    yield tmp_path
+    set_index_ttl(None)
+
+
+class TestIndex:
+    def test_index_path(self, index_cache):
+        assert index_path("my-bucket", "us-gov-west-1") == os.path.join(
+            str(index_cache), "opal-release-downloader", "my-bucket.us-gov-west-1.json"
+        )
+
+    def test_cached_listing_disabled(self, index_cache):
+        load = Mock(return_value=["2022.10.31/"])
+
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.10.31/"]
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.10.31/"]
+
+        assert load.call_count == 2
+        assert not os.path.exists(index_path("b", "r"))
+
+    def test_cached_listing(self, index_cache):
+        modified = datetime.datetime(2022, 10, 31, tzinfo=datetime.timezone.utc)
+        listing = [{"Key": "2022.10.31/a", "Size": 1, "LastModified": modified}]
+        load = Mock(return_value=listing)
+        set_index_ttl(60)
+
+        assert cached_listing("b", "r", "objects/2022.10.31", load) == listing
+        assert cached_listing("b", "r", "objects/2022.10.31", load) == listing
+
+        load.assert_called_once_with()
+        with open(index_path("b", "r")) as f:
+            assert "objects/2022.10.31" in json.load(f)
+
+    @patch("opal_release_downloader._index.time")
+    def test_cached_listing_stale(self, mock_time, index_cache):
+        load = Mock(side_effect=[["2022.10.31/"], ["2022.11.30/"]])
+        set_index_ttl(60)
+
+        mock_time.time.return_value = 1000.0
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.10.31/"]
+        mock_time.time.return_value = 1059.0
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.10.31/"]
+        mock_time.time.return_value = 1060.0
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.11.30/"]
+
+        assert load.call_count == 2
+
+    def test_cached_listing_refresh(self, index_cache):
+        load = Mock(side_effect=[["2022.10.31/"], ["2022.11.30/"]])
+        set_index_ttl(0)
+
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.10.31/"]
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.11.30/"]
+
+        set_index_ttl(60)
+        assert cached_listing("b", "r", "prefixes/", load) == ["2022.11.30/"]
+        assert load.call_count == 2
+
+    def test_cached_listing_empty(self, index_cache):
+        load = Mock(return_value=[])
+        set_index_ttl(60)
+
+        assert cached_listing("b", "r", "objects/missing", load) == []
+        assert cached_listing("b", "r", "objects/missing", load) == []
+
+        assert load.call_count == 2
+
+    @patch("opal_release_downloader._index.save_record")
+    def test_cached_listing_unwritable(self, mock_save_record, index_cache):
+        mock_save_record.side_effect = PermissionError("read-only")
+        set_index_ttl(60)
+
+        assert cached_listing("b", "r", "prefixes/", lambda: ["x/"]) == ["x/"]
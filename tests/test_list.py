@@ -1,8 +1,9 @@
 import pytest
-from unittest.mock import patch, Mock, call
+from unittest.mock import patch, Mock, call, ANY
 
 from opal_release_downloader.list import *
 
+from opal_release_downloader._constants import DEFAULT_MAX_POOL_CONNECTIONS
 import opal_release_downloader._date as _date
 import sys
 import botocore
@@ -25,10 +26,20 @@ def list_bucket_objects_config():
     return [bucket_name, config_retval, region_name, prefix, list_objects_dict]
 
 
+@pytest.fixture
+def clean_s3_clients():
+    clear_s3_clients()
+    yield
+    clear_s3_clients()
+    set_max_pool_connections(DEFAULT_MAX_POOL_CONNECTIONS)
+
+
 class TestList:
     @patch("botocore.config")
     @patch("boto3.client")
-    def test_get_s3_client(self, mock_boto3, mock_botocore, list_bucket_objects_config):
+    def test_get_s3_client(
+        self, mock_boto3, mock_botocore, list_bucket_objects_config, clean_s3_clients
+    ):
         (
             bucket_name,
             config_retval,
@@ -44,16 +55,39 @@ class TestList:
         s3 = get_s3_client(region_name=region_name)
 
         mock_botocore.Config.assert_called_once_with(
-            signature_version=botocore.UNSIGNED
+            signature_version=botocore.UNSIGNED,
+            max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
         )
         mock_boto3.assert_called_once_with(
             "s3", region_name=region_name, config=config_retval
         )
         assert mock_s3_client == s3
 
-    @patch("opal_release_downloader.list.get_s3_client")
-    def test_list_bucket_objects(self, mock_gets3, list_bucket_objects_config):
+    @patch("botocore.config")
+    @patch("boto3.client")
+    def test_get_s3_client_cached(
+        self, mock_boto3, mock_botocore, list_bucket_objects_config, clean_s3_clients
+    ):
+        (_, _, region_name, _, _) = list_bucket_objects_config
+
+        mock_boto3.side_effect = lambda *args, **kwargs: Mock()
+
+        s3 = get_s3_client(region_name=region_name)
+        assert get_s3_client(region_name=region_name) is s3
+        assert get_s3_client(region_name="elsewhere") is not s3
+        assert mock_boto3.call_count == 2
+
+        set_max_pool_connections(40)
+        s3_big_pool = get_s3_client(region_name=region_name)
+        assert s3_big_pool is not s3
+        mock_botocore.Config.assert_called_with(
+            signature_version=botocore.UNSIGNED, max_pool_connections=40
+        )
+        assert get_s3_client(region_name=region_name) is s3_big_pool
+        assert get_s3_client(region_name=region_name, max_pool_connections=10) is s3
 
+    @patch("opal_release_downloader.list.get_s3_client")
+    def test_iter_bucket_pages(self, mock_gets3, list_bucket_objects_config):
         (
             bucket_name,
             _,
@@ -62,24 +96,113 @@ class TestList:
             list_objects_dict,
         ) = list_bucket_objects_config
 
+        pages = [list_objects_dict, {"KeyCount": 0}]
         mock_s3_client = Mock()
-        mock_s3_client.list_objects_v2.return_value = list_objects_dict
+        mock_paginator = mock_s3_client.get_paginator.return_value
+        mock_paginator.paginate.return_value = iter(pages)
         mock_gets3.return_value = mock_s3_client
 
-        test_obj_dict = list_bucket_objects(
-            bucket_name, prefix=prefix, region_name=region_name
+        test_pages = list(
+            iter_bucket_pages(bucket_name, prefix=prefix, region_name=region_name)
         )
-        mock_s3_client.list_objects_v2.assert_called_once_with(
+
+        mock_gets3.assert_called_once_with(region_name=region_name)
+        mock_s3_client.get_paginator.assert_called_once_with("list_objects_v2")
+        mock_paginator.paginate.assert_called_once_with(
             Bucket=bucket_name, Prefix=prefix
         )
+        assert test_pages == pages
 
-        mock_gets3.assert_called_once_with(region_name=region_name)
+    @patch("opal_release_downloader.list.get_s3_client")
+    def test_iter_bucket_pages_delimiter(self, mock_gets3, list_bucket_objects_config):
+        (bucket_name, _, region_name, prefix, _) = list_bucket_objects_config
+
+        mock_s3_client = Mock()
+        mock_paginator = mock_s3_client.get_paginator.return_value
+        mock_paginator.paginate.return_value = iter([])
+        mock_gets3.return_value = mock_s3_client
+
+        list(
+            iter_bucket_pages(
+                bucket_name, prefix=prefix, delimiter="/", region_name=region_name
+            )
+        )
+
+        mock_paginator.paginate.assert_called_once_with(
+            Bucket=bucket_name, Prefix=prefix, Delimiter="/"
+        )
+
+    @patch("opal_release_downloader.list.iter_bucket_pages")
+    def test_iter_bucket_objects(self, mock_pages, list_bucket_objects_config):
+        (
+            bucket_name,
+            _,
+            region_name,
+            prefix,
+            list_objects_dict,
+        ) = list_bucket_objects_config
+
+        contents = list_objects_dict["Contents"]
+        mock_pages.return_value = iter(
+            [
+                {"KeyCount": 2, "Contents": contents[:2]},
+                {"KeyCount": 1, "Contents": contents[2:]},
+                {"KeyCount": 0},
+            ]
+        )
+
+        test_objects = list(
+            iter_bucket_objects(bucket_name, prefix=prefix, region_name=region_name)
+        )
+
+        mock_pages.assert_called_once_with(
+            bucket_name, prefix=prefix, region_name=region_name
+        )
+        assert test_objects == contents
+
+    @patch("opal_release_downloader.list.iter_bucket_pages")
+    def test_iter_common_prefixes(self, mock_pages, list_bucket_objects_config):
+        (bucket_name, _, region_name, _, _) = list_bucket_objects_config
+
+        mock_pages.return_value = iter(
+            [
+                {"CommonPrefixes": [{"Prefix": "2022.04.05/"}]},
+                {"CommonPrefixes": [{"Prefix": "2022.10.01/"}, {"Prefix": "docker/"}]},
+            ]
+        )
+
+        test_prefixes = list(iter_common_prefixes(bucket_name, region_name=region_name))
+
+        mock_pages.assert_called_once_with(
+            bucket_name, prefix="", delimiter="/", region_name=region_name
+        )
+        assert test_prefixes == ["2022.04.05/", "2022.10.01/", "docker/"]
+
+    @patch("opal_release_downloader.list.iter_bucket_objects")
+    def test_list_bucket_objects(self, mock_iter_objects, list_bucket_objects_config):
+
+        (
+            bucket_name,
+            _,
+            region_name,
+            prefix,
+            list_objects_dict,
+        ) = list_bucket_objects_config
+
+        mock_iter_objects.return_value = iter(list_objects_dict["Contents"])
+
+        test_obj_dict = list_bucket_objects(
+            bucket_name, prefix=prefix, region_name=region_name
+        )
+        mock_iter_objects.assert_called_once_with(
+            bucket_name, prefix=prefix, region_name=region_name
+        )
 
         assert test_obj_dict == list_objects_dict["Contents"]
 
-    @patch("opal_release_downloader.list.get_s3_client")
+    @patch("opal_release_downloader.list.iter_bucket_objects")
     def test_list_bucket_objects_no_object_found(
-        self, mock_gets3, list_bucket_objects_config
+        self, mock_iter_objects, list_bucket_objects_config
     ):
 
         (
@@ -90,27 +213,21 @@ class TestList:
             list_objects_dict,
         ) = list_bucket_objects_config
 
-        # Modify keycount so exception is raised
-        list_objects_dict["KeyCount"] = 0
-
-        mock_s3_client = Mock()
-        mock_s3_client.list_objects_v2.return_value = list_objects_dict
-        mock_gets3.return_value = mock_s3_client
+        mock_iter_objects.return_value = iter([])
 
         with pytest.raises(RuntimeError):
             list_bucket_objects(bucket_name, prefix=prefix, region_name=region_name)
 
-        mock_s3_client.list_objects_v2.assert_called_once_with(
-            Bucket=bucket_name, Prefix=prefix
+        mock_iter_objects.assert_called_once_with(
+            bucket_name, prefix=prefix, region_name=region_name
         )
 
-        mock_gets3.assert_called_once_with(region_name=region_name)
-
-    @patch("opal_release_downloader.list.list_bucket_objects")
-    def test_get_list(self, mock_list_bucket_objects, list_bucket_objects_config):
+    @patch("opal_release_downloader.list.iter_common_prefixes")
+    def test_get_list(self, mock_iter_prefixes, list_bucket_objects_config):
         (bucket_name, _, region_name, _, list_objects_dict) = list_bucket_objects_config
 
-        mock_list_bucket_objects.return_value = list_objects_dict["Contents"]
+        prefixes = ["2022.10.01/", "2022.04.05/", "docker/", "unpacker/"]
+        mock_iter_prefixes.return_value = iter(prefixes)
 
         s = set()
         for o in list_objects_dict["Contents"]:
@@ -120,10 +237,8 @@ class TestList:
 
         test_tuple = get_list(bucket_name, region_name=region_name)
 
-        mock_list_bucket_objects.assert_called_with(
-            bucket_name, region_name=region_name
-        )
-        mock_list_bucket_objects.assert_called_once()
+        mock_iter_prefixes.assert_called_with(bucket_name, region_name=region_name)
+        mock_iter_prefixes.assert_called_once()
 
         index = 0
         for test_val in test_tuple:
@@ -193,6 +308,67 @@ class TestList:
         )
         mock_json.assert_called_once()
 
+    @patch("json.dump")
+    @patch("opal_release_downloader.list.get_all")
+    def test_print_all_fields(self, mock_get_all, mock_json):
+        mock_get_all.return_value = [
+            {"Key": "2022.10.01/file1.txt", "Size": 1, "ETag": '"abc"'},
+        ]
+
+        print_all("my bucket", fields=["Size", "Key", "Missing"])
+
+        mock_json.assert_called_once_with(
+            [{"Size": 1, "Key": "2022.10.01/file1.txt"}],
+            sys.stdout,
+            indent=2,
+            default=str,
+        )
+
+    @patch("opal_release_downloader.list.get_all")
+    @patch("opal_release_downloader.list.iter_bucket_pages")
+    def test_print_all_ndjson(self, mock_iter_bucket_pages, mock_get_all, capsys):
+        pages = [
+            {
+                "Contents": [
+                    {"Key": "a", "Size": 1, "ETag": '"x"'},
+                    {"Key": "b", "Size": 2},
+                ]
+            },
+            {"Contents": [{"Key": "c", "Size": 3}]},
+        ]
+        written = []
+
+        def iter_pages(*args, **kwargs):
+            for page in pages:
+                yield page
+                # each page is written out before the next one is listed
+                written.append(capsys.readouterr().out)
+
+        mock_iter_bucket_pages.side_effect = iter_pages
+
+        print_all("my bucket", prefix="p/", format="ndjson", fields=["Key", "Size"])
+
+        mock_get_all.assert_not_called()
+        mock_iter_bucket_pages.assert_called_once_with(
+            "my bucket", prefix="p/", region_name=DEFAULT_REGION
+        )
+        assert written == [
+            '{"Key": "a", "Size": 1}\n{"Key": "b", "Size": 2}\n',
+            '{"Key": "c", "Size": 3}\n',
+        ]
+
+    @patch("opal_release_downloader.list.iter_bucket_pages")
+    def test_stream_all_empty(self, mock_iter_bucket_pages):
+        mock_iter_bucket_pages.return_value = iter([{"KeyCount": 0}])
+
+        with pytest.raises(RuntimeError):
+            stream_all("my bucket", prefix="p/")
+
+    def test_parse_fields(self):
+        assert parse_fields("Key, Size,ETag") == ["Key", "Size", "ETag"]
+        with pytest.raises(ValueError):
+            parse_fields(" , ")
+
     @patch("builtins.print")
     @patch("opal_release_downloader.list.get_all")
     def test_print_files(self, mock_get_all, mock_print, list_bucket_objects_config):
@@ -230,3 +406,28 @@ class TestList:
 
         result = get_latest(bucket_name, region_name=region_name)
         assert result == ret_vals[1]
+
+    @patch("opal_release_downloader.list.get_list")
+    def test_get_latest_no_releases(self, mock_get_list, list_bucket_objects_config):
+        (bucket_name, _, region_name, _, _) = list_bucket_objects_config
+
+        mock_get_list.return_value = (x for x in [])
+
+        with pytest.raises(RuntimeError):
+            get_latest(bucket_name, region_name=region_name)
+
+    @patch("opal_release_downloader.list.cached_listing")
+    def test_list_bucket_objects_cached(
+        self, mock_cached_listing, list_bucket_objects_config
+    ):
+        (bucket_name, _, region_name, prefix, _) = list_bucket_objects_config
+        mock_cached_listing.return_value = [{"Key": "2022.10.01/file1.txt"}]
+
+        obj_list = list_bucket_objects(
+            bucket_name, prefix=prefix, region_name=region_name
+        )
+
+        assert obj_list == [{"Key": "2022.10.01/file1.txt"}]
+        mock_cached_listing.assert_called_once_with(
+            bucket_name, region_name, f"objects/{prefix}", ANY
+        )
@@ -0,0 +1,82 @@
+import subprocess
+import sys
+
+import pytest
+from unittest.mock import patch
+
+from opal_release_downloader.__main__ import main
+
+
+def imported_modules(*args) -> set:
+    """
+    The top-level modules imported by running the package with args, as
+    reported by -X importtime.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "opal_release_downloader", *args],
+        capture_output=True,
+        text=True,
+    )
+    assert proc.returncode == 0, proc.stderr
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+
+def run_without_boto(*args) -> subprocess.CompletedProcess:
+    """
+    Run the package with args as if boto3 was not installed.
+    """
+    code = (
+        "import sys\n"
+        "sys.modules['boto3'] = sys.modules['botocore'] = None\n"
+        f"sys.argv = ['opal_release_downloader', *{list(args)!r}]\n"
+        "from opal_release_downloader.__main__ import main\n"
+        "main()\n"
+    )
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+
+
+class TestMain:
+    @pytest.mark.parametrize(
+        "argv, module, args",
+        [
+            (["prog"], ".download", []),
+            (["prog", "bucket", "2023.01.02"], ".download", ["bucket", "2023.01.02"]),
+            (["prog", "list", "bucket"], ".list", ["bucket"]),
+            (["prog", "FETCH", "bucket", "tag"], ".fetch", ["bucket", "tag"]),
+            (["prog", "verify", "images"], ".verify", ["images"]),
+        ],
+    )
+    @patch("importlib.import_module")
+    def test_main(self, mock_import_module, argv, module, args):
+        with patch.object(sys, "argv", argv):
+            main()
+            assert sys.argv[1:] == args
+
+        mock_import_module.assert_called_once_with(module, "opal_release_downloader")
+        mock_import_module.return_value.main.assert_called_once_with()
+
+    def test_verify_does_not_import_boto(self):
+        modules = imported_modules("verify", "--help")
+
+        assert "opal_release_downloader" in modules
+        assert "boto3" not in modules
+        assert "botocore" not in modules
+
+    def test_list_imports_boto(self):
+        assert "boto3" in imported_modules("list", "--help")
+
+    def test_verify_without_boto(self):
+        proc = run_without_boto("verify", "--help")
+
+        assert proc.returncode == 0, proc.stderr
+
+    @pytest.mark.parametrize("subcmd", ["list", "fetch"])
+    def test_s3_extra_hint(self, subcmd):
+        proc = run_without_boto(subcmd, "--help")
+
+        assert proc.returncode != 0
+        assert "pip install opal_release_downloader[s3]" in proc.stderr
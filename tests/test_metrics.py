@@ -0,0 +1,83 @@
+import argparse
+import json
+
+import pytest
+
+from opal_release_downloader import _metrics
+
+
+class TestMetrics:
+    def setup_method(self):
+        _metrics.reset()
+
+    def test_timed(self):
+        with _metrics.timed("download", "a.tar.gz", nbytes=1000):
+            pass
+        with _metrics.timed("download", nbytes=500):
+            pass
+        _metrics.count("index_hit")
+        _metrics.count("index_hit", 2)
+
+        report = _metrics.report()
+
+        phase = report["phases"]["download"]
+        assert phase["count"] == 2
+        assert phase["errors"] == 0
+        assert phase["bytes"] == 1500
+        assert report["counters"] == {"index_hit": 3}
+        # only named occurrences are kept as events
+        assert len(report["events"]) == 1
+        assert report["events"][0]["name"] == "a.tar.gz"
+        assert report["events"][0]["bytes"] == 1000
+
+    def test_timed_error(self):
+        with pytest.raises(RuntimeError):
+            with _metrics.timed("hash", "a.tar.gz"):
+                raise RuntimeError("boom")
+
+        report = _metrics.report()
+
+        assert report["phases"]["hash"]["errors"] == 1
+        assert report["events"][0]["error"] == "RuntimeError: boom"
+
+    def test_reset(self):
+        with _metrics.timed("verify", "images"):
+            pass
+        _metrics.count("download_skipped")
+
+        _metrics.reset()
+
+        report = _metrics.report()
+        assert report["phases"] == {}
+        assert report["counters"] == {}
+        assert report["events"] == []
+
+    def test_reporting(self, tmp_path):
+        path = str(tmp_path / "metrics.json")
+
+        with pytest.raises(RuntimeError):
+            with _metrics.reporting(path):
+                with _metrics.timed("fetch", "2023.01.02"):
+                    raise RuntimeError("boom")
+
+        # written even though the run failed
+        with open(path) as f:
+            report = json.load(f)
+        assert report["phases"]["fetch"]["errors"] == 1
+        assert not (tmp_path / "metrics.json.tmp").exists()
+
+    def test_reporting_no_path(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        with _metrics.reporting(None):
+            pass
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_add_metrics_argument(self):
+        parser = argparse.ArgumentParser()
+        _metrics.add_metrics_argument(parser)
+
+        assert parser.parse_args([]).metrics_file is None
+        args = parser.parse_args(["--metrics-file", "m.json"])
+        assert args.metrics_file == "m.json"
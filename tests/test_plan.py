@@ -0,0 +1,104 @@
+import argparse
+import json
+
+import pytest
+from unittest.mock import patch
+
+from opal_release_downloader._plan import *
+
+
+def stage(prefix, download=(), skip=()):
+    return {
+        "prefix": prefix,
+        "dest": f"/dest/{prefix}",
+        "download": list(download),
+        "skip": list(skip),
+        "bytes": sum(it["bytes"] for it in download),
+        "skipped_bytes": sum(it["Size"] for it in skip),
+    }
+
+
+STAGES = [
+    stage(
+        "2023.01.02",
+        download=[
+            {"Key": "2023.01.02/a.tar.gz", "Size": 1000, "bytes": 1000},
+            {"Key": "2023.01.02/b.tar.gz", "Size": 3000, "bytes": 1000},
+        ],
+        skip=[{"Key": "2023.01.02/c.tar.gz", "Size": 500, "reason": "unchanged"}],
+    ),
+    stage("unpacker", skip=[{"Key": "unpacker/x", "Size": 10, "reason": "exists"}]),
+]
+
+
+class TestPlan:
+    def test_summarize(self):
+        plan = summarize(STAGES, free_bytes=10000, throughput=100.0)
+
+        assert plan["objects"] == 2
+        assert plan["bytes"] == 2000
+        assert plan["skipped_objects"] == 2
+        assert plan["skipped_bytes"] == 510
+        assert plan["headroom_bytes"] == 8000
+        assert plan["eta_seconds"] == 20.0
+
+    def test_summarize_bandwidth_limit(self):
+        plan = summarize(STAGES, free_bytes=1000, throughput=100.0, max_bandwidth=50.0)
+
+        assert plan["eta_seconds"] == 40.0
+        assert plan["headroom_bytes"] == -1000
+
+    def test_summarize_no_estimate(self):
+        assert summarize(STAGES, free_bytes=0)["eta_seconds"] is None
+        # nothing to download takes no time, measured or not
+        assert summarize(STAGES[1:], free_bytes=0)["eta_seconds"] == 0.0
+
+    def test_print_plan_text(self, capsys):
+        plan = summarize(STAGES, free_bytes=1000, throughput=100.0)
+
+        with patch("opal_release_downloader._plan.warn") as mock_warn:
+            print_plan(plan)
+
+        out = capsys.readouterr().out
+        assert "download  2023.01.02/a.tar.gz" in out
+        assert "resuming at 2.00kB" in out
+        assert "skip      2023.01.02/c.tar.gz  500B (unchanged)" in out
+        assert "to download: 2 objects" in out
+        assert "estimate:    00:20" in out
+        assert "more disk space is needed" in mock_warn.call_args.args[0]
+
+    def test_print_plan_probe_error(self, capsys):
+        plan = summarize(STAGES, free_bytes=10000, probe_error="denied")
+
+        with patch("opal_release_downloader._plan.warn") as mock_warn:
+            print_plan(plan)
+            mock_warn.assert_called_once_with(
+                "WARNING: unable to measure throughput: denied"
+            )
+            capsys.readouterr()
+
+            print_plan(plan, "json")
+            mock_warn.assert_called_once()
+
+        assert json.loads(capsys.readouterr().out)["probe_error"] == "denied"
+
+    def test_print_plan_json(self, capsys):
+        plan = summarize(STAGES, free_bytes=10000)
+
+        print_plan(plan, "json")
+
+        assert json.loads(capsys.readouterr().out) == plan
+
+    def test_free_space_missing_directory(self, tmp_path):
+        # measured on the nearest directory that exists
+        assert free_space(str(tmp_path / "a" / "b")) > 0
+
+    def test_add_plan_argument(self):
+        parser = argparse.ArgumentParser()
+        add_plan_argument(parser)
+
+        assert parser.parse_args([]).plan is None
+        assert parser.parse_args(["--plan"]).plan == "text"
+        assert parser.parse_args(["--dry-run", "json"]).plan == "json"
+        with pytest.raises(SystemExit):
+            parser.parse_args(["--plan", "yaml"])
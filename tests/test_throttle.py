@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from unittest.mock import patch
+
+from opal_release_downloader._throttle import *
+
+
+class TestThrottle:
+    @patch("opal_release_downloader._throttle.time")
+    def test_token_bucket(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(1000)
+
+        # a full second's worth may burst through
+        assert bucket.reserve(1000) == 0.0
+        # then callers wait until their bytes would have been allowed
+        assert bucket.reserve(500) == pytest.approx(0.5)
+        assert bucket.reserve(500) == pytest.approx(1.0)
+
+        mock_time.monotonic.return_value = 102.0
+        assert bucket.reserve(100) == 0.0
+
+        # idle time refills the bucket, but only up to the burst size
+        mock_time.monotonic.return_value = 200.0
+        assert bucket.reserve(1000) == 0.0
+        assert bucket.reserve(1) > 0
+
+    @patch("opal_release_downloader._throttle.time")
+    def test_token_bucket_consume(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(1000, burst=0)
+
+        bucket.consume(250)
+
+        mock_time.sleep.assert_called_once_with(pytest.approx(0.25))
+
+    def test_token_bucket_invalid_rate(self):
+        with pytest.raises(ValueError):
+            TokenBucket(0)
+
+    @patch("opal_release_downloader._throttle.time")
+    def test_token_bucket_threads(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(1000, burst=0)
+        delays = []
+        lock = threading.Lock()
+
+        def take():
+            for _ in range(100):
+                d = bucket.reserve(10)
+                with lock:
+                    delays.append(d)
+
+        threads = [threading.Thread(target=take) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # 4000 bytes at 1000 B/s: the last caller waits 4s, whatever the order
+        assert max(delays) == pytest.approx(4.0)
+
+    def test_set_max_bandwidth(self):
+        try:
+            assert throttle_delay(10**9) == 0.0
+
+            set_max_bandwidth(1000)
+            assert throttle_delay(1000) == 0.0
+            assert throttle_delay(1000) > 0
+        finally:
+            set_max_bandwidth(None)
+        assert throttle_delay(10**9) == 0.0
+
+    def test_set_cancelled(self):
+        check_cancelled()
+        try:
+            set_cancelled()
+            with pytest.raises(RuntimeError, match="interrupted"):
+                check_cancelled()
+        finally:
+            set_cancelled(False)
+        check_cancelled()
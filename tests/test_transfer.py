@@ -0,0 +1,69 @@
+import hashlib
+import io
+import json
+import os
+
+from unittest.mock import Mock, call
+
+from opal_release_downloader._transfer import *
+
+
+class TestTransfer:
+    def test_hashing_writer(self):
+        data = [b"some ", b"bytes ", b"in order"]
+        mock_f = Mock()
+        mock_f.write.side_effect = [len(d) for d in data]
+
+        writer = HashingWriter(mock_f)
+        written = [writer.write(d) for d in data]
+
+        assert written == [len(d) for d in data]
+        assert mock_f.write.mock_calls == [call(d) for d in data]
+        assert not writer.seekable()
+        assert writer.hexdigest() == hashlib.md5(b"".join(data)).hexdigest()
+
+    def test_hashing_writer_update_from(self):
+        existing = io.BytesIO(b"kept from last time")
+        mock_checkpoint = Mock()
+        mock_f = Mock()
+
+        writer = HashingWriter(mock_f, checkpoint=mock_checkpoint)
+        writer.update_from(existing, 4, block_size=3)
+        writer.write(b" more")
+
+        mock_f.write.assert_called_once_with(b" more")
+        mock_checkpoint.advance.assert_called_once_with(mock_f, 5)
+        assert writer.hexdigest() == hashlib.md5(b"kept more").hexdigest()
+
+    def test_checkpoint_load(self, tmp_path):
+        s3_item = {"Key": "2022.09.07/blind", "Size": 5000, "ETag": '"abc"'}
+        local_name = str(tmp_path / "blind")
+        with open(local_name + ".part", "wb") as f:
+            f.write(bytes(3000))
+        with open(local_name + ".part.json", "w") as f:
+            json.dump(dict(s3_item, ranges=[[0, 1000], [1000, 2000], [2500, 3000]]), f)
+
+        assert Checkpoint(local_name, s3_item).load() == 2000
+        changed = dict(s3_item, ETag='"def"')
+        assert Checkpoint(local_name, changed).load() == 0
+
+    def test_checkpoint_load_missing(self, tmp_path):
+        s3_item = {"Key": "2022.09.07/blind", "Size": 5000}
+        assert Checkpoint(str(tmp_path / "blind"), s3_item).load() == 0
+
+    def test_checkpoint_advance(self, tmp_path):
+        s3_item = {"Key": "2022.09.07/blind", "Size": 5000}
+        local_name = str(tmp_path / "blind")
+        mock_f = Mock()
+
+        checkpoint = Checkpoint(local_name, s3_item, interval=100)
+        checkpoint.advance(mock_f, 60)
+        assert not os.path.exists(checkpoint.path)
+        checkpoint.advance(mock_f, 60)
+
+        mock_f.flush.assert_called_once()
+        with open(checkpoint.path) as f:
+            assert json.load(f)["ranges"] == [[0, 120]]
+
+        checkpoint.remove()
+        assert not os.path.exists(checkpoint.path)
@@ -1,3 +1,6 @@
+import hashlib
+import os
+
 import pytest
 import yaml
 from unittest.mock import patch, Mock, call, ANY
@@ -6,10 +9,11 @@ from opal_release_downloader.verify import *
 
 
 class TestVerify:
+    @patch("opal_release_downloader.verify.time")
     @patch("builtins.open")
     @patch("tqdm.tqdm")
     @patch("hashlib.md5")
-    def test_md5sum(self, mock_hashlib, mock_tqdm, mock_open, mock_os_path):
+    def test_md5sum(self, mock_hashlib, mock_tqdm, mock_open, mock_time, mock_os_path):
         filename = "myfile.parquet"
         hash = Mock()
         file_size = 4939199
@@ -17,37 +21,57 @@ class TestVerify:
 
         mock_hashlib.return_value = hash
         mock_os_path.getsize.return_value = file_size
-        read_bytes = [bytes(4096), bytes(4096), bytes(421), bytes(0)]
+        read_sizes = [DEFAULT_BLOCK_SIZE, DEFAULT_BLOCK_SIZE, 421, 0]
         mock_f = Mock()
-        mock_f.read.side_effect = read_bytes
+        mock_f.readinto.side_effect = read_sizes
         mock_open.return_value.__enter__.return_value = mock_f
         mock_tq = Mock()
         mock_tqdm.return_value.__enter__.return_value = mock_tq
         mock_tqdm.__exit__ = Mock(return_value=True)
         mock_open.__exit__ = Mock(return_value=True)
         hash.hexdigest.return_value = hash_value
+        # the first block is read before the progress interval has passed
+        mock_time.monotonic.side_effect = [0.0, 0.01, 0.2, 0.21]
 
         test_hash_value = md5sum(filename)
 
         mock_hashlib.assert_called_once()
         mock_os_path.getsize.assert_called_once_with(filename)
         mock_tqdm.assert_called_once_with(
-            total=file_size, unit="B", unit_scale=True, desc=filename
+            total=file_size,
+            unit="B",
+            unit_scale=True,
+            desc=filename,
+            position=None,
+            leave=True,
         )
-        assert mock_f.read.mock_calls == [
-            call(4096),
-            call(4096),
-            call(4096),
-            call(4096),
-        ]
-        assert hash.update.mock_calls == [
-            call(read_bytes[0]),
-            call(read_bytes[1]),
-            call(read_bytes[2]),
+        mock_open.assert_called_once_with(filename, "rb", buffering=0)
+        assert mock_f.readinto.call_count == 4
+        buffers = {id(c.args[0]) for c in mock_f.readinto.mock_calls}
+        assert len(buffers) == 1
+        assert [len(c.args[0]) for c in hash.update.mock_calls] == read_sizes[:3]
+        assert mock_tq.update.mock_calls == [
+            call(2 * DEFAULT_BLOCK_SIZE),
+            call(421),
         ]
-        assert mock_tq.update.mock_calls == [call(4096), call(4096), call(421)]
         assert test_hash_value == hash_value
 
+    @patch("tqdm.tqdm")
+    def test_md5sum_file(self, mock_tqdm, tmp_path):
+        data = bytes(range(256)) * 1000
+        filename = tmp_path / "data.bin"
+        filename.write_bytes(data)
+        mock_tq = Mock()
+        mock_tqdm.return_value.__enter__.return_value = mock_tq
+
+        set_block_size(1000)
+        try:
+            assert md5sum(str(filename)) == hashlib.md5(data).hexdigest()
+        finally:
+            set_block_size(DEFAULT_BLOCK_SIZE)
+
+        assert sum(c.args[0] for c in mock_tq.update.mock_calls) == len(data)
+
     @patch("builtins.open")
     def test_read_checksums_from_file(self, mock_open, mock_os_path):
         checksum = "/tmp/hashes/check.md5sum"
@@ -206,30 +230,66 @@ class TestVerify:
         with pytest.raises(Exception) as e:
             op_func(f)
 
-    @patch("opal_release_downloader.verify.md5sum")
-    def test_check_checksums_operator_matching_sum(self, mock_md5sum):
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_verified(self, mock_hash_file):
+        sums = {"other": "akb98434ptiuheg"}
+
+        op_func = check_checksums_operator(sums, True, verified=["docker.tgz"])
+        op_func("docker.tgz")
+        with pytest.raises(Exception):
+            op_func("unverified.tgz")
+
+        mock_hash_file.assert_not_called()
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_matching_sum(self, mock_hash_file):
         f = "other"
         sums = {"other": "akb98434ptiuheg"}
         strict = True
 
-        mock_md5sum.return_value = sums["other"]
+        mock_hash_file.return_value = {"md5": sums["other"]}
         op_func = check_checksums_operator(sums, strict)
         op_func(f)
 
-        mock_md5sum.assert_called_once_with(f)
+        mock_hash_file.assert_called_once_with(f, ["md5"])
 
-    @patch("opal_release_downloader.verify.md5sum")
-    def test_check_checksums_operator_nonmatching_sum(self, mock_md5sum):
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_nonmatching_sum(self, mock_hash_file):
         f = "other"
         sums = {"other": "akb98434ptiuheg"}
         strict = True
 
-        mock_md5sum.return_value = "nonmatching"
+        mock_hash_file.return_value = {"md5": "nonmatching"}
         op_func = check_checksums_operator(sums, strict)
         with pytest.raises(Exception) as e:
             op_func(f)
 
-        mock_md5sum.assert_called_once_with(f)
+        mock_hash_file.assert_called_once_with(f, ["md5"])
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_known_digest(self, mock_hash_file):
+        sums = {"other": "akb98434ptiuheg", "more": "3498tgaiuhg"}
+        digests = {"other": "akb98434ptiuheg"}
+        strict = True
+
+        mock_hash_file.return_value = {"md5": sums["more"]}
+        op_func = check_checksums_operator(sums, strict, digests=digests)
+        op_func("other")
+        op_func("more")
+
+        mock_hash_file.assert_called_once_with("more", ["md5"])
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_known_digest_nonmatching(self, mock_hash_file):
+        sums = {"other": "akb98434ptiuheg"}
+        digests = {"other": "nonmatching"}
+        strict = True
+
+        op_func = check_checksums_operator(sums, strict, digests=digests)
+        with pytest.raises(Exception) as e:
+            op_func("other")
+
+        mock_hash_file.assert_not_called()
 
     @patch("opal_release_downloader.verify.operate_on_files")
     @patch("opal_release_downloader.verify.check_checksums_operator")
@@ -241,7 +301,7 @@ class TestVerify:
         mock_operate_on_files,
     ):
         checksum = "checksums_file.txt"
-        sums = {"test", "blahago8934t98"}
+        sums = {"test": "blahago8934t98"}
         strict = False
         excluded_files = ["another"]
         operator = Mock()
@@ -253,13 +313,140 @@ class TestVerify:
         check_checksums(checksum, excluded_files=excluded_files, strict=strict)
 
         mock_read_checksums_from_file.assert_called_once_with(checksum)
-        mock_check_checksums_operator.assert_called_once_with(sums, strict)
+        mock_check_checksums_operator.assert_called_once_with(
+            {"test": {"md5": "blahago8934t98"}},
+            strict,
+            digests=None,
+            cache=None,
+            stats=None,
+            verified=None,
+        )
         mock_operate_on_files.assert_called_once_with(
             ".",
             operator,
             fail_if_subdirs=fail_if_subdirs,
             excluded_files=excluded_files,
+            snapshot=None,
+        )
+
+    def test_cached_digest(self, tmp_path):
+        f = tmp_path / "file.data"
+        f.write_bytes(b"some data")
+        st = os.stat(f)
+        cache = {str(f): cache_entry(st, "akb98434ptiuheg")}
+
+        assert cached_digest(cache, str(f), st) == "akb98434ptiuheg"
+        assert cached_digest(cache, "other", st) is None
+
+        f.write_bytes(b"changed data")
+        assert cached_digest(cache, str(f), os.stat(f)) is None
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_cache(self, mock_hash_file, tmp_path):
+        (tmp_path / "cached").write_bytes(b"cached")
+        (tmp_path / "stale").write_bytes(b"stale")
+        (tmp_path / "new").write_bytes(b"new")
+        cached = str(tmp_path / "cached")
+        stale = str(tmp_path / "stale")
+        new = str(tmp_path / "new")
+        sums = {cached: "1111", stale: "2222", new: "3333"}
+        cache = {
+            cached: cache_entry(os.stat(cached), "1111"),
+            stale: dict(cache_entry(os.stat(stale), "9999"), size=1),
+        }
+
+        mock_hash_file.side_effect = [{"md5": "2222"}, {"md5": "3333"}]
+        op_func = check_checksums_operator(sums, True, cache=cache)
+        for f in (cached, stale, new):
+            op_func(f)
+
+        assert mock_hash_file.mock_calls == [call(stale, ["md5"]), call(new, ["md5"])]
+        for f in (cached, stale, new):
+            assert cache[f] == cache_entry(os.stat(f), sums[f])
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_slots(self, mock_hash_file):
+        sums = {"other": "akb98434ptiuheg"}
+        mock_hash_file.return_value = {"md5": sums["other"]}
+
+        op_func = check_checksums_operator(sums, True, slots=ProgressSlots(1))
+        op_func("other")
+
+        mock_hash_file.assert_called_once_with("other", ["md5"], position=0)
+
+    def test_operate_on_files_parallel(self):
+        files = [f"f{i}" for i in range(20)]
+        files_operated = []
+
+        operate_on_files_parallel(files, files_operated.append, 4)
+
+        assert sorted(files_operated) == sorted(files)
+
+    def test_operate_on_files_parallel_failures(self):
+        files = [f"f{i}" for i in range(20)]
+        files_operated = []
+
+        def dummy_func(f):
+            files_operated.append(f)
+            if f in ("f7", "f13", "f2"):
+                raise Exception(f"bad {f}")
+
+        with pytest.raises(Exception) as e:
+            operate_on_files_parallel(files, dummy_func, 4)
+
+        assert sorted(files_operated) == sorted(files)
+        assert str(e.value).splitlines() == [
+            "3 file(s) failed verification",
+            "f13: bad f13",
+            "f2: bad f2",
+            "f7: bad f7",
+        ]
+
+    @patch("opal_release_downloader.verify.write")
+    @patch("builtins.print")
+    @patch("opal_release_downloader.verify.operate_on_files_parallel")
+    @patch("opal_release_downloader.verify.operate_on_files")
+    @patch("opal_release_downloader.verify.check_checksums_operator")
+    @patch("opal_release_downloader.verify.read_checksums_from_file")
+    def test_check_checksums_parallel(
+        self,
+        mock_read_checksums_from_file,
+        mock_check_checksums_operator,
+        mock_operate_on_files,
+        mock_operate_on_files_parallel,
+        mock_print,
+        mock_write,
+        mock_os_path,
+    ):
+        checksum = "checksums_file.txt"
+        sums = {"f1": "blahago8934t98", "f2": "3q948thaoseiht"}
+        operator = Mock()
+
+        mock_read_checksums_from_file.return_value = sums
+        mock_check_checksums_operator.return_value = operator
+        mock_os_path.getsize.return_value = 1000
+
+        def walk(root_dir, op, fail_if_subdirs, excluded_files, snapshot):
+            for f in sums:
+                op(f)
+
+        mock_operate_on_files.side_effect = walk
+
+        check_checksums(checksum, excluded_files=[checksum], jobs=3)
+
+        mock_check_checksums_operator.assert_called_once_with(
+            {f: {"md5": s} for f, s in sums.items()},
+            True,
+            digests=None,
+            slots=ANY,
+            cache=None,
+            stats=None,
+            verified=None,
+        )
+        mock_operate_on_files_parallel.assert_called_once_with(
+            ["f1", "f2"], operator, 3
         )
+        assert "verified 2 files" in mock_write.call_args.args[0]
 
     @patch("opal_release_downloader.verify.tqdm")
     def test_check_manifest_operator(self, mock_tqdm):
@@ -320,6 +507,7 @@ class TestVerify:
             fail_if_subdirs=True,
             excluded_files=excluded_files,
             expected_files=expected_files,
+            snapshot=None,
         )
 
     @patch("opal_release_downloader.verify.operate_on_files")
@@ -373,6 +561,7 @@ class TestVerify:
             fail_if_subdirs=True,
             excluded_files=excluded_files,
             expected_files=expected_files,
+            snapshot=None,
         )
 
     def test_find_file_and_confirm_no_search_or_fname(self):
@@ -474,6 +663,11 @@ class TestVerify:
         mock_os_path.exists.assert_called_once_with(directory)
         mock_os_path.isdir.assert_called_once_with(directory)
 
+    @patch("opal_release_downloader.verify.check_sizes")
+    @patch("opal_release_downloader.verify.read_expected_sizes")
+    @patch("opal_release_downloader.verify.scan_directory")
+    @patch("opal_release_downloader.verify.save_record")
+    @patch("opal_release_downloader.verify.load_record")
     @patch("opal_release_downloader.verify.check_checksums")
     @patch("opal_release_downloader.verify.check_manifest")
     @patch("opal_release_downloader.verify.find_file_and_confirm")
@@ -482,6 +676,11 @@ class TestVerify:
         mock_find_file,
         mock_check_manifest,
         mock_check_checksums,
+        mock_load_record,
+        mock_save_record,
+        mock_scan_directory,
+        mock_read_expected_sizes,
+        mock_check_sizes,
         mock_os_getcwd,
         mock_os_path,
         mock_os_chdir,
@@ -515,17 +714,36 @@ class TestVerify:
             call("md5sums_*", file_name=checksum, search=search),
             call("file_manifest_*.yml", file_name=manifest, search=search),
         ]
-        mock_check_manifest.assert_called_once_with(manifest, excluded_files=[checksum])
+        mock_check_manifest.assert_called_once_with(
+            manifest,
+            excluded_files=[checksum, ".opal_fetch.json", ".opal_verify_cache.json"],
+            snapshot=mock_scan_directory.return_value,
+        )
+        mock_scan_directory.assert_called_once_with(".")
+        mock_read_expected_sizes.assert_called_once_with(manifest, None)
+        mock_check_sizes.assert_called_once_with(
+            mock_read_expected_sizes.return_value, mock_scan_directory.return_value
+        )
         mock_check_checksums(
             checksum, excluded_files=[checksum], strict=strict_checksum
         )
 
+    @patch("opal_release_downloader.verify.check_sizes")
+    @patch("opal_release_downloader.verify.read_expected_sizes")
+    @patch("opal_release_downloader.verify.scan_directory")
+    @patch("opal_release_downloader.verify.save_record")
+    @patch("opal_release_downloader.verify.load_record")
     @patch("opal_release_downloader.verify.check_checksums")
     @patch("opal_release_downloader.verify.find_file_and_confirm")
     def test_verify_directory_no_require_manifest(
         self,
         mock_find_file,
         mock_check_checksums,
+        mock_load_record,
+        mock_save_record,
+        mock_scan_directory,
+        mock_read_expected_sizes,
+        mock_check_sizes,
         mock_os_getcwd,
         mock_os_path,
         mock_os_chdir,
@@ -561,3 +779,315 @@ class TestVerify:
         mock_check_checksums(
             checksum, excluded_files=[checksum], strict=strict_checksum
         )
+
+    @pytest.mark.parametrize("rehash", [False, True])
+    @patch("opal_release_downloader.verify.check_sizes")
+    @patch("opal_release_downloader.verify.read_expected_sizes")
+    @patch("opal_release_downloader.verify.scan_directory")
+    @patch("opal_release_downloader.verify.save_record")
+    @patch("opal_release_downloader.verify.load_record")
+    @patch("opal_release_downloader.verify.check_checksums")
+    @patch("opal_release_downloader.verify.find_file_and_confirm")
+    def test_verify_directory_cache(
+        self,
+        mock_find_file,
+        mock_check_checksums,
+        mock_load_record,
+        mock_save_record,
+        mock_scan_directory,
+        mock_read_expected_sizes,
+        mock_check_sizes,
+        mock_os_getcwd,
+        mock_os_path,
+        mock_os_chdir,
+        rehash,
+    ):
+        checksum = "checksum.txt"
+        cached = {"size": 1, "mtime_ns": 2, "inode": 3, "md5": "1111"}
+        mock_os_path.exists.return_value = True
+        mock_os_path.isdir.return_value = True
+        mock_scan_directory.return_value = {"kept": Mock(), "new": Mock()}
+        mock_find_file.return_value = checksum
+        mock_load_record.return_value = {"kept": cached, "removed": cached}
+
+        def check(checksum, **kwargs):
+            kwargs["cache"]["new"] = cached
+
+        mock_check_checksums.side_effect = check
+
+        verify_directory(
+            "/home/Sprocket/files",
+            checksum=checksum,
+            require_manifest=False,
+            rehash=rehash,
+        )
+
+        if rehash:
+            mock_load_record.assert_not_called()
+            mock_save_record.assert_called_once_with(
+                ".opal_verify_cache.json", {"new": cached}
+            )
+        else:
+            mock_load_record.assert_called_once_with(".opal_verify_cache.json")
+            mock_save_record.assert_called_once_with(
+                ".opal_verify_cache.json", {"kept": cached, "new": cached}
+            )
+
+    def test_scan_directory(self, tmp_path):
+        (tmp_path / "a.tar.gz").write_bytes(b"aaaa")
+        (tmp_path / "md5sums").write_bytes(b"")
+
+        snapshot = scan_directory(str(tmp_path))
+
+        assert sorted(snapshot) == ["a.tar.gz", "md5sums"]
+        assert snapshot["a.tar.gz"].st_size == 4
+
+        (tmp_path / "subdir").mkdir()
+        with pytest.raises(Exception) as e:
+            scan_directory(str(tmp_path))
+        assert "unexpected directory layout" in str(e.value)
+
+    def test_operate_on_files_snapshot(self, mock_os_walk):
+        files_operated = []
+        snapshot = {"one": Mock(), "two": Mock(), "excluded": Mock()}
+
+        operate_on_files(
+            ".",
+            files_operated.append,
+            fail_if_subdirs=True,
+            excluded_files=["excluded"],
+            snapshot=snapshot,
+        )
+
+        mock_os_walk.assert_not_called()
+        assert files_operated == ["one", "two"]
+
+    def test_verify_directory_files(self, tmp_path):
+        manifest = b"- a.tar.gz\n- file_manifest_x.yml\n"
+        (tmp_path / "a.tar.gz").write_bytes(b"aaaa")
+        (tmp_path / "file_manifest_x.yml").write_bytes(manifest)
+        (tmp_path / "md5sums_x").write_text(
+            f"{hashlib.md5(b'aaaa').hexdigest()}  a.tar.gz\n"
+            f"{hashlib.md5(manifest).hexdigest()}  file_manifest_x.yml\n"
+        )
+
+        with patch("builtins.print"):
+            verify_directory(str(tmp_path), search=True)
+
+        assert os.path.exists(tmp_path / ".opal_verify_cache.json")
+
+    def test_verify_directory_partial_downloads(self, tmp_path):
+        manifest = b"- a.tar.gz\n- file_manifest_x.yml\n"
+        (tmp_path / "a.tar.gz").write_bytes(b"aaaa")
+        (tmp_path / "file_manifest_x.yml").write_bytes(manifest)
+        (tmp_path / "md5sums_x").write_text(
+            f"{hashlib.md5(b'aaaa').hexdigest()}  a.tar.gz\n"
+            f"{hashlib.md5(manifest).hexdigest()}  file_manifest_x.yml\n"
+        )
+        # left by interrupted downloads
+        (tmp_path / "a.tar.gz.part").write_bytes(b"aa")
+        (tmp_path / "a.tar.gz.part.json").write_text("{}")
+        (tmp_path / "md5sums_x.part").write_text("")
+
+        with patch("builtins.print"), patch(
+            "opal_release_downloader.verify.warn"
+        ) as mock_warn:
+            verify_directory(str(tmp_path), search=True)
+
+        assert mock_warn.call_count == 3
+
+    @patch("opal_release_downloader.verify.save_record")
+    def test_verify_directory_read_only(self, mock_save_record, tmp_path):
+        (tmp_path / "a.tar.gz").write_bytes(b"aaaa")
+        (tmp_path / "md5sums_x").write_text(
+            f"{hashlib.md5(b'aaaa').hexdigest()}  a.tar.gz\n"
+        )
+        mock_save_record.side_effect = OSError("Read-only file system")
+
+        with patch("builtins.print"):
+            verify_directory(str(tmp_path), search=True, require_manifest=False)
+
+        mock_save_record.assert_called_once()
+
+    @patch("opal_release_downloader.verify.save_record")
+    def test_verify_directory_read_only_failure(self, mock_save_record, tmp_path):
+        (tmp_path / "a.tar.gz").write_bytes(b"aaaa")
+        (tmp_path / "md5sums_x").write_text(f"{'0' * 32}  a.tar.gz\n")
+        mock_save_record.side_effect = OSError("Read-only file system")
+
+        with patch("builtins.print"), pytest.raises(Exception) as e:
+            verify_directory(str(tmp_path), search=True, require_manifest=False)
+
+        # the verification failure, not the failed cache write
+        assert "checksum" in str(e.value)
+
+    @patch("tqdm.tqdm")
+    def test_hash_file(self, mock_tqdm, tmp_path):
+        data = os.urandom(3 * 1024 + 17)
+        filename = tmp_path / "data.bin"
+        filename.write_bytes(data)
+
+        with patch("builtins.open", wraps=open) as mock_open:
+            digests = hash_file(str(filename), ["md5", "sha256", "blake2b"])
+
+        mock_open.assert_called_once()
+        assert digests == {
+            "md5": hashlib.md5(data).hexdigest(),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "blake2b": hashlib.blake2b(data).hexdigest(),
+        }
+
+    def test_checksum_algorithm(self):
+        assert checksum_algorithm("md5sums_2023.01.02", {}) == "md5"
+        assert checksum_algorithm("sha256sums_2023.01.02", {}) == "sha256"
+        assert checksum_algorithm("b2sums_2023.01.02", {}) == "blake2b"
+        # any other name is told by its digests
+        assert checksum_algorithm("md5checksum", {"a": "0" * 32}) == "md5"
+        assert checksum_algorithm("checksums", {"a": "0" * 64}) == "sha256"
+        assert checksum_algorithm("checksums", {"a": "0" * 64, "b": "0"}) == "md5"
+
+    def test_read_checksums(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "md5sums_x").write_text(f"{'a' * 32}  a.tar.gz\n")
+        (tmp_path / "sha256sums_x").write_text(
+            f"{'B' * 64} *a.tar.gz\n{'c' * 64}  b.tar.gz\n"
+        )
+
+        sums = read_checksums(["md5sums_x", "sha256sums_x"])
+
+        assert sums == {
+            "a.tar.gz": {"md5": "a" * 32, "sha256": "b" * 64},
+            "b.tar.gz": {"sha256": "c" * 64},
+        }
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_multiple(self, mock_hash_file, tmp_path):
+        (tmp_path / "a").write_bytes(b"a")
+        f = str(tmp_path / "a")
+        sums = {f: {"md5": "1111", "sha256": "2222"}}
+        cache = {}
+
+        mock_hash_file.return_value = {"sha256": "2222"}
+        op_func = check_checksums_operator(sums, True, digests={f: "1111"}, cache=cache)
+        op_func(f)
+
+        # the md5 is already known, so the file is only read for its sha256
+        mock_hash_file.assert_called_once_with(f, ["sha256"])
+        assert cached_digests(cache, f, os.stat(f)) == sums[f]
+
+        mock_hash_file.reset_mock()
+        op_func = check_checksums_operator(sums, True, cache=cache)
+        op_func(f)
+
+        mock_hash_file.assert_not_called()
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_check_checksums_operator_multiple_nonmatching(self, mock_hash_file):
+        sums = {"a": {"md5": "1111", "sha256": "2222"}}
+
+        mock_hash_file.return_value = {"md5": "1111", "sha256": "9999"}
+        op_func = check_checksums_operator(sums, True)
+        with pytest.raises(Exception) as e:
+            op_func("a")
+
+        mock_hash_file.assert_called_once_with("a", ["md5", "sha256"])
+        assert "9999" in str(e.value)
+
+    def test_find_checksum_files(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "sha256sums_x").write_text("")
+        (tmp_path / "md5sums_x").write_text("")
+
+        assert find_checksum_files(search=True) == ["md5sums_x", "sha256sums_x"]
+        assert find_checksum_files("md5sums_x") == ["md5sums_x"]
+        assert find_checksum_files(["sha256sums_x"]) == ["sha256sums_x"]
+
+        (tmp_path / "md5sums_y").write_text("")
+        with pytest.raises(Exception):
+            find_checksum_files(search=True)
+
+    def test_find_checksum_files_none(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        with pytest.raises(Exception) as e:
+            find_checksum_files(search=True)
+
+        assert str(e.value) == "Unable to find checksum file"
+
+    def test_checksum_files(self):
+        names = ["a.tar.gz", "sha256sums_x", "md5sums_x", "b2sums_x", "md5checksum"]
+
+        assert checksum_files(names) == ["b2sums_x", "md5sums_x", "sha256sums_x"]
+
+    def test_verify_directory_sha256(self, tmp_path):
+        manifest = b"- a.tar.gz\n- file_manifest_x.yml\n"
+        (tmp_path / "a.tar.gz").write_bytes(b"aaaa")
+        (tmp_path / "file_manifest_x.yml").write_bytes(manifest)
+        (tmp_path / "sha256sums_x").write_text(
+            f"{hashlib.sha256(b'aaaa').hexdigest()}  a.tar.gz\n"
+            f"{hashlib.sha256(manifest).hexdigest()}  file_manifest_x.yml\n"
+        )
+        (tmp_path / "md5sums_x").write_text(
+            f"{hashlib.md5(b'aaab').hexdigest()}  a.tar.gz\n"
+        )
+
+        with patch("builtins.print"), pytest.raises(Exception) as e:
+            verify_directory(str(tmp_path), search=True)
+
+        # both checksum files are checked
+        assert 'file "a.tar.gz" checksum' in str(e.value)
+
+        (tmp_path / "md5sums_x").unlink()
+        with patch("builtins.print"):
+            verify_directory(str(tmp_path), search=True)
+
+    def test_check_sizes(self):
+        snapshot = {"a": Mock(st_size=4), "b": Mock(st_size=2), "c": Mock(st_size=9)}
+
+        check_sizes({"a": 4, "b": 2, "missing": 7}, snapshot)
+        with pytest.raises(Exception) as e:
+            check_sizes({"a": 4, "b": 3, "c": "10"}, snapshot)
+
+        assert str(e.value) == (
+            "2 file(s) have the wrong size\n"
+            "b: 2 bytes, expected 3\n"
+            "c: 9 bytes, expected 10"
+        )
+
+    @patch("opal_release_downloader.verify.load_record")
+    def test_read_expected_sizes(self, mock_load_record, tmp_path):
+        manifest = tmp_path / "file_manifest.yml"
+        manifest.write_text("a.tar.gz: 10\nb.tar.gz: 20\nc.tar.gz:\n")
+        mock_load_record.return_value = {
+            "a.tar.gz": {"Key": "2022.10.31/a.tar.gz", "Size": 1},
+            "d.tar.gz": {"Key": "2022.10.31/d.tar.gz", "Size": 4},
+        }
+
+        sizes = read_expected_sizes(str(manifest), {"b.tar.gz": 30})
+
+        mock_load_record.assert_called_once_with(".opal_fetch.json")
+        assert sizes == {"a.tar.gz": 10, "b.tar.gz": 30, "d.tar.gz": 4}
+
+    @patch("opal_release_downloader.verify.load_record")
+    def test_read_expected_sizes_listed_manifest(self, mock_load_record, tmp_path):
+        manifest = tmp_path / "file_manifest.yml"
+        manifest.write_text("- a.tar.gz\n- b.tar.gz\n")
+        mock_load_record.return_value = {}
+
+        assert read_expected_sizes(str(manifest)) == {}
+
+    @patch("opal_release_downloader.verify.hash_file")
+    def test_verify_directory_wrong_size(self, mock_hash_file, tmp_path):
+        (tmp_path / "a.tar.gz").write_bytes(b"aa")
+        (tmp_path / "md5sums_x").write_text("0cc175b9c0f1b6a8  a.tar.gz\n")
+
+        with pytest.raises(Exception) as e:
+            verify_directory(
+                str(tmp_path),
+                search=True,
+                require_manifest=False,
+                sizes={"a.tar.gz": 4},
+            )
+
+        assert "a.tar.gz: 2 bytes, expected 4" in str(e.value)
+        mock_hash_file.assert_not_called()